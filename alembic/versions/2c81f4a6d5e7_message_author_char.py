@@ -0,0 +1,36 @@
+"""Store messages.author as CHAR(1)
+
+Revision ID: 2c81f4a6d5e7
+Revises: e51a9c3b7d20
+Create Date: 2026-10-15 15:48:20.661093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c81f4a6d5e7'
+down_revision: Union[str, None] = 'e51a9c3b7d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 'USER' -> 'u', 'BOT' -> 'b'
+    op.alter_column('messages', 'author',
+                    type_=sa.CHAR(1),
+                    postgresql_using="lower(left(author::text, 1))")
+    sa.Enum(name='messageauthor').drop(op.get_bind(), checkfirst=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    message_author = sa.Enum('USER', 'BOT', name='messageauthor')
+    message_author.create(op.get_bind(), checkfirst=True)
+    op.alter_column('messages', 'author',
+                    type_=message_author,
+                    postgresql_using="(CASE author WHEN 'u' THEN 'USER' ELSE 'BOT' END)::messageauthor")
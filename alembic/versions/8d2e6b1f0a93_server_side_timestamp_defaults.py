@@ -0,0 +1,35 @@
+"""Fill created_at/updated_at on the database side
+
+Revision ID: 8d2e6b1f0a93
+Revises: 3f9c2a7d41b8
+Create Date: 2026-10-15 14:02:17.530264
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2e6b1f0a93'
+down_revision: Union[str, None] = '3f9c2a7d41b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('source_documents', 'text_chunks', 'messages')
+COLUMNS = ('created_at', 'updated_at')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in TABLES:
+        for column in COLUMNS:
+            op.alter_column(table, column, server_default=sa.text('now()'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        for column in COLUMNS:
+            op.alter_column(table, column, server_default=None)
@@ -0,0 +1,29 @@
+"""Replace the text_chunks source_document_id index with (source_document_id, sequence_in_document)
+
+Revision ID: b47c0e5d92f1
+Revises: 8d2e6b1f0a93
+Create Date: 2026-10-15 14:31:05.117842
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b47c0e5d92f1'
+down_revision: Union[str, None] = '8d2e6b1f0a93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_chunk_doc_seq', 'text_chunks', ['source_document_id', 'sequence_in_document'], unique=False)
+    op.drop_index(op.f('ix_text_chunks_source_document_id'), table_name='text_chunks')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(op.f('ix_text_chunks_source_document_id'), 'text_chunks', ['source_document_id'], unique=False)
+    op.drop_index('ix_chunk_doc_seq', table_name='text_chunks')
@@ -0,0 +1,42 @@
+"""Store metadata_json / retrieved_chunk_ids as JSONB and index chunk metadata
+
+Revision ID: e51a9c3b7d20
+Revises: b47c0e5d92f1
+Create Date: 2026-10-15 15:06:44.902371
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e51a9c3b7d20'
+down_revision: Union[str, None] = 'b47c0e5d92f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column('text_chunks', 'metadata_json',
+                    type_=postgresql.JSONB(astext_type=sa.Text()),
+                    postgresql_using='metadata_json::jsonb')
+    op.alter_column('messages', 'retrieved_chunk_ids',
+                    type_=postgresql.JSONB(astext_type=sa.Text()),
+                    postgresql_using='retrieved_chunk_ids::jsonb')
+    op.create_index('ix_chunk_meta_gin', 'text_chunks', ['metadata_json'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'metadata_json': 'jsonb_path_ops'})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_chunk_meta_gin', table_name='text_chunks', postgresql_using='gin')
+    op.alter_column('messages', 'retrieved_chunk_ids',
+                    type_=sa.JSON(),
+                    postgresql_using='retrieved_chunk_ids::json')
+    op.alter_column('text_chunks', 'metadata_json',
+                    type_=sa.JSON(),
+                    postgresql_using='metadata_json::json')
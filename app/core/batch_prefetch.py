@@ -0,0 +1,71 @@
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# 构造模型输入（填充、转张量）的后台线程，Embedding 与 Reranker 共用
+_batch_builder = ThreadPoolExecutor(max_workers=2, thread_name_prefix="batch-builder")
+
+
+def prefetch_batches(build: Callable[[T], R], items: Iterable[T]) -> Iterator[R]:
+    """
+    依次产出 build(item) 的结果，并在后台线程中提前构造下一个批次：
+    调用方对第 N 批执行模型前向时，第 N+1 批的 CPU 预处理已经在进行。
+    """
+    iterator = iter(items)
+    try:
+        future = _batch_builder.submit(build, next(iterator))
+    except StopIteration:
+        return
+    for item in iterator:
+        next_future = _batch_builder.submit(build, item)
+        yield future.result()
+        future = next_future
+    yield future.result()
+
+
+def pin_for_device(tensors: dict, device) -> dict:
+    """
+    目标设备为 CUDA 时把 CPU 张量放入锁页内存（在后台构造线程中调用），
+    这样后续 non_blocking 拷贝才是真正的异步 DMA；MPS/CPU 上原样返回。
+    """
+    if device is None or device.type != "cuda":
+        return dict(tensors)
+    return {k: v.pin_memory() for k, v in tensors.items()}
+
+
+def move_to_device(tensors: dict, device) -> dict:
+    """把一个批次的输入张量拷到模型所在设备，CUDA 上使用非阻塞拷贝。"""
+    non_blocking = device.type == "cuda"
+    return {k: v.to(device, non_blocking=non_blocking) for k, v in tensors.items()}
+
+
+def length_bucketed_batches(
+    sorted_indices: list[int],
+    lengths: list[int],
+    max_batch_size: int,
+    max_length_ratio: float,
+) -> list[list[int]]:
+    """
+    把已按长度升序排列的下标切分成小批次：每批最多 max_batch_size 条，
+    且批内最长与最短序列的长度比不超过 max_length_ratio（<= 0 时不限制），
+    避免长短差异大的序列被填充到同一长度，浪费的计算量与填充量成正比。
+    """
+    batches: list[list[int]] = []
+    batch: list[int] = []
+    for index in sorted_indices:
+        if batch and (
+            len(batch) >= max_batch_size
+            or (
+                max_length_ratio > 0
+                and lengths[index] > max_length_ratio * lengths[batch[0]]
+            )
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
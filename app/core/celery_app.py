@@ -1,4 +1,5 @@
 from celery import Celery
+
 from app.core.config import settings
 
 
@@ -22,8 +23,20 @@ celery_app.conf.update(
     timezone="Asia/Shanghai",
     enable_utc=True,
     result_expires=3600,
-    task_routes={"app.tasks.document_task.*": {"queue": "document_queue"}},
+    # 文档入库（解析、切块、向量化）是 CPU 密集型，走 document_queue，由 prefork 进程池处理；
+    # 查询任务耗时短，单独走 query_queue，不会排在大文档后面
+    task_routes={
+        "app.tasks.document_task.process_document_task": {"queue": "document_queue"},
+        "app.tasks.document_task.process_query_task": {"queue": "query_queue"},
+    },
+    # 入库任务耗时长且差异大，每个子进程一次只预取一个任务，避免任务堆积在忙碌的进程上
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
 )
 
 
-# uv run celery -A app.core.celery_app worker --loglevel=info --pool=threads -Q celery,document_queue --autoscale=4,2
+# 文档入库 worker：prefork 多进程绕开 GIL，并发数按 CPU 核数与内存设置（每个子进程各自加载 Embedding 模型），
+# 此时跨文档已经并行；prefork 子进程是守护进程，单个文档内部的进程池会自动停用，改为串行处理
+# uv run celery -A app.core.celery_app worker --loglevel=info --pool=prefork -Q celery,document_queue --concurrency=4
+# 查询 worker：
+# uv run celery -A app.core.celery_app worker --loglevel=info --pool=threads -Q query_queue --concurrency=4
@@ -1,45 +1,181 @@
+import asyncio
+import re
+import threading
+import weakref
+
 import chromadb
+import numpy as np
+from chromadb.config import Settings as ChromaSettings
 from loguru import logger
 
 from app.core.config import settings
 
 
 chroma_client = None
+chroma_collection = None
+# 保护同步客户端和集合的初始化，多个线程同时首次调用时只创建一次
+_chroma_init_lock = threading.Lock()
 
+# 客户端设置：关闭匿名遥测，避免每次请求额外的上报开销
+_chroma_client_settings = ChromaSettings(anonymized_telemetry=False)
+
+
+def _search_ef() -> int:
+    # 默认 search_ef 为 10，小于第一阶段召回的 top_k 时 HNSW 会漏掉大量近邻
+    return max(settings.CHROMA_HNSW_SEARCH_EF, settings.INITIAL_RETRIEVAL_TOP_K)
+
+
+def _collection_metadata() -> dict:
+    """
+    集合创建时使用的元数据，包括距离度量和 HNSW 索引参数。
+    注意这些参数只在集合首次创建时生效，修改后需要重建集合；
+    search_ef 例外，获取集合后由 _search_ef_update 检查并更新已有集合。
+    """
+    return {
+        "hnsw:space": "cosine",  # 指定距离度量方法
+        "hnsw:construction_ef": settings.CHROMA_HNSW_CONSTRUCTION_EF,
+        "hnsw:M": settings.CHROMA_HNSW_M,
+        "hnsw:search_ef": _search_ef(),
+        # 新向量先进入暴力搜索缓冲区，攒够 batch_size 个后再批量插入 HNSW 图
+        "hnsw:batch_size": settings.CHROMA_HNSW_BATCH_SIZE,
+        "hnsw:sync_threshold": settings.CHROMA_HNSW_SYNC_THRESHOLD,
+        "embedding_dimensions": settings.EMBEDDING_DIMENSIONS,  # 显式声明嵌入维度, Qwen 0.6B为1024
+    }
+
+
+def _search_ef_update(collection) -> dict | None:
+    """
+    已有集合的 search_ef 与配置不一致时，返回传给 collection.modify 的 configuration；
+    一致时返回 None。新版集合把参数保存在 configuration 中，旧集合只保存在元数据中。
+    """
+    hnsw_config = (collection.configuration_json or {}).get("hnsw") or {}
+    current = hnsw_config.get("ef_search")
+    if current is None:
+        current = (collection.metadata or {}).get("hnsw:search_ef", 10)
+    if current == _search_ef():
+        return None
+    logger.info(f"ChromaDB 集合的 search_ef 为 {current}，更新为 {_search_ef()}")
+    return {"hnsw": {"ef_search": _search_ef()}}
+
+
+_INTEGER_ID_PATTERN = re.compile(r"^-?\d+$")
+
+
+def chroma_ids_to_pg_ids(chroma_ids: list[str]) -> list[int]:
+    """
+    把 ChromaDB 返回的字符串 ID 转换为 PostgreSQL 主键。
+    正常情况下一次 NumPy 转换完成；出现无法解析的 ID 时才逐个过滤，记录并跳过这些 ID。
+    """
+    try:
+        return np.asarray(chroma_ids, dtype=np.int64).tolist()
+    except ValueError:
+        valid_ids = list(filter(_INTEGER_ID_PATTERN.match, chroma_ids))
+        logger.warning(
+            f"无法将 ChromaDB 中检索到的 ID {sorted(set(chroma_ids) - set(valid_ids))} 转换为整数。已跳过。"
+        )
+        return np.asarray(valid_ids, dtype=np.int64).tolist()
+
+
+def init_chroma_client() -> None:
+    """
+    创建进程内共享的同步客户端并获取集合，由 get_chroma_collection 首次调用时触发。
+    """
+    global chroma_client, chroma_collection
+    with _chroma_init_lock:
+        if chroma_collection is not None:
+            return
+        if chroma_client is None:
+            try:
+                # 如果 Celery worker 与 ChromaDB Docker 容器在同一个 Docker 网络中，
+                # 可以直接使用容器名和容器端口，例如 http://chromadb:8000
+                # 如果 Celery worker 运行在宿主机，则使用宿主机IP/localhost 和映射的端口 5500
+                # settings.CHROMA_HTTP_ENDPOINT = "http://localhost:5500"
+                chroma_client = chromadb.HttpClient(
+                    settings.CHROMA_HTTP_ENDPOINT, settings=_chroma_client_settings
+                )
+                logger.info(f"ChromaDB 客户端已连接到: {settings.CHROMA_HTTP_ENDPOINT}")
+            except Exception as e:
+                logger.error(
+                    f"连接 ChromaDB 失败 ({settings.CHROMA_HTTP_ENDPOINT}): {e}",
+                    exc_info=True,
+                )
+                raise RuntimeError("无法连接到 ChromaDB") from e
 
-def get_chroma_collection():
-    """获取或创建 ChromaDB 集合的辅助函数。"""
-    global chroma_client
-    if chroma_client is None:
         try:
-            # 如果 Celery worker 与 ChromaDB Docker 容器在同一个 Docker 网络中，
-            # 可以直接使用容器名和容器端口，例如 http://chromadb:8000
-            # 如果 Celery worker 运行在宿主机，则使用宿主机IP/localhost 和映射的端口 5500
-            # settings.CHROMA_HTTP_ENDPOINT = "http://localhost:5500"
-            chroma_client = chromadb.HttpClient(settings.CHROMA_HTTP_ENDPOINT)
-            logger.info(f"ChromaDB 客户端已连接到: {settings.CHROMA_HTTP_ENDPOINT}")
+            # settings.CHROMA_COLLECTION_NAME 是你在配置文件中定义的集合名称，例如 "rag_collection"
+            # 我们手动生成向量，因此不指定 embedding_function
+            chroma_collection = chroma_client.get_or_create_collection(
+                name=settings.CHROMA_COLLECTION_NAME,
+                metadata=_collection_metadata(),
+            )
+            logger.info(f"已获取或创建 ChromaDB 集合: {settings.CHROMA_COLLECTION_NAME}")
         except Exception as e:
             logger.error(
-                f"连接 ChromaDB 失败 ({settings.CHROMA_HTTP_ENDPOINT}): {e}",
+                f"获取或创建 ChromaDB 集合 '{settings.CHROMA_COLLECTION_NAME}' 失败: {e}",
                 exc_info=True,
             )
-            raise RuntimeError("无法连接到 ChromaDB") from e
+            raise RuntimeError("无法获取或创建 ChromaDB 集合") from e
+
+        try:
+            if (configuration := _search_ef_update(chroma_collection)) is not None:
+                chroma_collection.modify(configuration=configuration)
+        except Exception as e:
+            # 更新失败不影响使用，只是召回率仍受旧的 search_ef 限制
+            logger.warning(f"更新 ChromaDB 集合的 search_ef 失败: {e}")
+
+
+def get_chroma_collection():
+    """获取或创建 ChromaDB 集合的辅助函数。集合对象在进程内缓存，不再每次调用都请求服务端。"""
+    if chroma_collection is None:
+        init_chroma_client()
+    return chroma_collection
+
+
+# 异步客户端内部的 httpx 连接池绑定在创建它的事件循环上，
+# 因此按事件循环缓存：FastAPI 进程内全程复用同一个；
+# Celery 线程池中每个线程的事件循环各自持有一个，循环被回收后对应条目自动消失
+_async_collections: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, object]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+async def get_chroma_async_collection():
+    """获取或创建 ChromaDB 集合的异步版本，直接使用 AsyncHttpClient 的原生异步接口。"""
+    loop = asyncio.get_running_loop()
+    cached_collection = _async_collections.get(loop)
+    if cached_collection is not None:
+        return cached_collection
 
     try:
-        # settings.CHROMA_COLLECTION_NAME 是你在配置文件中定义的集合名称，例如 "rag_collection"
-        # 你也可以为 bce-embedding 模型指定 embedding_function，但由于我们手动生成，可以不指定
-        collection = chroma_client.get_or_create_collection(
-            name=settings.CHROMA_COLLECTION_NAME,            
-            metadata={
-                "hnsw:space": "cosine",  # 指定距离度量方法
-                "embedding_dimensions": settings.EMBEDDING_DIMENSIONS,  # 显式声明嵌入维度, Qwen 0.6B为1024
-            },
+        async_client = await chromadb.AsyncHttpClient(
+            settings.CHROMA_HTTP_ENDPOINT, settings=_chroma_client_settings
         )
-        logger.info(f"已获取或创建 ChromaDB 集合: {settings.CHROMA_COLLECTION_NAME}")
-        return collection
+        logger.info(f"ChromaDB 异步客户端已连接到: {settings.CHROMA_HTTP_ENDPOINT}")
+    except Exception as e:
+        logger.error(
+            f"连接 ChromaDB 失败 ({settings.CHROMA_HTTP_ENDPOINT}): {e}",
+            exc_info=True,
+        )
+        raise RuntimeError("无法连接到 ChromaDB") from e
+
+    try:
+        collection = await async_client.get_or_create_collection(
+            name=settings.CHROMA_COLLECTION_NAME,
+            metadata=_collection_metadata(),
+        )
+        logger.info(f"已获取或创建 ChromaDB 集合 (异步): {settings.CHROMA_COLLECTION_NAME}")
     except Exception as e:
         logger.error(
             f"获取或创建 ChromaDB 集合 '{settings.CHROMA_COLLECTION_NAME}' 失败: {e}",
             exc_info=True,
-        )        
+        )
         raise RuntimeError("无法获取或创建 ChromaDB 集合") from e
+
+    try:
+        if (configuration := _search_ef_update(collection)) is not None:
+            await collection.modify(configuration=configuration)
+    except Exception as e:
+        logger.warning(f"更新 ChromaDB 集合的 search_ef 失败: {e}")
+
+    _async_collections[loop] = collection
+    return collection
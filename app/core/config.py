@@ -6,6 +6,9 @@ class Settings(BaseSettings):
     app_name: str = "MemeMind"
     BASE_URL: str = "http://localhost:8000"    
     DEBUG: bool = False
+    # 允许跨域访问 API 的前端来源，环境变量中以 JSON 数组配置，例如 '["https://app.example.com"]'
+    CORS_ALLOWED_ORIGINS: list[str] = ["http://localhost:8000", "http://127.0.0.1:8000"]
+    ENABLE_GRADIO: bool = True  # 在 /gradio 挂载演示界面；关闭后不导入 gradio，缩短启动时间
 
     # PostgreSQL 配置
     POSTGRES_HOST: str = "localhost"
@@ -13,6 +16,12 @@ class Settings(BaseSettings):
     POSTGRES_DB: str = "mememind"
     POSTGRES_USER: str = "postgres"
     POSTGRES_PASSWORD: str = "postgres"
+    POSTGRES_STATEMENT_CACHE_SIZE: int = 1024  # asyncpg 预编译语句缓存大小，经 pgbouncer 事务模式连接时设为 0
+    POSTGRES_POOL_SIZE: int = 25  # FastAPI 进程常驻的连接数，按并发请求数调整
+    POSTGRES_MAX_OVERFLOW: int = 25  # 突发流量时在 pool_size 之外临时创建的连接数
+    POSTGRES_POOL_TIMEOUT: int = 30  # 连接池耗尽时等待可用连接的秒数
+    POSTGRES_POOL_RECYCLE: int = 1800  # 连接最长存活秒数，避免被服务端或中间网络设备静默断开
+    RUN_MIGRATIONS_ON_STARTUP: bool = True  # 启动时执行 Alembic 迁移；多 worker 部署时建议关闭并在部署阶段单独执行
 
     # RabbitMQ 配置
     RABBITMQ_HOST: str = "localhost:5672"
@@ -32,20 +41,84 @@ class Settings(BaseSettings):
     # ChromaDB 配置 ...
     CHROMA_HTTP_ENDPOINT: str = "http://localhost:5500"  # ChromaDB HTTP 访问地址
     CHROMA_COLLECTION_NAME: str = "mememind_rag_collection"  # ChromaDB 集合名称
+    CHROMA_HNSW_CONSTRUCTION_EF: int = 100  # 建图时的候选邻居数量
+    CHROMA_HNSW_M: int = 16  # 图中每个节点的最大连接数
+    CHROMA_HNSW_SEARCH_EF: int = 100  # 查询时的候选邻居数量，需不小于 INITIAL_RETRIEVAL_TOP_K，否则召回率下降
+    CHROMA_HNSW_BATCH_SIZE: int = 500  # 暴力搜索缓冲区大小，攒满后批量插入 HNSW 图
+    CHROMA_HNSW_SYNC_THRESHOLD: int = 2000  # 索引持久化到磁盘的阈值
+    CHROMA_BATCH_SIZE: int = 200  # 每次写入 ChromaDB 的向量数量
+    CHROMA_UPLOAD_CONCURRENCY: int = 4  # 同时进行的 ChromaDB 写入请求数量
+    VECTOR_INDEX_IN_MEMORY: bool = False  # API 进程在内存中保存全部向量的副本，查询时精确暴力检索，不再请求 ChromaDB
+    VECTOR_INDEX_MAX_VECTORS: int = 200_000  # 向量数超过该值时不加载内存副本，继续使用 ChromaDB 检索
+    VECTOR_INDEX_INT8: bool = False  # 内存副本以 int8（每个向量一个缩放系数）存储，内存占用约为 float32 的 1/4
+    VECTOR_INDEX_REFRESH_SECONDS: float = 30.0  # 内存副本的刷新间隔，新入库的文档最多延迟这么久才能被检索到
 
     # Embedding 模型相关
+    EMBEDDING_MODEL_PATH: str = "app/embeddings/Qwen3-Embedding-0.6B"  # 本地模型目录；切块按 token 计数时也用它的分词器
     EMBEDDING_INSTRUCTION_FOR_RETRIEVAL: str = "为这个句子生成表示以用于检索相关文章"
     EMBEDDING_DIMENSIONS: int = 1024  # 嵌入维度, Qwen 0.6B为1024 Qwen 4B为2560
+    EMBEDDING_BATCH_SIZE: int = 32  # 文档入库时每批送入 Embedding 模型的文本块数量
+    EMBEDDING_MICRO_BATCH_SIZE: int = 16  # 按长度排序后每次前向的文本数量
+    EMBEDDING_CPU_BF16: bool = False  # CPU 推理时以 bfloat16 加载 Embedding 模型，需 CPU 支持 BF16
+    EMBEDDING_CPU_INT8: bool = False  # CPU 推理时对 Linear 层做动态 int8 量化（float32 加载时生效）
+    EMBEDDING_WARMUP_ON_STARTUP: bool = True  # FastAPI 启动时预加载并预热 Embedding 模型
+    EMBEDDING_TORCH_COMPILE: bool = False  # 在 CUDA 上用 torch.compile 编译 Embedding 模型，首次调用需要编译时间
+    EMBEDDING_TORCH_COMPILE_MODE: str = "reduce-overhead"  # torch.compile 模式，reduce-overhead 会为每个输入形状捕获 CUDA Graph
+    EMBEDDING_MAX_LENGTH: int = 1024  # 单条文本编码的最大 token 数，需覆盖 CHUNK_SIZE 对应的 token 数与查询指令
+    EMBEDDING_ONNX_PATH: str = ""  # 非空时使用 ONNX Runtime 执行该 ONNX 模型（python -m app.utils.export_onnx 导出）
+    EMBEDDING_PAD_TO_MULTIPLE_OF: int = 8  # 输入长度向上取整到该倍数，设为 0 关闭；使用 CUDA Graph 时建议 64
+    QUERY_EMBED_CACHE_MAX_ENTRIES: int = 10_000  # 查询向量 LRU 缓存的条数，每条约 EMBEDDING_DIMENSIONS * 4 字节
+    QUERY_EMBED_MAX_BATCH: int = 16  # 并发查询合并向量化时每批的最大条数
+    QUERY_EMBED_BATCH_WAIT_MS: float = 5.0  # 收到第一条查询后等待其他查询加入批次的毫秒数，设为 0 只合并已在排队的查询
+    VECTOR_SEARCH_BATCH_WAIT_MS: float = 0.0  # 合并并发 ChromaDB 检索时的等待毫秒数；同批生成的查询向量会同时到达，通常无需等待
     CHUNK_SIZE: int = 512
     CHUNK_OVERLAP: int = 50
+    CHUNK_LENGTH_UNIT: str = "char"  # 块长度单位: char 按字符数; token 按 Embedding 模型的 token 数
+
+    # 文档解析相关配置
+    PDF_PARTITION_STRATEGY: str = "fast"  # PDF 解析策略: fast 直接提取文本层; hi_res 运行版面检测模型，适用于扫描件
+    PDF_PARALLEL_MIN_PAGES: int = 16  # PDF 页数超过该值时按页分片并行解析
+    PDF_PAGES_PER_SHARD: int = 8  # 每个分片包含的页数
+    INGEST_WORKERS: int = 4  # 并行解析 PDF、切分长文本使用的进程数，设为 0 关闭并行处理（prefork 子进程中自动关闭）
+    SPLIT_PARALLEL_MIN_CHARS: int = 1_000_000  # 文本长度超过该值时分段并行切块
 
     # Reranker 相关配置
     INITIAL_RETRIEVAL_TOP_K: int = 50  # 第一阶段向量召回的数量
     FINAL_CONTEXT_TOP_N: int = 5  # Rerank 后最终选取的数量
+    MMR_ENABLED: bool = False  # 召回后用最大边际相关性（MMR）去除相互重复的候选块，再交给 Reranker
+    MMR_LAMBDA: float = 0.7  # MMR 中相关性的权重，越小越偏向多样性
+    MMR_TOP_K: int = 20  # MMR 从召回结果中选出的候选块数量
+    CANDIDATE_PREFETCH_MAX_ENTRIES: int = 1024  # 缓存最近查询的召回 ID，重复查询时与召回并行预取 PostgreSQL，设为 0 关闭
     RERANKER_INSTRUCTION: str = "给定一个网页搜索查询，检索回答该查询的相关段落"
+    RERANKER_MICRO_BATCH_SIZE: int = 16  # Rerank 时每个小批次的候选文档数量
+    RERANKER_MAX_LENGTH_RATIO: float = 1.5  # 小批次内最长与最短输入的长度比上限，超过时另起一批以减少填充，设为 0 不限制
+    RERANKER_QUANTIZATION: str = "none"  # GPU 上的 Reranker 量化方式: none / 8bit / 4bit，需安装 bitsandbytes
+    RERANKER_CPU_INT8: bool = False  # CPU 推理时对 Reranker 主干的 Linear 层做动态 int8 量化
+    RERANKER_TORCH_COMPILE: bool = False  # 在 CUDA 上用 torch.compile 编译 Reranker（非量化模型），首次调用需要编译时间
+    RERANKER_TORCH_COMPILE_MODE: str = "default"  # torch.compile 模式，reduce-overhead 会为每个输入形状捕获 CUDA Graph
+    RERANKER_PAD_TO_MULTIPLE_OF: int = 8  # 输入长度向上取整到该倍数，设为 0 关闭；使用 CUDA Graph 时建议 64
+    RERANKER_ONNX_PATH: str = ""  # 非空时使用 ONNX Runtime 执行该 Reranker ONNX 模型（python -m app.utils.export_onnx --model reranker 导出）
+    RERANKER_WARMUP_ON_STARTUP: bool = True  # FastAPI 启动时预加载并预热 Reranker 模型
+    RERANKER_SHARE_QUERY_PREFIX: bool = True  # 指令 + 查询前缀每次 Rerank 只前向一次，各候选文档复用其 KV 缓存
+    RERANKER_MAX_LENGTH: int = 1024  # Rerank 输入的最大 token 数，需覆盖指令 + 查询 + 一个文本块（中文约 1 字 1 token）
+    RERANK_CACHE_MAX_ENTRIES: int = 50_000  # 缓存的 (查询, 文本块) 得分数量，重复查询时跳过 Reranker 前向，设为 0 关闭
+
+    # 语义缓存相关配置
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.97  # 查询向量余弦相似度达到该值即视为同一问题
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 1024
+    SEMANTIC_CACHE_TTL_SECONDS: int = 600
 
     # LLM 相关配置
+    LLM_BACKEND: str = "transformers"  # transformers: 进程内加载模型; openai: 调用 vLLM 等 OpenAI 兼容服务
     LLM_MODEL_PATH: str = "app/llm_models/Qwen2.5-1.5B-Instruct"
+    LLM_OPENAI_BASE_URL: str = "http://localhost:8001/v1"
+    LLM_OPENAI_MODEL: str = "Qwen/Qwen2.5-1.5B-Instruct"
+    LLM_OPENAI_API_KEY: str = "EMPTY"
+    LLM_OPENAI_TIMEOUT_SECONDS: float = 300.0
+    LLM_PREFIX_CACHE_MAX_ENTRIES: int = 4  # 缓存的上下文前缀 KV 数量，每条占用显存与上下文长度成正比，设为 0 关闭
+    LLM_WARMUP_ON_STARTUP: bool = False  # FastAPI 启动时预加载并预热 LLM（显存/内存足够时开启）
+    LLM_TORCH_COMPILE: bool = False  # 在 CUDA 上编译 LLM 的 forward 并使用静态 KV 缓存；开启后不使用前缀 KV 缓存
 
     model_config = SettingsConfigDict(
         env_file=(".env", ".env.local"), env_file_encoding="utf-8"
@@ -0,0 +1,44 @@
+import asyncio
+import weakref
+
+import redis.asyncio as aioredis
+from loguru import logger
+
+from app.core.config import settings
+
+# 知识库版本号保存在 Redis 中：文档入库完成（Celery worker）或删除（API）时递增，
+# 各 API 进程内的答案缓存据此判断缓存内容是否基于旧的知识库生成
+_CORPUS_VERSION_KEY = "mememind:corpus_version"
+_REDIS_URL = f"redis://{settings.REDIS_HOST}/3"
+
+# 异步客户端的连接池绑定在创建它的事件循环上，按事件循环缓存（与 ChromaDB 异步客户端相同）
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_client() -> aioredis.Redis:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = aioredis.Redis.from_url(_REDIS_URL)
+        _clients[loop] = client
+    return client
+
+
+async def get_corpus_version() -> int | None:
+    """读取当前知识库版本号；Redis 不可用时返回 None，调用方应跳过缓存。"""
+    try:
+        version = await _get_client().get(_CORPUS_VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"读取知识库版本号失败: {e}")
+        return None
+    return int(version or 0)
+
+
+async def bump_corpus_version() -> None:
+    """知识库内容发生变化后调用，使所有进程中基于旧内容的缓存答案失效。"""
+    try:
+        await _get_client().incr(_CORPUS_VERSION_KEY)
+    except Exception as e:
+        logger.error(f"更新知识库版本号失败: {e}")
@@ -1,15 +1,25 @@
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
 from pathlib import Path
+import numpy as np
 import torch
 import torch.nn.functional as F
 from torch import Tensor
 from loguru import logger
-from transformers import AutoTokenizer, AutoModel
+from transformers import AutoModel
+
+from app.core.batch_prefetch import move_to_device, pin_for_device, prefetch_batches
+from app.core.config import settings
+from app.core.onnx_session import create_onnx_session, run_onnx_session
+from app.core.tokenizer_cache import get_tokenizer
 
 # --- 1. 模型名称和路径 ---
 # 模型的 Hugging Face 名称
 EMBEDDING_MODEL_NAME = "Qwen/Qwen3-Embedding-0.6B"
-# 模型的本地路径
-EMBEDDING_MODEL_PATH = "app/embeddings/Qwen3-Embedding-0.6B"
+# 模型的本地路径（放在配置中，切块进程无需导入本模块及 torch 即可取得分词器路径）
+EMBEDDING_MODEL_PATH = settings.EMBEDDING_MODEL_PATH
 # 模型的最大长度
 QWEN_MAX_LENGTH = 8192
 
@@ -21,28 +31,31 @@ QWEN_MAX_LENGTH = 8192
 tokenizer = None
 embedding_model_global = None
 device = None
+# 配置了 EMBEDDING_ONNX_PATH 时使用的 ONNX Runtime 会话，此时不加载 PyTorch 模型
+onnx_session = None
 
 
 # --- 2. 模型所需的 last_token_pool 函数 ---
 # 这个函数来自 Qwen 官方示例，用于从模型的输出中正确地提取句向量
 def last_token_pool(last_hidden_states: Tensor, attention_mask: Tensor) -> Tensor:
     """
-    根据 attention_mask 从 last_hidden_states 中获取最后一个有效 token 的向量。
+    取每个序列最后一个有效 token 的向量。
+    分词器在加载时固定为左填充，最后一个有效 token 总在最后一个位置，
+    无需再按 attention_mask 判断填充方向（那一步会引入一次设备到主机的同步）。
     """
-    left_padding = attention_mask[:, -1].sum() == attention_mask.shape[0]
-    if left_padding:
-        return last_hidden_states[:, -1]
-    else:
-        sequence_lengths = attention_mask.sum(dim=1) - 1
-        batch_size = last_hidden_states.shape[0]
-        return last_hidden_states[
-            torch.arange(batch_size, device=last_hidden_states.device), sequence_lengths
-        ]
+    return last_hidden_states[:, -1]
 
 
 def _load_embedding_model():
     """延迟加载 Embedding 模型和 Tokenizer，并移至可用设备。"""
-    global tokenizer, embedding_model_global, device
+    global tokenizer, embedding_model_global, device, onnx_session
+    if settings.EMBEDDING_ONNX_PATH:
+        if onnx_session is None:
+            tokenizer = get_tokenizer(EMBEDDING_MODEL_PATH, padding_side="left")
+            # 输入以 numpy 数组交给 ONNX Runtime，由它负责拷贝到执行设备
+            device = torch.device("cpu")
+            onnx_session = create_onnx_session(settings.EMBEDDING_ONNX_PATH)
+        return
     if tokenizer is None or embedding_model_global is None:
         logger.info(f"首次加载 Embedding 模型: {EMBEDDING_MODEL_NAME}...")
         try:
@@ -54,7 +67,11 @@ def _load_embedding_model():
 
             # --- 3.  Tokenizer 和模型加载方式 ---
             # Qwen 模型推荐使用 'left' 作为填充侧，这对于 last_token_pool至关重要
-            tokenizer = AutoTokenizer.from_pretrained(model_path, padding_side="left")
+            tokenizer = get_tokenizer(EMBEDDING_MODEL_PATH, padding_side="left")
+            if tokenizer.padding_side != "left":
+                raise ValueError(
+                    f"Embedding 分词器必须左填充，当前为 {tokenizer.padding_side}"
+                )
 
             # 判断是否有可用 GPU
             if torch.cuda.is_available():
@@ -70,10 +87,10 @@ def _load_embedding_model():
                     logger.info("已启用 Flash Attention 2 和 bfloat16 加速。")
                 except Exception as e:
                     logger.warning(
-                        f"加载 Flash Attention 2 失败: {e}，将使用标准模式。"
+                        f"加载 Flash Attention 2 失败: {e}，将使用 PyTorch SDPA 注意力。"
                     )
                     embedding_model_global = AutoModel.from_pretrained(
-                        model_path, torch_dtype=torch.bfloat16
+                        model_path, torch_dtype=torch.bfloat16, attn_implementation="sdpa"
                     ).to(device)
 
             elif torch.backends.mps.is_available():
@@ -83,16 +100,52 @@ def _load_embedding_model():
                 )
                 # Apple Silicon 不支持 Flash Attention，但可以使用 bfloat16
                 embedding_model_global = AutoModel.from_pretrained(
-                    model_path, torch_dtype=torch.bfloat16
+                    model_path, torch_dtype=torch.bfloat16, attn_implementation="sdpa"
                 ).to(device)
             else:
                 device = torch.device("cpu")
                 logger.info("未检测到 CUDA 或 MPS，Embedding 模型将使用 CPU。")
-                embedding_model_global = AutoModel.from_pretrained(model_path).to(
-                    device
-                )
+                # 支持 AVX512-BF16/AMX 的 CPU 上，bfloat16 可以减半权重和激活的内存带宽
+                cpu_dtype = torch.bfloat16 if settings.EMBEDDING_CPU_BF16 else torch.float32
+                embedding_model_global = AutoModel.from_pretrained(
+                    model_path, torch_dtype=cpu_dtype, attn_implementation="sdpa"
+                ).to(device)
+                # 可选：Linear 层动态 int8 量化，走 oneDNN/FBGEMM 的 int8 GEMM，
+                # 权重内存约为 float32 的 1/4；bfloat16 加载时不再叠加量化
+                if settings.EMBEDDING_CPU_INT8 and cpu_dtype == torch.float32:
+                    embedding_model_global = torch.ao.quantization.quantize_dynamic(
+                        embedding_model_global.eval(), {torch.nn.Linear}, dtype=torch.qint8
+                    )
+                    logger.info("已对 Embedding 模型的 Linear 层启用动态 int8 量化。")
 
             embedding_model_global.eval()
+            # 允许 float32 矩阵乘使用 TF32 等更快的内部精度，对检索向量的质量影响可以忽略
+            torch.set_float32_matmul_precision("high")
+
+            # 可选：torch.compile 融合算子；reduce-overhead 模式下按输入形状捕获 CUDA Graph，
+            # 与 EMBEDDING_PAD_TO_MULTIPLE_OF 分桶配合，小批量查询编码的启动开销最明显。
+            # 编译发生在首次前向，启动时的预热（warmup_embedding_model）会提前付出这部分耗时
+            if settings.EMBEDDING_TORCH_COMPILE and device.type == "cuda":
+                try:
+                    compiled_model = torch.compile(
+                        embedding_model_global,
+                        mode=settings.EMBEDDING_TORCH_COMPILE_MODE,
+                        dynamic=True,
+                    )
+                    # torch.compile 是惰性的，编译错误要到首次前向才会出现：
+                    # 在这里做一次试运行，失败时保留未编译的模型，而不是让第一个请求失败
+                    probe_ids = torch.zeros((1, 8), dtype=torch.long, device=device)
+                    with torch.inference_mode():
+                        compiled_model(
+                            input_ids=probe_ids,
+                            attention_mask=torch.ones_like(probe_ids),
+                            return_dict=True,
+                        )
+                    embedding_model_global = compiled_model
+                    logger.info("已使用 torch.compile 编译 Embedding 模型。")
+                except Exception as e:
+                    logger.warning(f"torch.compile 编译 Embedding 模型失败: {e}，将使用 eager 模式。")
+
             logger.info(
                 f"Embedding 模型 {EMBEDDING_MODEL_NAME} 加载完成并移至 {device}。"
             )
@@ -105,11 +158,11 @@ def _load_embedding_model():
             ) from e
 
 
-def get_embeddings(
+def encode_texts(
     texts: list[str], task_description: str, is_query: bool
-) -> list[list[float]]:
+) -> np.ndarray:
     """
-    使用 Qwen3-Embedding 模型为文本列表生成向量嵌入。
+    使用 Qwen3-Embedding 模型为文本列表生成向量嵌入，返回形状为 (N, D) 的 float32 数组。
 
     Args:
         texts (list[str]): 需要编码的文本列表。
@@ -120,7 +173,7 @@ def get_embeddings(
     _load_embedding_model()
 
     if not texts:
-        return []
+        return np.empty((0, settings.EMBEDDING_DIMENSIONS), dtype=np.float32)
 
     # --- 4. 输入文本的格式化方式 ---
     # 根据 is_query 参数决定是否添加指令
@@ -131,28 +184,184 @@ def get_embeddings(
         # 文档（documents）不需要指令
         instructed_texts = texts
 
+    # 完全相同的文本（模板段落、重复的页眉页脚等）只编码一次，最后按下标展开
+    unique_index: dict[str, int] = {}
+    inverse = [unique_index.setdefault(text, len(unique_index)) for text in instructed_texts]
+
     try:
-        # Tokenize
-        inputs = tokenizer(
-            instructed_texts,
-            padding=True,
+        # Tokenize：先不填充，得到每条文本各自的 token 序列
+        encoded_ids = tokenizer(
+            list(unique_index),
+            padding=False,
             truncation=True,
-            return_tensors="pt",
-            max_length=QWEN_MAX_LENGTH,  # 使用新模型的最大长度
+            return_attention_mask=False,
+            # 截断上限取配置与模型上限的较小值：文本块远短于 8192，
+            # 个别异常长的输入不会把所在小批次的注意力计算拖到模型上限
+            max_length=min(settings.EMBEDDING_MAX_LENGTH, QWEN_MAX_LENGTH),
+        )["input_ids"]
+
+        # 按长度排序后分成小批次前向：同一批次内长度接近，一条超长文本不会让整批都填充到它的长度
+        order = torch.argsort(
+            torch.tensor([len(ids) for ids in encoded_ids]), stable=True
         )
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-
-        # Get embeddings
-        with torch.no_grad():
-            outputs = embedding_model_global(**inputs, return_dict=True)
-            # --- 5. 使用 last_token_pool 提取向量 ---
-            embeddings = last_token_pool(
-                outputs.last_hidden_state, inputs["attention_mask"]
+        order_list = order.tolist()
+        sorted_embeddings: list[torch.Tensor] = []
+        micro_batch_size = settings.EMBEDDING_MICRO_BATCH_SIZE
+
+        def _pad_batch(batch_indices: list[int]):
+            padded = tokenizer.pad(
+                {"input_ids": [encoded_ids[i] for i in batch_indices]},
+                padding=True,
+                # 序列长度向上取整到固定倍数：形状落在有限个桶里，
+                # 编译/CUDA Graph 可以按桶复用，GPU 上也更利于 Tensor Core 对齐
+                pad_to_multiple_of=settings.EMBEDDING_PAD_TO_MULTIPLE_OF or None,
+                return_tensors="pt",
             )
-            # L2 归一化
-            normalized_embeddings = F.normalize(embeddings, p=2, dim=1)
+            return pin_for_device(padded, device)
+
+        micro_batches = [
+            order_list[start : start + micro_batch_size]
+            for start in range(0, len(order_list), micro_batch_size)
+        ]
+        with torch.inference_mode():
+            # 下一个小批次的填充在后台线程中进行，与当前小批次的前向重叠
+            for cpu_inputs in prefetch_batches(_pad_batch, micro_batches):
+                inputs = move_to_device(cpu_inputs, device)
+
+                if onnx_session is not None:
+                    # 导出的 ONNX 图内已完成池化和归一化
+                    sorted_embeddings.append(
+                        torch.from_numpy(
+                            run_onnx_session(
+                                onnx_session, {k: v.numpy() for k, v in inputs.items()}
+                            )
+                        )
+                    )
+                    continue
 
-        return normalized_embeddings.cpu().tolist()
+                # Get embeddings
+                outputs = embedding_model_global(**inputs, return_dict=True)
+                # --- 5. 使用 last_token_pool 提取向量 ---
+                embeddings = last_token_pool(
+                    outputs.last_hidden_state, inputs["attention_mask"]
+                )
+                # L2 归一化，半精度输出先转回 float32，避免范数计算损失精度
+                sorted_embeddings.append(F.normalize(embeddings.float(), p=2, dim=1))
+
+            sorted_embeddings_tensor = torch.cat(sorted_embeddings)
+            # 恢复排序前的顺序与去重后的展开合并为一次 gather：
+            # sorted_position[u] 为第 u 个唯一文本在排序结果中的行号
+            sorted_position = torch.empty_like(order)
+            sorted_position[order] = torch.arange(len(order))
+            gather_index = sorted_position[torch.tensor(inverse)]
+            normalized_embeddings = sorted_embeddings_tensor[
+                gather_index.to(sorted_embeddings_tensor.device)
+            ]
+
+        return normalized_embeddings.cpu().numpy()
     except Exception as e:
         logger.error(f"生成文本嵌入时发生错误: {e}", exc_info=True)
         raise
+
+
+def get_embeddings(
+    texts: list[str], task_description: str, is_query: bool
+) -> list[list[float]]:
+    """encode_texts 的列表版本，供需要 Python 列表的调用方（文档入库）使用。"""
+    return encode_texts(texts, task_description, is_query).tolist()
+
+
+# 查询向量的进程内 LRU 缓存，键为 (任务指令, 规范化后的查询文本) 的摘要。
+# 值为 float32 数组，返回给调用方的是副本，避免缓存内容被误改
+_query_embedding_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+_query_embedding_cache_lock = threading.Lock()
+# 规范化时去掉的句末标点（NFKC 已把全角问号、感叹号等转为半角）。
+# 只去句末语气标点：+ # * / 等可能是查询内容本身（"C++" 与 "C#" 不能共用一个向量）
+_QUERY_STRIP_CHARS = "?!.,;:。？！…，；："
+
+
+def _query_cache_key(text: str, task_description: str) -> bytes:
+    """
+    只在大小写、全半角、空白和句末标点上不同的查询视为同一查询，共用一个缓存向量。
+    键用定长摘要，缓存占用与查询长度无关。
+    """
+    normalized = " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+    normalized = normalized.rstrip(_QUERY_STRIP_CHARS).rstrip()
+    return hashlib.sha256(f"{task_description}\0{normalized}".encode()).digest()
+
+
+def lookup_query_embedding(text: str, task_description: str) -> np.ndarray | None:
+    """只查缓存、不执行模型；事件循环中可直接调用，命中时省去线程切换和批处理等待。"""
+    key = _query_cache_key(text, task_description)
+    with _query_embedding_cache_lock:
+        cached = _query_embedding_cache.get(key)
+        if cached is None:
+            return None
+        _query_embedding_cache.move_to_end(key)
+        return cached.copy()
+
+
+def embed_queries(texts: list[str], task_description: str) -> list[np.ndarray]:
+    """
+    为一批查询文本生成向量嵌入：命中 LRU 缓存的直接返回，
+    其余的合并为一次 encode_texts 调用编码。
+    每个向量是 float32 数组，检索链路直接使用，不再装箱成 Python float 列表。
+
+    Args:
+        texts (list[str]): 查询文本列表。
+        task_description (str): 描述任务的指令。
+    """
+    keys = [_query_cache_key(text, task_description) for text in texts]
+    results: list[np.ndarray | None] = []
+    with _query_embedding_cache_lock:
+        for key in keys:
+            cached = _query_embedding_cache.get(key)
+            if cached is not None:
+                _query_embedding_cache.move_to_end(key)
+            results.append(cached)
+
+    # 规范化后相同的查询只编码第一次出现的原文
+    misses: dict[bytes, str] = {}
+    for key, text, cached in zip(keys, texts, results):
+        if cached is None:
+            misses.setdefault(key, text)
+    if misses:
+        encoded = encode_texts(list(misses.values()), task_description, is_query=True)
+        new_entries = dict(zip(misses, encoded))
+        with _query_embedding_cache_lock:
+            for key, embedding in new_entries.items():
+                _query_embedding_cache[key] = embedding
+            while len(_query_embedding_cache) > settings.QUERY_EMBED_CACHE_MAX_ENTRIES:
+                _query_embedding_cache.popitem(last=False)
+        results = [
+            new_entries[key] if cached is None else cached
+            for key, cached in zip(keys, results)
+        ]
+    return [embedding.copy() for embedding in results]
+
+
+def embed_query(text: str, task_description: str) -> np.ndarray:
+    """
+    为单条查询文本生成向量嵌入，相同的查询会直接命中进程内的 LRU 缓存。
+
+    Args:
+        text (str): 查询文本。
+        task_description (str): 描述任务的指令。
+    """
+    return embed_queries([text], task_description)[0]
+
+
+def warmup_embedding_model() -> None:
+    """
+    加载 Embedding 模型并执行一次推理作为预热。
+    首次前向会触发 CUDA 上下文、cuBLAS 句柄和算子选择等一次性开销，
+    在启动阶段完成后，第一个真实请求就不再承担这部分延迟。
+    """
+    _load_embedding_model()
+    # 直接调用 encode_texts，绕过查询缓存，确保真的走一次模型
+    encode_texts(
+        ["warmup"],
+        task_description=settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL,
+        is_query=True,
+    )
+    logger.info("Embedding 模型预热完成。")
@@ -1,17 +1,47 @@
+import copy
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
+import httpx
+import orjson
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import (
+    AutoModelForCausalLM,
+    PreTrainedTokenizerBase,
+    BatchEncoding,
+    DynamicCache,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
 from loguru import logger
 
+from app.core.config import settings
+from app.core.tokenizer_cache import get_tokenizer
+
 # --- 全局变量，用于存储加载后的模型和分词器 ---
 llm_model: Optional[AutoModelForCausalLM] = None
-llm_tokenizer: Optional[AutoTokenizer] = None
+llm_tokenizer: Optional[PreTrainedTokenizerBase] = None
 
 # --- 模型配置 ---
 LLM_MODEL_NAME = "Qwen/Qwen2.5-1.5B-Instruct"
 LLM_MODEL_PATH = "app/llm_models/Qwen2.5-1.5B-Instruct"
 
+# --- 前缀 KV 缓存 ---
+# 键为聊天模板中可复用的前缀文本（系统提示 + 指令 + 检索到的上下文），
+# 值为 (前缀 token ids, 预填充得到的 KV 缓存)。
+# 相同上下文的后续提问只需预填充问题部分，省去上下文的重复计算。
+_prefix_kv_cache: "OrderedDict[str, tuple[torch.Tensor, DynamicCache]]" = OrderedDict()
+_prefix_kv_cache_lock = threading.Lock()
+
+# --- OpenAI 兼容推理服务 (vLLM / TGI 等) ---
+# LLM_BACKEND="openai" 时使用，进程内共享一个带连接池的 HTTP 客户端
+_openai_http_client: httpx.Client | None = None
+_openai_http_client_lock = threading.Lock()
+
 
 def _load_llm_model():
     """
@@ -32,13 +62,32 @@ def _load_llm_model():
                 model_path,
                 torch_dtype="auto",
                 device_map="auto",  # accelerate 会自动处理设备映射
+                attn_implementation="sdpa",  # 显式使用 PyTorch 融合注意力，不回退到 eager
             )
 
-            llm_tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_PATH)
+            llm_tokenizer = get_tokenizer(LLM_MODEL_PATH)
 
             # 将模型设置为评估模式
             llm_model.eval()
 
+            # 可选：只编译 forward（generate 的解码循环保留在 Python 中），
+            # 配合 generate 的静态 KV 缓存，每个解码步的输入形状固定，编译结果可以反复复用
+            if settings.LLM_TORCH_COMPILE and llm_model.device.type == "cuda":
+                eager_forward = llm_model.forward
+                try:
+                    llm_model.forward = torch.compile(
+                        eager_forward, mode="reduce-overhead", fullgraph=False
+                    )
+                    # torch.compile 是惰性的，编译错误要到首次前向才会出现：
+                    # 在这里做一次试运行，失败时换回未编译的 forward，而不是让第一个请求失败
+                    probe_ids = torch.zeros((1, 8), dtype=torch.long, device=llm_model.device)
+                    with torch.inference_mode():
+                        llm_model(input_ids=probe_ids, use_cache=False)
+                    logger.info("已使用 torch.compile 编译 LLM forward。")
+                except Exception as e:
+                    llm_model.forward = eager_forward
+                    logger.warning(f"torch.compile 编译 LLM 失败: {e}，将使用 eager 模式。")
+
             device = next(llm_model.parameters()).device
             logger.info(f"LLM 模型 {LLM_MODEL_NAME} 加载成功，运行于设备: {device}")
 
@@ -47,16 +96,272 @@ def _load_llm_model():
             raise RuntimeError(f"无法加载 LLM 模型: {LLM_MODEL_NAME}") from e
 
 
+def prepare_llm() -> None:
+    """
+    确保 LLM 已可用于生成：进程内后端会加载模型，OpenAI 兼容后端无需准备。
+    可以在检索阶段提前在后台调用，让模型加载与检索、精排重叠进行。
+    """
+    if settings.LLM_BACKEND != "openai":
+        _load_llm_model()
+
+
+def warmup_llm() -> None:
+    """
+    准备 LLM 并生成几个 token 作为预热。OpenAI 兼容后端不在进程内运行模型，无需预热。
+    """
+    if settings.LLM_BACKEND == "openai":
+        return
+    _load_llm_model()
+    # 生成几个 token，让预填充和解码两条路径（含 KV 缓存分配）都执行一次
+    generate_text_from_llm("你好", max_new_tokens=4)
+    logger.info("LLM 预热完成。")
+
+
+def _get_prefix_past_key_values(
+    prefix_text: str, input_ids: torch.Tensor
+) -> DynamicCache | None:
+    """
+    返回 prefix_text 对应的 KV 缓存副本，未命中时先预填充并缓存。
+    只有当完整输入的 token 序列确实以前缀的 token 序列开头时才可复用，否则返回 None。
+    """
+    with _prefix_kv_cache_lock:
+        cached = _prefix_kv_cache.get(prefix_text)
+        if cached is not None:
+            _prefix_kv_cache.move_to_end(prefix_text)
+
+    if cached is None:
+        prefix_ids = llm_tokenizer([prefix_text], return_tensors="pt").input_ids.to(
+            llm_model.device
+        )
+    else:
+        prefix_ids = cached[0]
+
+    # 分词可能在前缀边界处与后续文本合并成不同的 token，此时前缀缓存不可用
+    prefix_len = prefix_ids.shape[1]
+    if prefix_len >= input_ids.shape[1] or not torch.equal(
+        input_ids[0, :prefix_len], prefix_ids[0]
+    ):
+        return None
+
+    if cached is None:
+        prefix_cache = DynamicCache()
+        with torch.inference_mode():
+            llm_model(input_ids=prefix_ids, past_key_values=prefix_cache, use_cache=True)
+        cached = (prefix_ids, prefix_cache)
+        with _prefix_kv_cache_lock:
+            _prefix_kv_cache[prefix_text] = cached
+            while len(_prefix_kv_cache) > settings.LLM_PREFIX_CACHE_MAX_ENTRIES:
+                _prefix_kv_cache.popitem(last=False)
+
+    # generate 会原地追加 KV，必须交给它一份副本，保持缓存中的前缀不被污染。
+    # 缓存中的张量是 inference_mode 下创建的，副本也在 inference_mode 下生成
+    with torch.inference_mode():
+        return copy.deepcopy(cached[1])
+
+
+def _get_openai_http_client() -> httpx.Client:
+    global _openai_http_client
+    if _openai_http_client is None:
+        with _openai_http_client_lock:
+            if _openai_http_client is None:
+                _openai_http_client = httpx.Client(
+                    base_url=settings.LLM_OPENAI_BASE_URL,
+                    headers={"Authorization": f"Bearer {settings.LLM_OPENAI_API_KEY}"},
+                    timeout=httpx.Timeout(settings.LLM_OPENAI_TIMEOUT_SECONDS),
+                    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                )
+    return _openai_http_client
+
+
+def _build_openai_payload(
+    prompt: str,
+    system_prompt: str,
+    max_new_tokens: int,
+    temperature: float,
+    top_p: float,
+) -> dict:
+    return {
+        "model": settings.LLM_OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt},
+        ],
+        "max_tokens": max_new_tokens,
+        "temperature": temperature,
+        "top_p": top_p,
+    }
+
+
+def _generate_text_via_openai_api(
+    prompt: str,
+    system_prompt: str,
+    max_new_tokens: int,
+    temperature: float,
+    top_p: float,
+) -> str:
+    """
+    调用 OpenAI 兼容的 /chat/completions 接口生成文本。
+    vLLM 等推理服务自带连续批处理和前缀缓存，并发请求不会在进程内串行排队。
+    """
+    try:
+        response = _get_openai_http_client().post(
+            "/chat/completions",
+            json=_build_openai_payload(
+                prompt, system_prompt, max_new_tokens, temperature, top_p
+            ),
+        )
+        response.raise_for_status()
+        answer = response.json()["choices"][0]["message"]["content"]
+        logger.info(f"LLM 服务生成的文本 (前100字符): {answer[:100]}...")
+        return answer
+    except Exception as e:
+        logger.error(f"调用 LLM 服务生成文本时发生错误: {e}", exc_info=True)
+        raise RuntimeError(f"LLM 生成文本失败: {e}") from e
+
+
+def _stream_text_via_openai_api(
+    prompt: str,
+    system_prompt: str,
+    max_new_tokens: int,
+    temperature: float,
+    top_p: float,
+) -> Iterator[str]:
+    """以流式方式调用 OpenAI 兼容接口，逐段产出生成的文本（解析 SSE 的 data 行）。"""
+    payload = _build_openai_payload(
+        prompt, system_prompt, max_new_tokens, temperature, top_p
+    )
+    payload["stream"] = True
+    try:
+        with _get_openai_http_client().stream(
+            "POST", "/chat/completions", json=payload
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+                choices = orjson.loads(data).get("choices") or []
+                if choices and (content := choices[0].get("delta", {}).get("content")):
+                    yield content
+    except Exception as e:
+        logger.error(f"调用 LLM 服务流式生成文本时发生错误: {e}", exc_info=True)
+        raise RuntimeError(f"LLM 生成文本失败: {e}") from e
+
+
+@lru_cache(maxsize=16)
+def _system_prefix(system_prompt: str) -> tuple[str, torch.Tensor]:
+    """
+    系统提示在聊天模板中渲染出的文本及其 token ids（CPU），按系统提示缓存。
+    系统段以 <|im_end|> 和换行结尾，后面紧跟特殊 token，分开分词与整体分词结果一致。
+    """
+    system_text = llm_tokenizer.apply_chat_template(
+        [{"role": "system", "content": system_prompt}],
+        tokenize=False,
+        add_generation_prompt=False,
+    )
+    system_ids = llm_tokenizer(
+        [system_text], return_tensors="pt", add_special_tokens=False
+    ).input_ids
+    return system_text, system_ids
+
+
+def _build_model_inputs(
+    prompt: str, system_prompt: str, cache_prefix: str | None
+) -> tuple[BatchEncoding, DynamicCache | None]:
+    """
+    按 Qwen2.5-Instruct 的聊天模板构造模型输入，
+    并取得可复用的前缀 KV 缓存（不可用时为 None）：
+    提供 cache_prefix 时前缀为系统段 + 模板头部 + cache_prefix，否则只复用系统段。
+    """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt},
+    ]
+    text = llm_tokenizer.apply_chat_template(
+        messages, tokenize=False, add_generation_prompt=True
+    )
+
+    # 系统段的 token 已缓存，只对用户轮次和生成提示分词
+    system_text, system_ids = _system_prefix(system_prompt)
+    if text.startswith(system_text):
+        rest_ids = llm_tokenizer(
+            [text[len(system_text) :]], return_tensors="pt", add_special_tokens=False
+        ).input_ids
+        input_ids = torch.cat([system_ids, rest_ids], dim=1)
+        model_inputs = BatchEncoding(
+            {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+        ).to(llm_model.device)
+    else:
+        model_inputs = llm_tokenizer([text], return_tensors="pt").to(llm_model.device)
+
+    if (
+        settings.LLM_TORCH_COMPILE  # 编译模式使用静态 KV 缓存，与动态前缀缓存不兼容
+        or settings.LLM_PREFIX_CACHE_MAX_ENTRIES <= 0
+    ):
+        return model_inputs, None
+
+    if cache_prefix and prompt.startswith(cache_prefix):
+        # 前缀在模板中的位置：系统提示和模板头部之后紧跟 prompt
+        prefix_text = text[: text.index(prompt) + len(cache_prefix)]
+    elif text.startswith(system_text):
+        prefix_text = system_text
+    else:
+        return model_inputs, None
+
+    past_key_values = None
+    try:
+        past_key_values = _get_prefix_past_key_values(
+            prefix_text, model_inputs.input_ids
+        )
+    except Exception as e:
+        logger.warning(f"前缀 KV 缓存不可用，回退到完整预填充: {e}")
+    return model_inputs, past_key_values
+
+
+def _generation_kwargs(
+    past_key_values: DynamicCache | None,
+    max_new_tokens: int,
+    temperature: float,
+    top_p: float,
+) -> dict:
+    """
+    generate 的公共参数：显式单束搜索并启用 KV 缓存；有前缀缓存时传入副本，
+    编译模式下使用预分配的静态缓存，解码过程中不再随长度扩容。
+    temperature <= 0 时走贪心解码，跳过采样相关的 logits 处理。
+    """
+    kwargs: dict = {"max_new_tokens": max_new_tokens, "num_beams": 1, "use_cache": True}
+    if past_key_values is not None:
+        kwargs["past_key_values"] = past_key_values
+    elif settings.LLM_TORCH_COMPILE:
+        kwargs["cache_implementation"] = "static"
+    if temperature > 0:
+        kwargs.update(do_sample=True, temperature=temperature, top_p=top_p)
+    else:
+        kwargs["do_sample"] = False
+    return kwargs
+
+
 def generate_text_from_llm(
     prompt: str,
     system_prompt: str = "You are a helpful assistant.",  # 可选的系统提示词
     max_new_tokens: int = 512,
     temperature: float = 0.7,
     top_p: float = 0.9,
+    cache_prefix: str | None = None,
 ) -> str:
     """
     使用加载的 Qwen2.5 模型根据给定的提示生成文本。
+    cache_prefix 为 prompt 中可跨请求复用的开头部分（例如指令 + 上下文），
+    提供时会复用或建立该前缀的 KV 缓存。
     """
+    if settings.LLM_BACKEND == "openai":
+        # 推理服务端自行做前缀缓存，cache_prefix 在这里不需要
+        return _generate_text_via_openai_api(
+            prompt, system_prompt, max_new_tokens, temperature, top_p
+        )
+
     _load_llm_model()
 
     if llm_model is None or llm_tokenizer is None:
@@ -65,27 +370,19 @@ def generate_text_from_llm(
     logger.debug(f"向 LLM 发送的 Prompt (部分内容):\n{prompt[:100]}")
 
     try:
-        # 构建符合 Qwen2.5-Instruct 模型的聊天模板
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
-        ]
-        text = llm_tokenizer.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
+        # 构建符合 Qwen2.5-Instruct 模型的聊天模板，并尽量复用前缀 KV 缓存
+        model_inputs, past_key_values = _build_model_inputs(
+            prompt, system_prompt, cache_prefix
         )
 
-        # 将格式化后的文本 tokenize
-        model_inputs = llm_tokenizer([text], return_tensors="pt").to(llm_model.device)
-
         # 使用模型生成文本
-        with torch.no_grad():
+        with torch.inference_mode():
             # 3. 根据官方文档，使用 **model_inputs 解包方式传递参数
             generated_ids = llm_model.generate(
                 **model_inputs,
-                max_new_tokens=max_new_tokens,
-                do_sample=True,
-                temperature=temperature,
-                top_p=top_p,
+                **_generation_kwargs(
+                    past_key_values, max_new_tokens, temperature, top_p
+                ),
             )
 
         # 4. 根据官方文档，使用更健壮的方式来分离生成的部分
@@ -105,3 +402,91 @@ def generate_text_from_llm(
     except Exception as e:
         logger.error(f"LLM 生成文本时发生错误: {e}", exc_info=True)
         raise RuntimeError(f"LLM 生成文本失败: {e}") from e
+
+
+class _StopOnEvent(StoppingCriteria):
+    """外部设置 stop_event 后，generate 在下一个解码步结束（例如流式响应的客户端已断开）。"""
+
+    def __init__(self, stop_event: threading.Event):
+        self.stop_event = stop_event
+
+    def __call__(self, input_ids: torch.LongTensor, scores, **kwargs) -> torch.BoolTensor:
+        return torch.full(
+            (input_ids.shape[0],),
+            self.stop_event.is_set(),
+            dtype=torch.bool,
+            device=input_ids.device,
+        )
+
+
+def stream_text_from_llm(
+    prompt: str,
+    system_prompt: str = "You are a helpful assistant.",
+    max_new_tokens: int = 512,
+    temperature: float = 0.7,
+    top_p: float = 0.9,
+    cache_prefix: str | None = None,
+    stop_event: threading.Event | None = None,
+) -> Iterator[str]:
+    """
+    与 generate_text_from_llm 参数相同，但以生成器的形式逐段产出文本，
+    调用方无需等待整个回答生成完毕即可开始输出。
+    调用方设置 stop_event（或关闭本生成器）后生成会尽快停止，不再占用 GPU 直到 max_new_tokens。
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    if settings.LLM_BACKEND == "openai":
+        for piece in _stream_text_via_openai_api(
+            prompt, system_prompt, max_new_tokens, temperature, top_p
+        ):
+            if stop_event.is_set():
+                # 退出循环后生成器被回收，HTTP 流随之关闭，服务端停止生成
+                break
+            yield piece
+        return
+
+    _load_llm_model()
+
+    if llm_model is None or llm_tokenizer is None:
+        raise RuntimeError("LLM 模型实例未成功加载，无法生成文本。")
+
+    model_inputs, past_key_values = _build_model_inputs(
+        prompt, system_prompt, cache_prefix
+    )
+    streamer = TextIteratorStreamer(
+        llm_tokenizer, skip_prompt=True, skip_special_tokens=True
+    )
+    generation_errors: list[Exception] = []
+
+    def _generate():
+        try:
+            with torch.inference_mode():
+                llm_model.generate(
+                    **model_inputs,
+                    **_generation_kwargs(
+                        past_key_values, max_new_tokens, temperature, top_p
+                    ),
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop_event)]),
+                )
+        except Exception as e:
+            generation_errors.append(e)
+            # 出错时结束流，避免消费方一直等待
+            streamer.end()
+
+    # generate 在后台线程中运行，生成的 token 经 streamer 逐段交给当前线程
+    generation_thread = threading.Thread(target=_generate, daemon=True)
+    generation_thread.start()
+    try:
+        yield from streamer
+    finally:
+        # 消费方提前关闭生成器时，让后台的 generate 在下一个 token 处停止
+        stop_event.set()
+    generation_thread.join()
+
+    if generation_errors:
+        logger.error(f"LLM 流式生成文本时发生错误: {generation_errors[0]}")
+        raise RuntimeError(
+            f"LLM 生成文本失败: {generation_errors[0]}"
+        ) from generation_errors[0]
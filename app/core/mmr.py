@@ -0,0 +1,36 @@
+import numpy as np
+
+
+def mmr_select(
+    query_vec: np.ndarray, doc_mat: np.ndarray, lambda_mult: float, k: int
+) -> list[int]:
+    """
+    最大边际相关性（MMR）贪心选择，返回被选中文档在 doc_mat 中的行号（按选中顺序）。
+
+    每一步选择 lambda_mult * 与查询的相似度 - (1 - lambda_mult) * 与已选文档的最大相似度
+    最高的文档。向量均已 L2 归一化，相似度即点积；与已选文档的最大相似度增量维护，
+    每选中一个文档只需一次矩阵-向量乘法，doc_mat 总共只被扫描 k 次。
+    """
+    doc_mat = np.ascontiguousarray(doc_mat, dtype=np.float32)
+    query_vec = np.ascontiguousarray(query_vec, dtype=np.float32)
+    n = doc_mat.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return []
+
+    relevance = lambda_mult * (doc_mat @ query_vec)
+    max_similarity = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected: list[int] = []
+    for _ in range(k):
+        # 第一步尚无已选文档，只按相关性选择
+        scores = (
+            relevance
+            if not selected
+            else relevance - (1 - lambda_mult) * max_similarity
+        )
+        best = int(np.argmax(np.where(available, scores, -np.inf)))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, doc_mat @ doc_mat[best], out=max_similarity)
+    return selected
@@ -0,0 +1,42 @@
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+from loguru import logger
+
+# 按优先级排列的执行提供程序，实际使用其中当前安装的 onnxruntime 支持的部分
+_PREFERRED_PROVIDERS = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+
+
+def create_onnx_session(model_path: str) -> ort.InferenceSession:
+    """
+    创建开启全部图优化的 ONNX Runtime 推理会话，有 CUDA 提供程序时优先使用 GPU。
+    """
+    path = Path(model_path)
+    if not path.exists():
+        raise FileNotFoundError(f"ONNX 模型不存在: {path.absolute()}")
+
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    available = set(ort.get_available_providers())
+    providers = [p for p in _PREFERRED_PROVIDERS if p in available]
+    session = ort.InferenceSession(
+        str(path), sess_options=sess_options, providers=providers
+    )
+    logger.info(f"ONNX 模型 {path.name} 加载完成，执行提供程序: {session.get_providers()}")
+    return session
+
+
+def run_onnx_session(
+    session: ort.InferenceSession, inputs: dict[str, np.ndarray]
+) -> np.ndarray:
+    """
+    通过 IOBinding 执行推理并返回第一个输出：输入只拷贝一次到执行设备，
+    输出直接写入 CPU 内存，省去 session.run 内部的中间拷贝。
+    """
+    binding = session.io_binding()
+    for name, value in inputs.items():
+        binding.bind_cpu_input(name, np.ascontiguousarray(value))
+    binding.bind_output(session.get_outputs()[0].name)
+    session.run_with_iobinding(binding)
+    return binding.copy_outputs_to_cpu()[0]
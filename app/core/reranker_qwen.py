@@ -1,9 +1,20 @@
+from functools import partial
 from pathlib import Path
 from loguru import logger
 import torch
 
 # Qwen Reranker 使用 AutoModelForCausalLM
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoModelForCausalLM, BitsAndBytesConfig, DynamicCache
+
+from app.core.batch_prefetch import (
+    length_bucketed_batches,
+    move_to_device,
+    pin_for_device,
+    prefetch_batches,
+)
+from app.core.config import settings
+from app.core.onnx_session import create_onnx_session, run_onnx_session
+from app.core.tokenizer_cache import get_tokenizer
 from app.schemas.schemas import TextChunkResponse
 
 # --- 1. 模型常量 ---
@@ -20,6 +31,7 @@ QWEN_RERANKER_MAX_LENGTH = 8192
 reranker_tokenizer = None
 reranker_model_global = None
 reranker_device = None
+reranker_onnx_session = None
 
 # Qwen Reranker 的特定提示词（Prompt）结构
 # 这些是固定的，只需要定义一次
@@ -38,10 +50,55 @@ token_true_id = None
 token_false_id = None
 
 
+def _build_quantization_config() -> BitsAndBytesConfig | None:
+    """
+    根据 RERANKER_QUANTIZATION 构造 bitsandbytes 量化配置，仅在 CUDA 上生效。
+    需要额外安装 bitsandbytes：uv add bitsandbytes
+    """
+    match settings.RERANKER_QUANTIZATION:
+        case "8bit":
+            return BitsAndBytesConfig(load_in_8bit=True)
+        case "4bit":
+            return BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=_cuda_half_dtype(),
+            )
+        case _:
+            return None
+
+
+def _cuda_half_dtype() -> torch.dtype:
+    """
+    GPU 上的半精度类型：Ampere 及更新的 GPU 使用 bfloat16（与 Qwen3 训练精度一致，
+    数值范围与 float32 相同，不会像 float16 那样在长输入上溢出），更老的 GPU 退回 float16。
+    """
+    return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+
+
+def _load_reranker_tokenizer() -> None:
+    global reranker_tokenizer, prefix_tokens, suffix_tokens, token_true_id, token_false_id
+
+    reranker_tokenizer = get_tokenizer(RERANKER_MODEL_PATH, padding_side="left")
+
+    # 初始化提示词的 token
+    # 这些只需要计算一次，所以放在加载函数里
+    prefix_tokens = reranker_tokenizer.encode(PREFIX, add_special_tokens=False)
+    suffix_tokens = reranker_tokenizer.encode(SUFFIX, add_special_tokens=False)
+    token_true_id = reranker_tokenizer.convert_tokens_to_ids("yes")
+    token_false_id = reranker_tokenizer.convert_tokens_to_ids("no")
+
+
 def _load_reranker_model():
-    global reranker_tokenizer, reranker_model_global, reranker_device
-    global prefix_tokens, suffix_tokens, token_true_id, token_false_id
+    global reranker_model_global, reranker_device, reranker_onnx_session
 
+    if settings.RERANKER_ONNX_PATH:
+        if reranker_onnx_session is None:
+            _load_reranker_tokenizer()
+            # 输入以 numpy 数组交给 ONNX Runtime，由它负责拷贝到执行设备
+            reranker_device = torch.device("cpu")
+            reranker_onnx_session = create_onnx_session(settings.RERANKER_ONNX_PATH)
+        return
     if reranker_tokenizer is None or reranker_model_global is None:
         logger.info(f"首次加载 Reranker 模型: {RERANKER_MODEL_NAME}...")
         try:
@@ -52,49 +109,99 @@ def _load_reranker_model():
             logger.info(f"从本地加载 Reranker 模型: {model_path}...")
 
             # --- 3. Tokenizer 和模型加载方式 ---
-            reranker_tokenizer = AutoTokenizer.from_pretrained(
-                RERANKER_MODEL_PATH, padding_side="left"
-            )
-
-            # 初始化提示词的 token
-            # 这些只需要计算一次，所以放在加载函数里
-            prefix_tokens = reranker_tokenizer.encode(PREFIX, add_special_tokens=False)
-            suffix_tokens = reranker_tokenizer.encode(SUFFIX, add_special_tokens=False)
-            token_true_id = reranker_tokenizer.convert_tokens_to_ids("yes")
-            token_false_id = reranker_tokenizer.convert_tokens_to_ids("no")
+            _load_reranker_tokenizer()
 
             # 判断设备并加载模型
-            if torch.cuda.is_available():
+            quantization_config = _build_quantization_config()
+            half_dtype = _cuda_half_dtype() if torch.cuda.is_available() else torch.float16
+            if torch.cuda.is_available() and quantization_config is not None:
+                reranker_device = torch.device("cuda")
+                logger.info(
+                    f"检测到 CUDA，Reranker 模型将以 {settings.RERANKER_QUANTIZATION} 量化加载到 GPU。"
+                )
+                try:
+                    # 量化模型由 bitsandbytes 自行放置到 GPU，不能再调用 .to(device)
+                    reranker_model_global = AutoModelForCausalLM.from_pretrained(
+                        RERANKER_MODEL_PATH,
+                        quantization_config=quantization_config,
+                        device_map={"": reranker_device.index or 0},
+                        torch_dtype=half_dtype,
+                        attn_implementation="sdpa",
+                    )
+                except Exception as e:
+                    logger.warning(f"量化加载 Reranker 失败: {e}，将使用 {half_dtype}。")
+                    reranker_model_global = AutoModelForCausalLM.from_pretrained(
+                        RERANKER_MODEL_PATH, torch_dtype=half_dtype, attn_implementation="sdpa"
+                    ).to(reranker_device)
+            elif torch.cuda.is_available():
                 reranker_device = torch.device("cuda")
                 logger.info("检测到 CUDA，Reranker 模型将使用 GPU。")
                 try:
                     reranker_model_global = AutoModelForCausalLM.from_pretrained(
                         RERANKER_MODEL_PATH,
-                        torch_dtype=torch.float16,
+                        torch_dtype=half_dtype,
                         attn_implementation="flash_attention_2",
                     ).to(reranker_device)
                     logger.info("已启用 Flash Attention 2 加速。")
                 except Exception as e:
                     logger.warning(
-                        f"加载 Flash Attention 2 失败: {e}，将使用标准模式。"
+                        f"加载 Flash Attention 2 失败: {e}，将使用 PyTorch SDPA 注意力。"
                     )
                     reranker_model_global = AutoModelForCausalLM.from_pretrained(
-                        RERANKER_MODEL_PATH, torch_dtype=torch.float16
+                        RERANKER_MODEL_PATH, torch_dtype=half_dtype, attn_implementation="sdpa"
                     ).to(reranker_device)
             elif torch.backends.mps.is_available():
                 reranker_device = torch.device("mps")
                 logger.info("检测到 MPS，Reranker 模型将使用 MPS。")
+                # 与 Embedding 模型一致，Apple Silicon 上使用 bfloat16
                 reranker_model_global = AutoModelForCausalLM.from_pretrained(
-                    RERANKER_MODEL_PATH, torch_dtype=torch.float16
+                    RERANKER_MODEL_PATH, torch_dtype=torch.bfloat16, attn_implementation="sdpa"
                 ).to(reranker_device)
             else:
                 reranker_device = torch.device("cpu")
                 logger.info("未检测到 CUDA 或 MPS，Reranker 模型将使用 CPU。")
                 reranker_model_global = AutoModelForCausalLM.from_pretrained(
-                    RERANKER_MODEL_PATH
+                    RERANKER_MODEL_PATH, attn_implementation="sdpa"
                 ).to(reranker_device)
+                # 可选：只量化 Transformer 主干的 Linear 层，lm_head 保持 float32，
+                # 避免 "yes"/"no" 两个 logits 的差值受量化误差影响
+                if settings.RERANKER_CPU_INT8:
+                    reranker_model_global.eval()
+                    reranker_model_global.model = torch.ao.quantization.quantize_dynamic(
+                        reranker_model_global.model, {torch.nn.Linear}, dtype=torch.qint8
+                    )
+                    logger.info("已对 Reranker 主干的 Linear 层启用动态 int8 量化。")
 
             reranker_model_global.eval()
+
+            # 可选：torch.compile 融合算子、减少逐算子的 Python 调度开销。
+            # 仅用于 CUDA 上的非量化模型；首次前向会触发编译，耗时较长。
+            # dynamic=True 避免每个新的批次大小/序列长度都重新编译
+            if (
+                settings.RERANKER_TORCH_COMPILE
+                and reranker_device.type == "cuda"
+                and quantization_config is None
+            ):
+                try:
+                    compiled_model = torch.compile(
+                        reranker_model_global,
+                        mode=settings.RERANKER_TORCH_COMPILE_MODE,
+                        dynamic=True,
+                    )
+                    # torch.compile 是惰性的，编译错误要到首次前向才会出现：
+                    # 在这里做一次试运行，失败时保留未编译的模型，而不是让第一个请求失败
+                    probe_ids = torch.zeros((1, 8), dtype=torch.long, device=reranker_device)
+                    with torch.inference_mode():
+                        compiled_model(
+                            input_ids=probe_ids,
+                            attention_mask=torch.ones_like(probe_ids),
+                            logits_to_keep=1,
+                        )
+                    reranker_model_global = compiled_model
+                    logger.info("已使用 torch.compile 编译 Reranker 模型。")
+                except Exception as e:
+                    logger.warning(f"torch.compile 编译 Reranker 失败: {e}，将使用 eager 模式。")
+
             logger.info(
                 f"Reranker 模型 {RERANKER_MODEL_NAME} 加载完成并移至 {reranker_device}。"
             )
@@ -105,11 +212,65 @@ def _load_reranker_model():
             raise RuntimeError(f"无法加载 Reranker 模型: {RERANKER_MODEL_NAME}") from e
 
 
+def _build_left_padded_batch(
+    batch_ids: list[list[int]], past_length: int = 0
+) -> dict[str, torch.Tensor]:
+    """
+    直接在 CPU 上构造左填充的 input_ids 与 attention_mask 张量（CUDA 上放入锁页内存），
+    不经过 tokenizer.pad 的逐条字典处理。
+    序列长度按 RERANKER_PAD_TO_MULTIPLE_OF 分桶，编译后的图（含 CUDA Graph）可以按桶复用。
+    past_length > 0 表示前 past_length 个 token 已在 KV 缓存中：注意力掩码需覆盖这些位置，
+    并显式给出位置编号，使填充位于前缀与文档之间时文档仍紧接前缀连续编号。
+    """
+    lengths = [len(ids) for ids in batch_ids]
+    max_len = max(lengths)
+    multiple = settings.RERANKER_PAD_TO_MULTIPLE_OF
+    if multiple:
+        max_len = -(-max_len // multiple) * multiple
+
+    pad_id = reranker_tokenizer.pad_token_id
+    input_ids = torch.tensor(
+        [[pad_id] * (max_len - len(ids)) + ids for ids in batch_ids], dtype=torch.long
+    )
+    # 左填充：每行最后 length 个位置为有效 token
+    pad_lengths = max_len - torch.tensor(lengths)
+    attention_mask = (
+        torch.arange(max_len).unsqueeze(0) >= pad_lengths.unsqueeze(1)
+    ).long()
+    tensors = {"input_ids": input_ids, "attention_mask": attention_mask}
+    if past_length:
+        tensors["position_ids"] = (
+            past_length + attention_mask.cumsum(dim=1) - 1
+        ).clamp_min(past_length)
+        tensors["attention_mask"] = torch.cat(
+            [torch.ones(len(batch_ids), past_length, dtype=torch.long), attention_mask],
+            dim=1,
+        )
+    return pin_for_device(tensors, reranker_device)
+
+
+def _expand_prefix_cache(prefix_cache: DynamicCache, batch_size: int) -> DynamicCache:
+    """
+    把批大小为 1 的前缀 KV 扩展为 batch_size 份供一个小批次使用。
+    expand 只是视图，不复制显存；前向追加 KV 时 torch.cat 会生成新张量，前缀本身不被修改。
+    """
+    return DynamicCache.from_legacy_cache(
+        tuple(
+            (key.expand(batch_size, -1, -1, -1), value.expand(batch_size, -1, -1, -1))
+            for key, value in prefix_cache.to_legacy_cache()
+        )
+    )
+
+
 def rerank_documents(
-    query: str, documents: list[TextChunkResponse], task_instruction: str = None
+    query: str,
+    documents: list[TextChunkResponse],
+    task_instruction: str = None,
+    top_n: int | None = None,
 ) -> list[tuple[TextChunkResponse, float]]:
     """
     使用 Qwen3-Reranker-4B 模型对初步检索到的文档块列表进行重排序。
+    指定 top_n 时只返回得分最高的 top_n 个文档块。
     """
     _load_reranker_model()
 
@@ -125,53 +286,127 @@ def rerank_documents(
             "Given a web search query, retrieve relevant passages that answer the query"
         )
 
-    pairs = [
-        f"<Instruct>: {task_instruction}\n<Query>: {query}\n<Document>: {doc.chunk_text}"
-        for doc in documents
-    ]
-
     try:
-        with torch.no_grad():
+        with torch.inference_mode():
             # 4.2 自定义 Tokenization 过程
-            # 先对核心文本进行 tokenize，不填充，不加特殊符号
-            inputs = reranker_tokenizer(
-                pairs,
+            # 指令 + 查询部分对所有候选文档都相同，只 tokenize 一次；
+            # 文档单独批量 tokenize，再在 id 层面拼接，避免把同一段查询重复分词 N 次
+            max_length = min(settings.RERANKER_MAX_LENGTH, QWEN_RERANKER_MAX_LENGTH)
+            query_ids = reranker_tokenizer.encode(
+                f"<Instruct>: {task_instruction}\n<Query>: {query}\n<Document>: ",
+                add_special_tokens=False,
+            )
+            # 至少给文档留出一半长度，超长查询从尾部截断
+            doc_budget = max_length - len(prefix_tokens) - len(suffix_tokens)
+            query_ids = query_ids[: max(doc_budget // 2, doc_budget - len(query_ids))]
+            doc_max_length = doc_budget - len(query_ids)
+            # 内容相同的候选文档只打分一次，最后再按下标展开回每个文档
+            unique_index: dict[str, int] = {}
+            inverse = [
+                unique_index.setdefault(doc.chunk_text, len(unique_index))
+                for doc in documents
+            ]
+            doc_inputs = reranker_tokenizer(
+                list(unique_index),
+                add_special_tokens=False,
                 padding=False,
-                truncation="longest_first",
+                truncation=True,
                 return_attention_mask=False,
-                max_length=QWEN_RERANKER_MAX_LENGTH
-                - len(prefix_tokens)
-                - len(suffix_tokens),
+                max_length=doc_max_length,
             )
 
-            # 手动为每个序列加上前后缀
-            for i in range(len(inputs["input_ids"])):
-                inputs["input_ids"][i] = (
-                    prefix_tokens + inputs["input_ids"][i] + suffix_tokens
+            # 拼接前缀、查询、文档和后缀
+            query_part = prefix_tokens + query_ids
+            prefix_cache = None
+            # 导出的 ONNX 图只接受完整输入，不支持外部传入的 KV 缓存
+            if settings.RERANKER_SHARE_QUERY_PREFIX and reranker_onnx_session is None:
+                # 系统提示 + 指令 + 查询对所有候选文档相同：只前向一次得到 KV 缓存，
+                # 之后每个小批次只需计算文档和后缀部分的 token
+                prefix_cache = DynamicCache()
+                reranker_model_global(
+                    input_ids=torch.tensor([query_part], device=reranker_device),
+                    past_key_values=prefix_cache,
+                    use_cache=True,
+                    logits_to_keep=1,
+                )
+                all_input_ids = [
+                    doc_ids + suffix_tokens for doc_ids in doc_inputs["input_ids"]
+                ]
+                build_batch = partial(
+                    _build_left_padded_batch, past_length=len(query_part)
+                )
+            else:
+                all_input_ids = [
+                    query_part + doc_ids + suffix_tokens
+                    for doc_ids in doc_inputs["input_ids"]
+                ]
+                build_batch = _build_left_padded_batch
+
+            # 4.3 按长度排序后分成小批次前向：同一批次内长度接近，填充量最小，
+            #     且峰值显存只与小批次大小有关，而不是一次性填充全部候选文档
+            #     长度相差超过 RERANKER_MAX_LENGTH_RATIO 倍时提前切分，短文档不会被填充到长文档的长度
+            lengths = [len(ids) for ids in all_input_ids]
+            order = torch.argsort(torch.tensor(lengths), stable=True)
+            sorted_scores: list[torch.Tensor] = []
+            micro_batches = [
+                [all_input_ids[i] for i in batch_indices]
+                for batch_indices in length_bucketed_batches(
+                    order.tolist(),
+                    lengths,
+                    settings.RERANKER_MICRO_BATCH_SIZE,
+                    settings.RERANKER_MAX_LENGTH_RATIO,
                 )
+            ]
+            # 下一个小批次的张量在后台线程中构造，与当前小批次的前向重叠
+            for cpu_inputs in prefetch_batches(build_batch, micro_batches):
+                if reranker_onnx_session is not None:
+                    # 导出的 ONNX 图内已完成 "yes"/"no" 打分
+                    sorted_scores.append(
+                        torch.from_numpy(
+                            run_onnx_session(
+                                reranker_onnx_session,
+                                {k: v.numpy() for k, v in cpu_inputs.items()},
+                            )
+                        )
+                    )
+                    continue
 
-            # 对整个批次进行填充
-            inputs = reranker_tokenizer.pad(inputs, padding=True, return_tensors="pt")
-            inputs = {k: v.to(reranker_device) for k, v in inputs.items()}
+                batch_inputs = move_to_device(cpu_inputs, reranker_device)
+                if prefix_cache is not None:
+                    batch_inputs["past_key_values"] = _expand_prefix_cache(
+                        prefix_cache, batch_inputs["input_ids"].shape[0]
+                    )
 
-            # 4.3 计算分数
-            # 获取模型在最后一个 token 位置上的 logits
-            last_token_logits = reranker_model_global(**inputs).logits[:, -1, :]
+                # 只让 lm_head 计算最后一个位置的 logits，不再生成 (batch, seq, vocab) 的完整张量
+                last_token_logits = reranker_model_global(
+                    **batch_inputs, logits_to_keep=1
+                ).logits[:, -1, :]
 
-            # 提取 "yes" 和 "no" 两个词的 logits
-            true_vector = last_token_logits[:, token_true_id]
-            false_vector = last_token_logits[:, token_false_id]
+                # "yes"/"no" 二分类 softmax 中 "yes" 的概率等于 sigmoid(yes - no)，
+                # 只读两列；转为 float32 后再相减，半精度/量化模型下也能保持得分精度
+                sorted_scores.append(
+                    torch.sigmoid(
+                        last_token_logits[:, token_true_id].float()
+                        - last_token_logits[:, token_false_id].float()
+                    )
+                )
 
-            # 计算 LogSoftmax 并转换为概率
-            batch_scores = torch.stack([false_vector, true_vector], dim=1)
-            batch_scores = torch.nn.functional.log_softmax(batch_scores, dim=1)
-            # 取出 "yes" 的概率作为最终得分
-            scores = batch_scores[:, 1].exp().cpu().tolist()
+            # 恢复排序前的顺序与去重后的展开合并为一次 gather：
+            # sorted_position[u] 为第 u 个唯一文档在排序结果中的位置
+            sorted_position = torch.empty_like(order)
+            sorted_position[order] = torch.arange(len(order))
+            gather_index = sorted_position[torch.tensor(inverse)]
+            yes_probs = torch.cat(sorted_scores)[gather_index.to(reranker_device)]
 
-        # 4.4 关联分数并排序
-        scored_documents = sorted(
-            zip(documents, scores), key=lambda x: x[1], reverse=True
-        )
+            # 4.4 在设备上直接用 topk 选出并排序得分最高的文档，只把需要的结果拷回 CPU
+            k = len(documents) if top_n is None else min(top_n, len(documents))
+            top_scores, top_indices = torch.topk(yes_probs, k=k, sorted=True)
+            top_scores = top_scores.float().cpu().tolist()
+            top_indices = top_indices.cpu().tolist()
+
+        scored_documents = [
+            (documents[idx], score) for idx, score in zip(top_indices, top_scores)
+        ]
 
         logger.info(
             f"对 {len(documents)} 个文档块进行了 Rerank，查询: '{query[:50]}...'"
@@ -181,3 +416,21 @@ def rerank_documents(
     except Exception as e:
         logger.error(f"使用 Reranker 对文档块进行重排序时发生错误: {e}", exc_info=True)
         raise
+
+
+def warmup_reranker_model() -> None:
+    """
+    加载 Reranker 模型并对一个样例执行一次打分作为预热，
+    提前付出 CUDA 初始化、torch.compile 编译等一次性开销。
+    """
+    _load_reranker_model()
+    rerank_documents(
+        "warmup",
+        [
+            TextChunkResponse.model_construct(
+                id=0, source_document_id=0, chunk_text="warmup", sequence_in_document=0
+            )
+        ],
+        task_instruction=settings.RERANKER_INSTRUCTION,
+    )
+    logger.info("Reranker 模型预热完成。")
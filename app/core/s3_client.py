@@ -1,5 +1,6 @@
 import boto3
 from loguru import logger
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
 from botocore.exceptions import ClientError
 
@@ -17,6 +18,15 @@ s3_client = boto3.client(
     region_name='us-east-1'
 )
 
+# 上传使用的分片传输配置：超过 8MB 的文件按 8MB 分片并发上传，
+# upload_fileobj 逐片读取源文件流，内存占用与分片大小相关而与文件大小无关
+upload_transfer_config = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True,
+)
+
 
 def ensure_minio_bucket_exists(bucket_name: str):
     try:
@@ -0,0 +1,23 @@
+from functools import lru_cache
+
+from loguru import logger
+from transformers import AutoTokenizer, PreTrainedTokenizerBase
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(
+    model_path: str, padding_side: str | None = None
+) -> PreTrainedTokenizerBase:
+    """
+    按 (模型路径, padding 方向) 加载并缓存分词器，同一进程内相同配置只加载一次。
+    显式使用 fast tokenizer（Rust 实现）。
+
+    注意：fast tokenizer 在 truncation/padding 设置不同的调用之间并发使用时
+    可能报 "Already borrowed"，因此调用方式差异很大的场景应使用不同的 padding_side 键
+    （或不共享实例）。
+    """
+    kwargs = {"use_fast": True}
+    if padding_side is not None:
+        kwargs["padding_side"] = padding_side
+    logger.info(f"加载分词器: {model_path} (padding_side={padding_side})")
+    return AutoTokenizer.from_pretrained(model_path, **kwargs)
@@ -1,24 +1,28 @@
 import asyncio
+import sys
 
 from fastapi import FastAPI, Response
-import gradio as gr
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from loguru import logger
 
 from app.core.config import settings
 from app.core.database import initialize_database_for_fastapi, close_database_for_fastapi
 from app.core.s3_client import ensure_minio_bucket_exists
-from app.core.embedding_qwen import _load_embedding_model
-from app.core.reranker_qwen import _load_reranker_model
-from app.core.llm_service import _load_llm_model
+from app.core.embedding_qwen import warmup_embedding_model
+from app.core.reranker_qwen import warmup_reranker_model
+from app.core.llm_service import warmup_llm
 from app.utils.migrations import run_migrations
 from app.source_doc.routes import router as source_doc_router
 from app.query.routes import router as query_router
-from app.ui.gradio_interface import rag_demo_ui
+from app.query.service import QueryService
 
 
-# Run migrations on startup
-run_migrations()
+# 日志经队列交给后台线程写出，请求处理和事件循环不会因 stderr 管道写满而阻塞；
+# 非 DEBUG 模式下不输出逐请求的调试日志
+logger.remove()
+logger.add(sys.stderr, level="DEBUG" if settings.DEBUG else "INFO", enqueue=True)
 
 
 @asynccontextmanager
@@ -29,42 +33,76 @@ run_migrations()
 #     await close_database_for_fastapi()
 async def lifespan(app: FastAPI):
     # --- 应用启动阶段 ---
-    print("应用启动，开始并行加载所有资源...")
+    logger.info("应用启动，开始并行加载所有资源...")
     
     # 将所有同步的、耗时的启动任务都封装成一个可在事件循环中等待的对象
     # 这样可以防止它们阻塞主线程
     startup_tasks = [
         asyncio.to_thread(initialize_database_for_fastapi),
         asyncio.to_thread(ensure_minio_bucket_exists, bucket_name=settings.MINIO_BUCKET),
-        # asyncio.to_thread(_load_embedding_model),
-        # asyncio.to_thread(_load_reranker_model),
-        # asyncio.to_thread(_load_llm_model)
-        #  配置足够的话，可以在开始时加载所有模型
     ]
+    # 数据库迁移不再在导入模块时同步执行，而是与其他启动任务并行
+    if settings.RUN_MIGRATIONS_ON_STARTUP:
+        startup_tasks.append(asyncio.to_thread(run_migrations))
+
+    # 启动时加载并预热模型，避免首个请求承担冷启动延迟；各模型在不同线程中并行加载。
+    # 查询路径一定会用到 Embedding 和 Reranker；LLM 较大，配置足够时再开启
+    warmups = {
+        "Embedding": (settings.EMBEDDING_WARMUP_ON_STARTUP, warmup_embedding_model),
+        "Reranker": (settings.RERANKER_WARMUP_ON_STARTUP, warmup_reranker_model),
+        "LLM": (settings.LLM_WARMUP_ON_STARTUP, warmup_llm),
+    }
+    enabled_warmups = {
+        name: warmup for name, (enabled, warmup) in warmups.items() if enabled
+    }
+    # 模型预热只读取本地权重，与数据库、MinIO 的初始化互不依赖，两组任务同时进行
+    warmup_gather = asyncio.gather(
+        *(asyncio.to_thread(warmup) for warmup in enabled_warmups.values()),
+        return_exceptions=True,
+    )
 
     # 使用 asyncio.gather 来【并行】执行所有启动任务
     # 这会比一个一个顺序执行要快得多
-    await asyncio.gather(*startup_tasks)
+    try:
+        await asyncio.gather(*startup_tasks)
+    finally:
+        warmup_results = await warmup_gather
+
+    # QueryService 不持有请求级状态，全进程共用一个实例，路由依赖直接从 app.state 取用
+    app.state.query_service = QueryService()
+
+    for name, result in zip(enabled_warmups, warmup_results):
+        if isinstance(result, Exception):
+            # 预热失败不阻止应用启动，模型会在首次请求时按需加载
+            logger.warning(f"{name} 模型预热失败: {result}")
     
-    print("所有资源加载完毕，应用准备就绪。🚀")
+    logger.info("所有资源加载完毕，应用准备就绪。🚀")
 
     yield
 
     # --- 应用关闭阶段 ---
-    print("应用关闭，开始释放资源...")
+    logger.info("应用关闭，开始释放资源...")
     await close_database_for_fastapi()
-    print("资源释放完毕。")  
+    logger.info("资源释放完毕。")
 
 
-app = FastAPI(title=settings.app_name, version="0.1.0", lifespan=lifespan)
+# JSON 响应统一使用 orjson 序列化，直接输出 bytes，比标准库 json 快数倍
+app = FastAPI(
+    title=settings.app_name,
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 
+# 显式的来源白名单：通配来源与 allow_credentials 同时使用会被浏览器拒绝；
+# 方法和请求头只放行 API 实际用到的部分，预检请求无需回显任意请求头
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=settings.CORS_ALLOWED_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "DELETE"],
+    allow_headers=["Authorization", "Content-Type"],
 )
 
 
@@ -72,10 +110,16 @@ app.include_router(source_doc_router)
 app.include_router(query_router)
 
 # vvv 关键的一行：将 Gradio 应用挂载到 FastAPI vvv
-# 这会在您的应用下创建一个 /gradio 路径，用于展示 UI 界面
-app = gr.mount_gradio_app(app, rag_demo_ui, path="/gradio")
+# 这会在您的应用下创建一个 /gradio 路径，用于展示 UI 界面。
+# gradio 的导入链很重（pandas 等），只在启用界面时才导入
+if settings.ENABLE_GRADIO:
+    import gradio as gr
+
+    from app.ui.gradio_interface import rag_demo_ui
+
+    app = gr.mount_gradio_app(app, rag_demo_ui, path="/gradio")
 
-@app.get("/health")
-async def health_check(response: Response):
-    response.status_code = 200
-    return {"status": "ok 👍 "}
+# 健康检查：不构造、不序列化响应体，直接返回 204
+@app.get("/health", status_code=204, include_in_schema=False)
+async def health_check() -> Response:
+    return Response(status_code=204)
@@ -1,9 +1,10 @@
-from datetime import datetime, timezone
+from datetime import datetime
 from typing import Optional, List
 import enum
 
-from sqlalchemy import ForeignKey, Integer, String, DateTime, Text, JSON
-from sqlalchemy import Enum as SQLAlchemyEnum
+from sqlalchemy import CHAR, ForeignKey, Index, Integer, String, DateTime, Text, LargeBinary, func
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column, relationship, DeclarativeBase
 
 # --- 基础类和混入 (Mixin) ---
@@ -11,13 +12,17 @@ class Base(DeclarativeBase):
     pass
 
 class DateTimeMixin:
+    # 时间戳由数据库在写入时填充，批量插入不必在 Python 中为每一行构造 datetime；
+    # eager_defaults 让 INSERT/UPDATE 通过 RETURNING 取回服务端生成的值，异步会话中不会触发延迟加载
+    __mapper_args__ = {"eager_defaults": True}
+
     created_at: Mapped[datetime] = mapped_column(
-        DateTime(timezone=True), index=True, default=lambda: datetime.now(timezone.utc)
+        DateTime(timezone=True), index=True, server_default=func.now()
     )
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
-        default=lambda: datetime.now(timezone.utc),
-        onupdate=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
+        onupdate=func.now(),
     )
 
 # --- 源文档和文本块模型 ---
@@ -36,23 +41,45 @@ class SourceDocument(Base, DateTimeMixin):
     error_message: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     number_of_chunks: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
+    # 删除文档时由数据库的 ON DELETE CASCADE 删除文本块（passive_deletes），
+    # ORM 不再先把该文档的全部文本块（含 chunk_text）加载进来逐条删除；
+    # lazy="raise" 禁止隐式懒加载，需要时须在查询中显式 selectinload
     text_chunks: Mapped[List["TextChunk"]] = relationship(
-        "TextChunk", back_populates="source_document", cascade="all, delete-orphan"
+        "TextChunk",
+        back_populates="source_document",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        lazy="raise",
     )
 
 class TextChunk(Base, DateTimeMixin):
     __tablename__ = "text_chunks"
+    # 按文档取出全部文本块并按顺序排列时可直接范围扫描该索引，省去排序；
+    # 以 source_document_id 开头，也覆盖了按文档删除、外键级联等只按文档过滤的查询
+    __table_args__ = (
+        Index("ix_chunk_doc_seq", "source_document_id", "sequence_in_document"),
+        # 支持 metadata_json @> '{"page_number": 5}' 这类按元数据过滤的查询
+        Index(
+            "ix_chunk_meta_gin",
+            "metadata_json",
+            postgresql_using="gin",
+            postgresql_ops={"metadata_json": "jsonb_path_ops"},
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     source_document_id: Mapped[int] = mapped_column(
-        ForeignKey("source_documents.id", ondelete="CASCADE"), nullable=False, index=True
+        ForeignKey("source_documents.id", ondelete="CASCADE"), nullable=False
     )
     source_document: Mapped["SourceDocument"] = relationship(
-        "SourceDocument", back_populates="text_chunks"
+        "SourceDocument", back_populates="text_chunks", lazy="raise"
     )
     chunk_text: Mapped[str] = mapped_column(Text, nullable=False)
     sequence_in_document: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
-    metadata_json: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    # JSONB 以解析后的二进制格式存储，读取时无需重新解析文本，并且可以建立 GIN 索引
+    metadata_json: Mapped[Optional[dict]] = mapped_column(JSONB, nullable=True)
+    # 文本内容的 128 位哈希，用于在入库时找到内容相同的已有文本块并复用其向量
+    content_hash: Mapped[Optional[bytes]] = mapped_column(LargeBinary(16), nullable=True, index=True)
 
 # --- 全新设计的 Message 模型 ---
 
@@ -60,6 +87,28 @@ class MessageAuthor(str, enum.Enum):
     USER = "user"
     BOT = "bot"
 
+class MessageAuthorType(TypeDecorator):
+    """
+    以单个字符存储 MessageAuthor（'u' / 'b'），比 PostgreSQL 枚举或变长字符串更窄，
+    行和索引都随之变小。
+    """
+
+    impl = CHAR(1)
+    cache_ok = True
+
+    _TO_DB = {MessageAuthor.USER: "u", MessageAuthor.BOT: "b"}
+    _FROM_DB = {code: author for author, code in _TO_DB.items()}
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return self._TO_DB[MessageAuthor(value)]
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self._FROM_DB[value]
+
 class Message(Base, DateTimeMixin):
     __tablename__ = "messages"
 
@@ -79,8 +128,8 @@ class Message(Base, DateTimeMixin):
         "Message", back_populates="user_query"
     )
 
-    author: Mapped[MessageAuthor] = mapped_column(SQLAlchemyEnum(MessageAuthor), nullable=False)    
+    author: Mapped[MessageAuthor] = mapped_column(MessageAuthorType(), nullable=False)    
     
     content: Mapped[str] = mapped_column(Text, nullable=False)
     # 存储用于生成答案的上下文信息 (仅对 bot 消息有意义)
-    retrieved_chunk_ids: Mapped[Optional[List[int]]] = mapped_column(JSON, nullable=True)
\ No newline at end of file
+    retrieved_chunk_ids: Mapped[Optional[List[int]]] = mapped_column(JSONB, nullable=True)
\ No newline at end of file
@@ -0,0 +1,49 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from app.core.config import settings
+
+
+class RecentCandidateCache:
+    """
+    最近查询的召回结果缓存（进程内 LRU），键为规范化后查询文本的摘要。
+
+    命中时的候选块 ID 只用于推测性地提前读取 PostgreSQL，
+    与向量化、向量检索并行进行；最终使用的候选集仍以本次召回结果为准，
+    因此缓存过时只会浪费一次预取，不会影响结果。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._candidates: OrderedDict[bytes, list[int]] = OrderedDict()
+
+    @staticmethod
+    def _key(query: str) -> bytes:
+        # 忽略大小写和空白差异，UI 中重复提交的同一问题可以命中
+        normalized = " ".join(query.casefold().split())
+        return hashlib.sha256(normalized.encode()).digest()
+
+    def lookup(self, query: str) -> list[int] | None:
+        key = self._key(query)
+        with self._lock:
+            candidate_ids = self._candidates.get(key)
+            if candidate_ids is not None:
+                self._candidates.move_to_end(key)
+            return candidate_ids
+
+    def store(self, query: str, candidate_ids: list[int]) -> None:
+        if self.max_entries <= 0:
+            return
+        key = self._key(query)
+        with self._lock:
+            self._candidates[key] = list(candidate_ids)
+            self._candidates.move_to_end(key)
+            while len(self._candidates) > self.max_entries:
+                self._candidates.popitem(last=False)
+
+
+recent_candidate_cache = RecentCandidateCache(
+    max_entries=settings.CANDIDATE_PREFETCH_MAX_ENTRIES
+)
@@ -0,0 +1,43 @@
+import asyncio
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.core.embedding_qwen import embed_queries
+from app.query.micro_batcher import MicroBatcher
+
+
+class QueryEmbeddingBatcher(MicroBatcher):
+    """
+    把并发到达的查询向量化请求合并成批次：收到第一条请求后最多再等待
+    QUERY_EMBED_BATCH_WAIT_MS 毫秒或攒满 QUERY_EMBED_MAX_BATCH 条，
+    然后在线程中一次 embed_queries 调用完成编码，再把结果分发给各请求的 Future。
+    一个批次在 GPU 上执行期间，后续请求继续排队，组成下一个批次。
+    """
+
+    async def embed(self, text: str, task_description: str) -> np.ndarray:
+        return await self._submit((text, task_description))
+
+    async def _process_batch(self, batch: list[tuple[tuple[str, str], asyncio.Future]]) -> None:
+        # 同一批次内按任务指令分组，每组一次模型调用
+        groups: dict[str, list[tuple[str, asyncio.Future]]] = {}
+        for (text, task_description), future in batch:
+            groups.setdefault(task_description, []).append((text, future))
+        for task_description, items in groups.items():
+            try:
+                embeddings = await asyncio.to_thread(
+                    embed_queries, [text for text, _ in items], task_description
+                )
+            except Exception as e:
+                logger.error(f"批量查询向量化失败: {e}", exc_info=True)
+                self._fail([future for _, future in items], e)
+                continue
+            for (_, future), embedding in zip(items, embeddings):
+                self._resolve(future, embedding)
+
+
+query_embedding_batcher = QueryEmbeddingBatcher(
+    max_batch=settings.QUERY_EMBED_MAX_BATCH,
+    wait_ms=settings.QUERY_EMBED_BATCH_WAIT_MS,
+)
@@ -0,0 +1,63 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Any
+
+
+class MicroBatcher(ABC):
+    """
+    把并发到达的请求合并成批次的通用骨架：收到第一条请求后最多再等待 wait_ms 毫秒
+    或攒满 max_batch 条，然后交给子类的 _process_batch 一次处理，再把结果分发给各请求的 Future。
+    一个批次执行期间，后续请求继续排队，组成下一个批次。
+    """
+
+    def __init__(self, max_batch: int, wait_ms: float):
+        self.max_batch = max_batch
+        self.wait_seconds = wait_ms / 1000
+        # 队列和后台任务绑定事件循环，首次调用时在当前循环中创建
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def _submit(self, request: Any) -> Any:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future))
+        return await future
+
+    async def _collect_batch(self) -> list[tuple[Any, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_seconds
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # 等待窗口结束后已在队列中的请求也一并带上
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    @abstractmethod
+    async def _process_batch(self, batch: list[tuple[Any, asyncio.Future]]) -> None:
+        """处理一个批次，并为其中每个 Future 设置结果或异常。"""
+
+    async def _run(self) -> None:
+        while True:
+            await self._process_batch(await self._collect_batch())
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Any) -> None:
+        # 请求方可能已取消（客户端断开），此时丢弃结果
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(futures: list[asyncio.Future], error: BaseException) -> None:
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
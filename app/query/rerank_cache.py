@@ -0,0 +1,50 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from app.core.config import settings
+
+
+class RerankScoreCache:
+    """
+    Reranker 打分结果缓存（进程内 LRU），键为 (查询摘要, 文本块 ID)。
+
+    Reranker 是检索链路中最耗算力的一步，且得分只取决于指令、查询和文本块内容；
+    文本块写入后内容不再变化、主键也不会复用，因此同一查询再次检索到的候选块
+    可以直接复用历史得分，只对未命中的候选块执行前向计算。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._scores: OrderedDict[tuple[bytes, int], float] = OrderedDict()
+
+    @staticmethod
+    def query_key(query: str, task_instruction: str) -> bytes:
+        """指令与查询共同决定得分，一起做摘要；定长摘要避免在键中保存长查询文本。"""
+        return hashlib.sha256(f"{task_instruction}\0{query}".encode()).digest()
+
+    def lookup(self, query_key: bytes, chunk_ids: list[int]) -> dict[int, float]:
+        """返回已缓存的 {文本块 ID: 得分}，未命中的 ID 不出现在结果中。"""
+        hits: dict[int, float] = {}
+        with self._lock:
+            for chunk_id in chunk_ids:
+                score = self._scores.get((query_key, chunk_id))
+                if score is not None:
+                    self._scores.move_to_end((query_key, chunk_id))
+                    hits[chunk_id] = score
+        return hits
+
+    def store(self, query_key: bytes, scores: dict[int, float]) -> None:
+        """写入一批得分，超过容量时淘汰最久未使用的条目。"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for chunk_id, score in scores.items():
+                self._scores[(query_key, chunk_id)] = score
+                self._scores.move_to_end((query_key, chunk_id))
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+
+rerank_score_cache = RerankScoreCache(max_entries=settings.RERANK_CACHE_MAX_ENTRIES)
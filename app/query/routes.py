@@ -1,11 +1,11 @@
-from pydantic import BaseModel
-from fastapi import APIRouter, Depends, HTTPException
+import orjson
+from pydantic import BaseModel, ConfigDict, Field
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.database import get_db
-from app.text_chunk.repository import TextChunkRepository
-from app.text_chunk.service import TextChunkService
 from app.schemas.schemas import TextChunkResponse
 from .service import QueryService
 
@@ -13,48 +13,61 @@ from .service import QueryService
 router = APIRouter(prefix="/query", tags=["Query & RAG"])
 
 
-# 依赖注入 QueryService
-def get_query_service(db: AsyncSession = Depends(get_db)) -> QueryService:
-    text_chunk_repo = TextChunkRepository(db)
-    text_chunk_service_instance = TextChunkService(text_chunk_repo)
-    return QueryService(text_chunk_service=text_chunk_service_instance)
+# 依赖注入 QueryService：实例在应用启动时创建并挂在 app.state 上，这里直接取用
+def get_query_service(request: Request) -> QueryService:
+    return request.app.state.query_service
+
+
+# 请求体：创建后不再修改；拒绝未知字段，并去掉查询首尾的空白，
+# 避免只差空白的相同问题错过查询向量和答案缓存
+REQUEST_MODEL_CONFIG = ConfigDict(frozen=True, extra="forbid", str_strip_whitespace=True)
 
 
 class QueryRequest(BaseModel):  # 定义请求体
-    query: str
-    top_k: int = 5
+    model_config = REQUEST_MODEL_CONFIG
+
+    query: str = Field(..., min_length=1, max_length=2048, description="查询文本")
+    # 精排后返回的数量不超过第一阶段的召回数量
+    top_k: int = Field(5, ge=1, le=50, description="返回的文本块数量")
 
 
 class AskQueryRequest(BaseModel):  # 用于接收问答请求
-    query: str
+    model_config = REQUEST_MODEL_CONFIG
+
+    query: str = Field(..., min_length=1, max_length=2048, description="用户问题")
     # 可以添加 LLM 调用参数的可选字段，如果希望用户能控制
     # max_tokens: Optional[int] = 512
     # temperature: Optional[float] = 0.7
 
 
 class AskQueryResponse(BaseModel):  # 用于返回问答结果
+    model_config = ConfigDict(frozen=True)
+
     query: str
     answer: str
     retrieved_context_texts: list[str] | None = None  # 可选，是否返回上下文给前端
 
 
-@router.post("/retrieve-chunks", response_model=list[TextChunkResponse])
+@router.post(
+    "/retrieve-chunks",
+    response_model=list[TextChunkResponse],
+    response_model_exclude_none=True,  # 空的 metadata_json 等字段不再序列化输出
+)
 async def retrieve_chunks_for_query(
     request_data: QueryRequest,  # 使用请求体
     query_service: QueryService = Depends(get_query_service),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     根据用户查询，检索相关的文本块 (用于测试检索效果)。
     """
     try:
-        relevant_chunks = await query_service.retrieve_relevant_chunks(
-            query_text=request_data.query, top_k_final_reranked=request_data.top_k
+        # 没有相关文本块时直接返回空列表
+        return await query_service.retrieve_relevant_chunks(
+            db=db,
+            query_text=request_data.query,
+            top_k_final_reranked=request_data.top_k,
         )
-        if not relevant_chunks:
-            # 可以返回空列表，或者根据业务需求抛出 404
-            # raise HTTPException(status_code=404, detail="No relevant chunks found.")
-            pass
-        return relevant_chunks
     except ValueError as ve:  # 捕获服务层可能抛出的特定错误
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
@@ -62,10 +75,15 @@ async def retrieve_chunks_for_query(
         raise HTTPException(status_code=500, detail="Error retrieving chunks.")
 
 
-@router.post("/ask", response_model=AskQueryResponse)
+@router.post(
+    "/ask",
+    response_model=AskQueryResponse,
+    response_model_exclude_none=True,  # 没有上下文时不输出 retrieved_context_texts
+)
 async def ask_llm_question(
     request_data: AskQueryRequest,
     query_service: QueryService = Depends(get_query_service),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     接收用户查询，执行 RAG 流程（检索上下文 + LLM 生成答案），并返回结果。
@@ -73,6 +91,7 @@ async def ask_llm_question(
     try:
         # 调用 QueryService 中新的问答方法
         result_dict = await query_service.generate_answer_from_query(
+            db=db,
             query_text=request_data.query
             # 如果 AskQueryRequest 中定义了llm参数，可以在这里传递
             # llm_max_tokens=request_data.max_tokens or 512,
@@ -80,12 +99,7 @@ async def ask_llm_question(
         )
 
         # 如果发生错误，generate_answer_from_query 内部会记录日志，
-        # 并可能返回一个包含错误信息的 answer。
-        # 这里可以根据 result_dict 的内容进一步判断是否要抛出 HTTPException
-        if "error" in result_dict.get("answer", "").lower():  # 简单错误检查
-            # 可以不抛错，直接返回LLM服务返回的错误提示
-            pass
-
+        # 并在 answer 中返回错误提示，这里直接返回给前端
         return AskQueryResponse(**result_dict)
 
     except ValueError as ve:  # 例如向量化失败等在 service 中抛出的 ValueError
@@ -99,3 +113,83 @@ async def ask_llm_question(
         raise HTTPException(
             status_code=500, detail="处理您的问题时发生内部错误，请稍后再试。"
         )
+
+
+async def _open_answer_stream(
+    query_service: QueryService, db: AsyncSession, query_text: str
+):
+    """完成检索并取得答案的异步迭代器；检索阶段的错误在开始响应前转换为 HTTP 错误。"""
+    try:
+        return await query_service.stream_answer_from_query(
+            db=db, query_text=query_text
+        )
+    except ValueError as ve:
+        logger.error(f"处理流式问答请求时发生参数或逻辑错误: {ve}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        logger.error(f"处理流式问答请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500, detail="处理您的问题时发生内部错误，请稍后再试。"
+        )
+
+
+@router.post("/ask/stream")
+async def ask_llm_question_stream(
+    request_data: AskQueryRequest,
+    query_service: QueryService = Depends(get_query_service),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    与 /ask 相同的 RAG 流程，但以纯文本流的形式边生成边返回答案，
+    客户端无需等待整个回答生成完毕。
+    """
+    answer_stream = await _open_answer_stream(query_service, db, request_data.query)
+
+    async def _text():
+        try:
+            async for token in answer_stream:
+                yield token
+        except Exception:
+            # 纯文本流没有单独的错误通道，响应头发出后只能在正文末尾追加提示
+            yield "抱歉，回答您的问题时发生内部错误。请联系管理员。"
+        finally:
+            await answer_stream.aclose()
+
+    return StreamingResponse(_text(), media_type="text/plain; charset=utf-8")
+
+
+_SSE_ERROR_DETAIL = {"detail": "处理您的问题时发生内部错误，请稍后再试。"}
+
+
+@router.post("/ask/sse")
+async def ask_llm_question_sse(
+    request_data: AskQueryRequest,
+    query_service: QueryService = Depends(get_query_service),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    与 /ask/stream 相同，但以 Server-Sent Events 格式输出：
+    每段文本为一条 data: {"token": "..."} 事件，结束时发送 data: [DONE]。
+    """
+    answer_stream = await _open_answer_stream(query_service, db, request_data.query)
+
+    async def _events():
+        try:
+            async for token in answer_stream:
+                yield b"data: " + orjson.dumps({"token": token}) + b"\n\n"
+        except Exception:
+            # 响应头已经发出，生成阶段的错误只能以事件的形式告知客户端；
+            # 异常详情已在服务层记录，不返回给客户端，也不再发送 [DONE]
+            yield b"event: error\ndata: " + orjson.dumps(_SSE_ERROR_DETAIL) + b"\n\n"
+            return
+        finally:
+            # 客户端断开时立即关闭内层生成器，使其停止 LLM 生成，而不是等垃圾回收
+            await answer_stream.aclose()
+        yield b"data: [DONE]\n\n"
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        # 禁止中间代理缓冲和缓存事件流
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,52 @@
+import asyncio
+
+import numpy as np
+from loguru import logger
+
+from app.core.chromadb_client import chroma_ids_to_pg_ids, get_chroma_async_collection
+from app.core.config import settings
+from app.query.micro_batcher import MicroBatcher
+
+
+class VectorSearchBatcher(MicroBatcher):
+    """
+    把并发到达的 ChromaDB 向量检索合并成一次 query 请求（query_embeddings 传入多个向量），
+    N 个并发查询只需一次 HTTP 往返。查询向量由 QueryEmbeddingBatcher 按批生成、同时返回，
+    因此同一批查询通常会同时到达这里，默认不再额外等待。
+    """
+
+    async def search(self, query_embedding: np.ndarray, top_k: int) -> list[int]:
+        """返回与查询最相似的 top_k 个文本块在 PostgreSQL 中的 ID（按相似度降序）。"""
+        return await self._submit((query_embedding, top_k))
+
+    async def _process_batch(
+        self, batch: list[tuple[tuple[np.ndarray, int], asyncio.Future]]
+    ) -> None:
+        # n_results 是整个请求共用的参数，按 top_k 分组
+        groups: dict[int, list[tuple[np.ndarray, asyncio.Future]]] = {}
+        for (query_embedding, top_k), future in batch:
+            groups.setdefault(top_k, []).append((query_embedding, future))
+        for top_k, items in groups.items():
+            try:
+                chroma_collection = await get_chroma_async_collection()
+                results = await chroma_collection.query(
+                    query_embeddings=[query_embedding for query_embedding, _ in items],
+                    n_results=top_k,
+                    # ChromaDB 的 ID 即 PostgreSQL 主键，不需要取回元数据；distances 用于调试或排序
+                    include=["distances"],
+                )
+            except Exception as e:
+                logger.error(f"批量向量检索失败: {e}", exc_info=True)
+                self._fail([future for _, future in items], e)
+                continue
+            if len(items) > 1:
+                logger.debug(f"合并 {len(items)} 个查询为一次 ChromaDB 检索。")
+            # results["ids"] 是一个列表的列表，每个查询向量对应其中一项
+            for (_, future), chroma_ids in zip(items, results["ids"]):
+                self._resolve(future, chroma_ids_to_pg_ids(chroma_ids))
+
+
+vector_search_batcher = VectorSearchBatcher(
+    max_batch=settings.QUERY_EMBED_MAX_BATCH,
+    wait_ms=settings.VECTOR_SEARCH_BATCH_WAIT_MS,
+)
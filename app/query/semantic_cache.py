@@ -0,0 +1,106 @@
+import threading
+import time
+from typing import Any
+
+import numpy as np
+import torch
+from loguru import logger
+
+from app.core.config import settings
+
+
+class SemanticAnswerCache:
+    """
+    基于查询向量相似度的问答结果缓存（进程内）。
+
+    查询向量在生成时已经做过 L2 归一化，因此余弦相似度就是一次矩阵-向量点积。
+    当新查询与某个历史查询的相似度不低于阈值时，直接复用该历史查询的答案，
+    跳过检索、Rerank 和 LLM 生成的全部开销。
+
+    每个条目都属于某个知识库版本（app.core.corpus_version）：文档入库完成或删除后版本号递增，
+    查询时看到更新的版本号即清空缓存；基于旧版本生成、晚于版本变化才写入的答案直接丢弃。
+    """
+
+    def __init__(self, threshold: float, max_entries: int, ttl_seconds: int):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._embeddings: torch.Tensor | None = None  # (N, D) float32 矩阵
+        self._answers: list[dict[str, Any]] = []
+        self._created_at: list[float] = []
+        self._corpus_version = 0
+
+    def _evict_expired(self) -> None:
+        # 条目按写入时间顺序追加，过期的条目总是位于最前面
+        deadline = time.monotonic() - self.ttl_seconds
+        expired = 0
+        while expired < len(self._created_at) and self._created_at[expired] < deadline:
+            expired += 1
+        if expired:
+            self._drop_oldest(expired)
+
+    def _drop_oldest(self, count: int) -> None:
+        self._answers = self._answers[count:]
+        self._created_at = self._created_at[count:]
+        if self._embeddings is not None:
+            self._embeddings = self._embeddings[count:] if self._answers else None
+
+    def _sync_corpus_version(self, corpus_version: int) -> None:
+        if corpus_version > self._corpus_version:
+            self._clear_entries()
+            self._corpus_version = corpus_version
+
+    def lookup(
+        self, query_embedding: np.ndarray, corpus_version: int
+    ) -> dict[str, Any] | None:
+        """返回与查询最相似且超过阈值的缓存答案，未命中时返回 None。"""
+        with self._lock:
+            self._sync_corpus_version(corpus_version)
+            self._evict_expired()
+            if self._embeddings is None:
+                return None
+            query = torch.from_numpy(query_embedding)
+            best_score, best_index = torch.max(self._embeddings @ query, dim=0)
+            if best_score.item() < self.threshold:
+                return None
+            logger.debug(f"语义缓存命中，相似度: {best_score.item():.4f}")
+            return dict(self._answers[best_index.item()])
+
+    def store(
+        self, query_embedding: np.ndarray, answer: dict[str, Any], corpus_version: int
+    ) -> None:
+        """
+        写入一条查询向量及其答案，超过容量时淘汰最早的条目。
+        corpus_version 为生成答案前读取的知识库版本，生成期间知识库已变化时不写入。
+        """
+        row = torch.from_numpy(query_embedding).unsqueeze(0)
+        with self._lock:
+            self._sync_corpus_version(corpus_version)
+            if corpus_version < self._corpus_version:
+                return
+            self._embeddings = (
+                row if self._embeddings is None else torch.cat([self._embeddings, row])
+            )
+            self._answers.append(dict(answer))
+            self._created_at.append(time.monotonic())
+            overflow = len(self._answers) - self.max_entries
+            if overflow > 0:
+                self._drop_oldest(overflow)
+
+    def clear(self) -> None:
+        """知识库内容发生变化时清空缓存，避免返回过时的答案。"""
+        with self._lock:
+            self._clear_entries()
+
+    def _clear_entries(self) -> None:
+        self._embeddings = None
+        self._answers = []
+        self._created_at = []
+
+
+semantic_answer_cache = SemanticAnswerCache(
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.SEMANTIC_CACHE_TTL_SECONDS,
+)
@@ -1,101 +1,95 @@
 import asyncio
+import heapq
+import threading
+from collections.abc import AsyncIterator
+from operator import itemgetter
 from typing import Any
+import numpy as np
 from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
-from app.core.embedding_qwen import get_embeddings
-from app.core.chromadb_client import get_chroma_collection
+from app.core.corpus_version import get_corpus_version
+from app.core.chromadb_client import get_chroma_async_collection
+from app.core.embedding_qwen import lookup_query_embedding
+from app.core.mmr import mmr_select
 from app.core.reranker_qwen import rerank_documents
-from app.core.llm_service import generate_text_from_llm
+from app.core.llm_service import (
+    generate_text_from_llm,
+    prepare_llm,
+    stream_text_from_llm,
+)
+from app.text_chunk.repository import TextChunkRepository
 from app.text_chunk.service import TextChunkService
+from app.query.candidate_cache import recent_candidate_cache
+from app.query.embedding_batcher import query_embedding_batcher
+from app.query.rerank_cache import rerank_score_cache
+from app.query.search_batcher import vector_search_batcher
+from app.query.semantic_cache import semantic_answer_cache
+from app.query.vector_index import vector_index
 from app.schemas.schemas import TextChunkResponse
 
 
 class QueryService:
-    def __init__(self, text_chunk_service: TextChunkService):
+    def __init__(self):
         """
         查询服务层，负责处理 RAG 检索逻辑。
-        :param text_chunk_service: 用于从 PostgreSQL 获取文本块的服务实例。
+        本身不持有任何请求级状态，在应用启动时创建一次并全进程复用；
+        数据库会话由调用方按请求传入。
         """
-        self.text_chunk_service = text_chunk_service
         # Embedding 模型和 ChromaDB 集合通过导入的辅助函数按需加载/获取
 
-    async def _embed_query_async(self, query_text: str) -> list[float]:
+    async def _embed_query_async(self, query_text: str) -> np.ndarray:
         """
         异步包裹查询文本的向量化过程。
-        get_embeddings 是一个同步的、计算密集型函数。
+        encode_texts 是一个同步的、计算密集型函数，返回 float32 数组。
         """
         logger.debug(f"开始为查询文本生成向量嵌入: '{query_text[:50]}...'")
         try:
-            # get_embeddings 期望一个文本列表和指令
-            # 它内部处理模型的加载、设备选择、分词、推理和归一化
-            embeddings_list = await asyncio.to_thread(
-                get_embeddings,  # 同步函数
-                [query_text],  # 作为单元素列表传入
-                # instruction=settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL,  # 从配置中获取指令
-                task_description=settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL,
-                is_query=True,
+            # 重复（规范化后相同）的查询直接命中 LRU 缓存，不经过线程和批处理器；
+            # 其余的并发查询经批处理器合并成一次模型调用（在线程中执行）
+            query_embedding = lookup_query_embedding(
+                query_text, settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL
             )
-            if not embeddings_list:
+            if query_embedding is None:
+                query_embedding = await query_embedding_batcher.embed(
+                    query_text, settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL
+                )
+            if query_embedding is None or query_embedding.size == 0:
                 logger.error(f"查询文本 '{query_text}' 的向量化结果为空。")
                 raise ValueError("未能为查询生成向量嵌入。")
             logger.debug("查询文本向量嵌入生成完毕。")
-            return embeddings_list[0]  # 返回单个查询向量
+            return query_embedding  # 返回单个查询向量
         except Exception as e:
             logger.error(f"查询向量化失败: {e}", exc_info=True)
             # 可以选择重新抛出特定类型的异常或通用异常
             raise ValueError(f"查询向量化失败: {e}")
 
     async def _search_vector_db_async(
-        self, query_embedding: list[float], top_k: int
+        self, query_embedding: np.ndarray, top_k: int
     ) -> list[int]:  # 返回 TextChunk 在 PostgreSQL 中的 ID 列表
         """
         异步包裹在 ChromaDB 中进行向量搜索的过程。
         返回检索到的文本块在 PostgreSQL 中的主键 ID 列表。
         """
-        logger.debug(f"开始在 ChromaDB 中搜索 top_k={top_k} 个相关文本块。")
+        if settings.VECTOR_INDEX_IN_MEMORY:
+            try:
+                retrieved_pg_ids = await vector_index.search(query_embedding, top_k)
+            except Exception as e:
+                logger.warning(f"内存向量索引不可用，改用 ChromaDB 检索: {e}")
+                retrieved_pg_ids = None
+            if retrieved_pg_ids is not None:
+                logger.info(
+                    f"从内存向量索引初步召回 {len(retrieved_pg_ids)} 个文本块 ID: {retrieved_pg_ids}"
+                )
+                return retrieved_pg_ids
 
-        def _query_chroma_sync():
-            # get_chroma_collection 内部处理客户端和集合的获取/创建
-            # 并且已经配置了使用 'cosine' 相似度
-            chroma_collection = get_chroma_collection()
-
-            # 执行查询
-            results = chroma_collection.query(
-                query_embeddings=[query_embedding],  # query_embeddings 需要一个向量列表
-                n_results=top_k,
-                include=[
-                    "metadatas",
-                    "distances",
-                ],  # metadatas 可能包含 text_chunk_db_id，distances 用于调试或排序
-            )
-            return results
+        logger.debug(f"开始在 ChromaDB 中搜索 top_k={top_k} 个相关文本块。")
 
         try:
-            results = await asyncio.to_thread(_query_chroma_sync)
-
-            retrieved_pg_ids: list[int] = []
-            if results and results.get("ids") and results["ids"][0]:
-                # results["ids"] 是一个列表的列表, 例如: [['id1', 'id2'], ...]
-                # 对于单个查询向量，我们关心 results["ids"][0]
-                chroma_ids_str_list = results["ids"][0]
-                for str_id in chroma_ids_str_list:
-                    try:
-                        retrieved_pg_ids.append(int(str_id))
-                    except ValueError:
-                        logger.warning(
-                            f"无法将 ChromaDB 中检索到的 ID '{str_id}' 转换为整数。已跳过。"
-                        )
-
-                # 你也可以选择从 metadatas 中提取 text_chunk_db_id (如果你存储了这个字段)
-                # 例如:
-                # if results.get("metadatas") and results["metadatas"][0]:
-                #     for metadata_item in results["metadatas"][0]:
-                #         db_id = metadata_item.get("text_chunk_db_id")
-                #         if db_id is not None:
-                #             retrieved_pg_ids.append(int(db_id))
-                # else:
-                #     logger.warning("ChromaDB 查询结果中未找到 metadatas 或 metadatas 为空。")
+            # 并发到达的检索经批处理器合并成一次 ChromaDB query 请求；
+            # 集合已经配置了使用 'cosine' 相似度，查询走原生异步接口，无需线程池中转
+            retrieved_pg_ids = await vector_search_batcher.search(query_embedding, top_k)
 
             logger.info(
                 f"从 ChromaDB 初步召回 {len(retrieved_pg_ids)} 个文本块 ID: {retrieved_pg_ids}"
@@ -105,14 +99,72 @@ class QueryService:
             logger.error(f"向量数据库搜索失败: {e}", exc_info=True)
             raise ValueError(f"向量数据库搜索失败: {e}")
 
-    async def retrieve_relevant_chunks(
-        self, query_text: str, top_k_final_reranked: int
-    ) -> list[TextChunkResponse]:  # 最终返回的仍然是 TextChunkResponse 列表
+    async def _rerank_async(
+        self, query_text: str, candidate_chunks: list[TextChunkResponse], top_n: int
+    ) -> list[tuple[TextChunkResponse, float]]:
         """
-        为给定查询检索最相关的文本块 (包含召回和精排)。
+        对候选文本块重排序并返回得分最高的 top_n 个。
+        已缓存得分的候选块不再经过 Reranker，只对未命中的部分执行前向计算。
         """
-        logger.info(f"开始为查询 '{query_text[:100]}...' 检索并精排文本块。")
+        query_key = rerank_score_cache.query_key(
+            query_text, settings.RERANKER_INSTRUCTION
+        )
+        scores = rerank_score_cache.lookup(
+            query_key, [chunk.id for chunk in candidate_chunks]
+        )
+        misses = [chunk for chunk in candidate_chunks if chunk.id not in scores]
+        logger.debug(
+            f"Rerank 得分缓存命中 {len(candidate_chunks) - len(misses)}/{len(candidate_chunks)} 个候选块。"
+        )
+        if misses:
+            # rerank_documents 是同步的，CPU/GPU密集型，也需要放入线程；
+            # 未命中的候选块全部打分（不截断），以便写入缓存
+            reranked_misses = await asyncio.to_thread(
+                rerank_documents,
+                query_text,
+                misses,
+                settings.RERANKER_INSTRUCTION,
+            )
+            new_scores = {chunk.id: score for chunk, score in reranked_misses}
+            rerank_score_cache.store(query_key, new_scores)
+            scores.update(new_scores)
+
+        # 一次遍历配对文本块与得分，再只选出前 top_n 个，无需整体排序和二次查表
+        scored = [(chunk, scores[chunk.id]) for chunk in candidate_chunks]
+        return heapq.nlargest(top_n, scored, key=itemgetter(1))
 
+    async def _diversify_candidates(
+        self, query_embedding: np.ndarray, candidate_ids: list[int]
+    ) -> list[int]:
+        """
+        用 MMR 从召回结果中选出 MMR_TOP_K 个彼此不重复的候选块，减少 Rerank 的输入数量。
+        取回候选向量失败时原样返回召回结果。
+        """
+        try:
+            chroma_collection = await get_chroma_async_collection()
+            results = await chroma_collection.get(
+                ids=[str(chunk_id) for chunk_id in candidate_ids],
+                include=["embeddings"],
+            )
+            # get 返回的顺序不保证与请求一致；ID 必须与 embeddings 逐行对应，
+            # 因此严格转换，不跳过无法解析的 ID（请求的本来就是整数 ID）
+            ids = [int(chunk_id) for chunk_id in results["ids"]]
+        except Exception as e:
+            logger.warning(f"获取候选向量失败，跳过 MMR: {e}")
+            return candidate_ids
+
+        selected = mmr_select(
+            np.asarray(query_embedding, dtype=np.float32),
+            np.asarray(results["embeddings"], dtype=np.float32),
+            settings.MMR_LAMBDA,
+            settings.MMR_TOP_K,
+        )
+        diversified_ids = [ids[i] for i in selected]
+        logger.debug(f"MMR 从 {len(candidate_ids)} 个候选块中选出 {len(diversified_ids)} 个。")
+        return diversified_ids
+
+    async def _recall_candidate_ids(self, query_text: str) -> list[int]:
+        """向量化查询并在向量数据库中召回候选文本块 ID，出错时返回空列表。"""
         # 1. 将查询文本向量化
         try:
             query_embedding = await self._embed_query_async(query_text)
@@ -123,24 +175,74 @@ class QueryService:
         # 2. 【召回阶段】在向量数据库中搜索大量候选文本块的ID
         try:
             # 使用配置中定义的较大 top_k进行初步召回
-            candidate_chunk_pg_ids = await self._search_vector_db_async(
+            candidate_ids = await self._search_vector_db_async(
                 query_embedding, top_k=settings.INITIAL_RETRIEVAL_TOP_K
             )
         except ValueError as e:
             logger.error(f"向量数据库初步召回时发生错误: {e}")
             return []
 
+        if settings.MMR_ENABLED and len(candidate_ids) > settings.MMR_TOP_K:
+            candidate_ids = await self._diversify_candidates(
+                query_embedding, candidate_ids
+            )
+        return candidate_ids
+
+    @staticmethod
+    async def _collect_speculative_chunks(
+        task: asyncio.Task | None,
+    ) -> list[TextChunkResponse]:
+        """等待推测性预取结束并取回结果；预取失败不影响主流程。"""
+        if task is None:
+            return []
+        try:
+            return await task
+        except Exception as e:
+            logger.warning(f"推测性预取候选文本块失败: {e}")
+            return []
+
+    async def retrieve_relevant_chunks(
+        self, db: AsyncSession, query_text: str, top_k_final_reranked: int
+    ) -> list[TextChunkResponse]:  # 最终返回的仍然是 TextChunkResponse 列表
+        """
+        为给定查询检索最相关的文本块 (包含召回和精排)。
+        """
+        logger.info(f"开始为查询 '{query_text[:100]}...' 检索并精排文本块。")
+
+        text_chunk_service = TextChunkService(TextChunkRepository(db))
+        # 同一查询最近召回过的候选块 ID 若有缓存，在向量化与召回进行的同时
+        # 推测性地先从 PostgreSQL 取回这些文本块，命中时隐藏一次数据库往返
+        speculative_ids = recent_candidate_cache.lookup(query_text)
+        speculative_task = (
+            asyncio.create_task(text_chunk_service.get_chunks_by_ids(speculative_ids))
+            if speculative_ids
+            else None
+        )
+        try:
+            candidate_chunk_pg_ids = await self._recall_candidate_ids(query_text)
+        finally:
+            # 无论召回是否成功都要等预取结束：同一个会话不能并发执行两条查询
+            speculative_chunks = await self._collect_speculative_chunks(
+                speculative_task
+            )
+
         if not candidate_chunk_pg_ids:
             logger.info("向量数据库初步召回未找到相关的文本块ID。")
             return []
+        recent_candidate_cache.store(query_text, candidate_chunk_pg_ids)
 
         # 3. 【召回阶段】使用这些ID从 PostgreSQL 中获取候选文本块的详细信息
         try:
-            candidate_chunks: list[
-                TextChunkResponse
-            ] = await self.text_chunk_service.get_chunks_by_ids(
-                chunk_ids=candidate_chunk_pg_ids
-            )
+            # 预取结果只保留本次召回到的块，其余 ID 再补查一次
+            wanted_ids = set(candidate_chunk_pg_ids)
+            candidate_chunks: list[TextChunkResponse] = [
+                chunk for chunk in speculative_chunks if chunk.id in wanted_ids
+            ]
+            missing_ids = wanted_ids.difference(chunk.id for chunk in candidate_chunks)
+            if missing_ids:
+                candidate_chunks += await text_chunk_service.get_chunks_by_ids(
+                    chunk_ids=list(missing_ids)
+                )
             logger.info(
                 f"已从 PostgreSQL 获取 {len(candidate_chunks)} 个候选文本块的详细信息。"
             )
@@ -157,20 +259,15 @@ class QueryService:
         # 4. 【精排阶段】使用 Reranker 模型对候选文本块进行重排序
         try:
             logger.debug(f"开始对 {len(candidate_chunks)} 个候选块进行 Rerank...")
-            # rerank_documents 是同步的，CPU/GPU密集型，也需要放入线程
             reranked_results: list[
                 tuple[TextChunkResponse, float]
-            ] = await asyncio.to_thread(
-                rerank_documents,
-                query_text,
-                candidate_chunks,
-                settings.RERANKER_INSTRUCTION,
+            ] = await self._rerank_async(
+                query_text, candidate_chunks, top_k_final_reranked
             )
 
-            # 提取最终的 top_n 个文档块
+            # _rerank_async 已经只返回最终的 top_n 个文档块
             final_top_n_chunks: list[TextChunkResponse] = [
-                doc_response
-                for doc_response, score in reranked_results[:top_k_final_reranked]
+                doc_response for doc_response, score in reranked_results
             ]
             logger.info(f"Rerank 完成，最终选取 {len(final_top_n_chunks)} 个文本块。")
             return final_top_n_chunks
@@ -181,7 +278,9 @@ class QueryService:
             # 这里我们选择返回空列表，或者你可以选择返回 initial_retrieved_chunks 的前N个作为降级方案
             return []
 
-    async def get_context_for_llm(self, query_text: str) -> list[str]:
+    async def get_context_for_llm(
+        self, db: AsyncSession, query_text: str
+    ) -> list[str]:
         """
         获取为 LLM 准备的最终上下文文本列表。
         内部会调用 retrieve_relevant_chunks 并使用 settings.FINAL_CONTEXT_TOP_N。
@@ -193,6 +292,7 @@ class QueryService:
         final_reranked_chunk_responses: list[
             TextChunkResponse
         ] = await self.retrieve_relevant_chunks(
+            db=db,
             query_text=query_text,
             top_k_final_reranked=settings.FINAL_CONTEXT_TOP_N,  # 使用配置中为LLM准备的块数量
         )
@@ -209,9 +309,41 @@ class QueryService:
         logger.info(f"已为 LLM 准备了 {len(context_texts)} 段上下文文本。")
         return context_texts
 
+    async def _prepare_llm_async(self) -> None:
+        """
+        在后台线程中准备 LLM。这里只记录错误：
+        加载失败时，随后的生成调用会再次尝试加载并把错误抛给调用方。
+        """
+        try:
+            await asyncio.to_thread(prepare_llm)
+        except Exception as e:
+            logger.warning(f"后台预加载 LLM 失败: {e}")
+
+    @staticmethod
+    def _build_prompt(query_text: str, context_strings: list[str]) -> tuple[str, str]:
+        """
+        构建发送给 LLM 的 Prompt，返回 (prompt, context_prefix)。
+        指令和上下文构成可复用的前缀：相同上下文的提问可以复用 LLM 的前缀 KV 缓存。
+        """
+        context_block = "\n---\n".join(context_strings)
+        context_prefix = f"""【指令】根据下面提供的上下文信息来回答用户提出的问题。如果上下文中没有足够的信息来回答问题，请明确说明你无法从已知信息中找到答案，不要编造。请使用中文回答。
+
+    【上下文信息】
+    {context_block}
+
+    【用户问题】"""
+        prompt = f"""{context_prefix}
+    {query_text}
+
+    【回答】
+    """
+        logger.debug(f"构建的 Prompt (部分内容):\n{prompt[:200]}...")
+        return prompt, context_prefix
+
     # --- 生成最终答案 ---
     async def generate_answer_from_query(
         self,
+        db: AsyncSession,
         query_text: str,
         llm_max_tokens: int = 512,
         llm_temperature: float = 0.7,
@@ -226,9 +358,30 @@ class QueryService:
         context_strings = []  # 初始化为空列表，保证变量存在
         answer_text = "抱歉，处理您的问题时发生了未知错误。"  # 设置默认错误答案
 
+        # 0. 语义缓存：与历史问题足够相似时直接复用答案，跳过检索和生成
+        query_embedding: np.ndarray | None = None
+        # 知识库版本在检索之前读取：生成期间有文档入库完成时，本次答案不会写入缓存
+        corpus_version = (
+            await get_corpus_version() if settings.SEMANTIC_CACHE_ENABLED else None
+        )
+        if corpus_version is not None:
+            try:
+                query_embedding = await self._embed_query_async(query_text)
+                cached_answer = semantic_answer_cache.lookup(
+                    query_embedding, corpus_version
+                )
+                if cached_answer is not None:
+                    logger.info(f"查询 '{query_text[:50]}...' 命中语义缓存。")
+                    return {**cached_answer, "query": query_text}
+            except ValueError as e:
+                logger.warning(f"语义缓存查询失败，继续完整的 RAG 流程: {e}")
+
+        # 检索和精排期间在后台准备 LLM（首次调用时加载模型），两者重叠进行
+        llm_prepare_task = asyncio.create_task(self._prepare_llm_async())
+
         try:
             # 1. 获取上下文
-            context_strings = await self.get_context_for_llm(query_text)
+            context_strings = await self.get_context_for_llm(db, query_text)
 
             # 2. 如果找不到上下文，直接返回提示信息，不再调用 LLM
             if not context_strings:
@@ -242,29 +395,28 @@ class QueryService:
                 }
 
             # 3. 构建 Prompt
-            context_block = "\n---\n".join(context_strings)
-            prompt = f"""【指令】根据下面提供的上下文信息来回答用户提出的问题。如果上下文中没有足够的信息来回答问题，请明确说明你无法从已知信息中找到答案，不要编造。请使用中文回答。
-
-    【上下文信息】
-    {context_block}
-
-    【用户问题】
-    {query_text}
-
-    【回答】
-    """
-            logger.debug(f"构建的 Prompt (部分内容):\n{prompt[:200]}...")
+            prompt, context_prefix = self._build_prompt(query_text, context_strings)
 
             # 4. 调用 LLM 生成文本
+            await llm_prepare_task
             answer_text = await asyncio.to_thread(
                 generate_text_from_llm,
                 prompt=prompt,
                 max_new_tokens=llm_max_tokens,
                 temperature=llm_temperature,
                 top_p=llm_top_p,
+                cache_prefix=context_prefix,
             )
             logger.info(f"LLM 成功为查询 '{query_text[:50]}...' 生成答案。")
 
+            # 只缓存基于上下文成功生成的答案，错误提示不进入缓存
+            if query_embedding is not None:
+                semantic_answer_cache.store(
+                    query_embedding,
+                    {"answer": answer_text, "retrieved_context_texts": context_strings},
+                    corpus_version,
+                )
+
         except Exception as e:
             logger.error(f"生成答案过程中发生错误: {e}", exc_info=True)
             # 即使发生错误，也使用预设的错误信息
@@ -279,3 +431,91 @@ class QueryService:
             "answer": answer_text,
             "retrieved_context_texts": context_strings,
         }
+
+    async def stream_answer_from_query(
+        self,
+        db: AsyncSession,
+        query_text: str,
+        llm_max_tokens: int = 512,
+        llm_temperature: float = 0.7,
+        llm_top_p: float = 0.9,
+    ) -> AsyncIterator[str]:
+        """
+        与 generate_answer_from_query 流程相同，但以流式方式返回答案。
+        检索和精排（需要数据库会话）在返回之前完成；
+        返回的异步迭代器只负责 LLM 生成，逐段产出文本，不再使用数据库会话。
+        生成阶段的错误会从迭代器中抛出，由调用方决定如何告知客户端。
+        """
+        logger.info(f"开始为查询流式生成答案: '{query_text[:100]}...'")
+
+        query_embedding: np.ndarray | None = None
+        # 知识库版本在检索之前读取：生成期间有文档入库完成时，本次答案不会写入缓存
+        corpus_version = (
+            await get_corpus_version() if settings.SEMANTIC_CACHE_ENABLED else None
+        )
+        if corpus_version is not None:
+            try:
+                query_embedding = await self._embed_query_async(query_text)
+                cached_answer = semantic_answer_cache.lookup(
+                    query_embedding, corpus_version
+                )
+                if cached_answer is not None:
+                    logger.info(f"查询 '{query_text[:50]}...' 命中语义缓存。")
+                    return self._single_chunk_stream(cached_answer["answer"])
+            except ValueError as e:
+                logger.warning(f"语义缓存查询失败，继续完整的 RAG 流程: {e}")
+
+        llm_prepare_task = asyncio.create_task(self._prepare_llm_async())
+        context_strings = await self.get_context_for_llm(db, query_text)
+        if not context_strings:
+            logger.warning(f"未能为查询 '{query_text[:100]}...' 获取到上下文。")
+            return self._single_chunk_stream(
+                "抱歉，我们的知识库中没有找到与您问题直接相关的信息。"
+            )
+
+        prompt, context_prefix = self._build_prompt(query_text, context_strings)
+
+        async def _generate() -> AsyncIterator[str]:
+            await llm_prepare_task
+            stop_event = threading.Event()
+            token_iterator = stream_text_from_llm(
+                prompt=prompt,
+                max_new_tokens=llm_max_tokens,
+                temperature=llm_temperature,
+                top_p=llm_top_p,
+                cache_prefix=context_prefix,
+                stop_event=stop_event,
+            )
+            answer_parts: list[str] = []
+            try:
+                # 同步生成器的每一步都可能阻塞（等待模型产出 token），放到线程中取
+                while (
+                    piece := await asyncio.to_thread(next, token_iterator, None)
+                ) is not None:
+                    answer_parts.append(piece)
+                    yield piece
+            except Exception as e:
+                # 不在这里吞掉异常：由路由层按各自的协议告知客户端（SSE 的 error 事件等）
+                logger.error(f"流式生成答案过程中发生错误: {e}", exc_info=True)
+                raise
+            finally:
+                # 客户端断开时 StreamingResponse 会取消/关闭本生成器：
+                # 通知后台生成线程在下一个 token 处停止，不再占用 GPU 直到 max_new_tokens
+                stop_event.set()
+
+            logger.info(f"LLM 成功为查询 '{query_text[:50]}...' 流式生成答案。")
+            if query_embedding is not None:
+                semantic_answer_cache.store(
+                    query_embedding,
+                    {
+                        "answer": "".join(answer_parts),
+                        "retrieved_context_texts": context_strings,
+                    },
+                    corpus_version,
+                )
+
+        return _generate()
+
+    @staticmethod
+    async def _single_chunk_stream(text: str) -> AsyncIterator[str]:
+        yield text
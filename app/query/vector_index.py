@@ -0,0 +1,182 @@
+import asyncio
+import time
+
+import numpy as np
+import torch
+from loguru import logger
+
+from app.core.chromadb_client import get_chroma_async_collection
+from app.core.config import settings
+
+
+class InMemoryVectorIndex:
+    """
+    ChromaDB 集合中全部向量在进程内的只读副本，查询时做精确的暴力检索。
+
+    向量在入库时已 L2 归一化，余弦相似度就是一次矩阵-向量点积，
+    由 PyTorch 的 BLAS 内核完成；中小规模的集合上比 HTTP 调用 ChromaDB 快得多，
+    而且结果是精确的 top-k，不受 HNSW 近似误差影响。
+
+    ChromaDB 仍是唯一的持久化存储：副本在首次查询时加载，之后超过
+    VECTOR_INDEX_REFRESH_SECONDS 时在后台重新加载（文档由 Celery 异步入库，
+    API 进程无法得知入库完成的时刻）；删除文档时调用 invalidate 立即丢弃副本。
+
+    int8=True 时每个向量按自身最大绝对值对称量化为 int8，另存一个 float32 缩放系数；
+    检索时分块反量化后计算点积，每次只读取 1/4 的字节。召回阶段的微小误差由后续的 Rerank 吸收。
+    """
+
+    # int8 模式下每次反量化的行数，控制临时 float32 块的大小
+    _INT8_BLOCK_ROWS = 16384
+
+    def __init__(
+        self,
+        max_vectors: int,
+        refresh_seconds: float,
+        int8: bool = False,
+        page_size: int = 5000,
+    ):
+        self.max_vectors = max_vectors
+        self.refresh_seconds = refresh_seconds
+        self.int8 = int8
+        self.page_size = page_size
+        self._matrix: torch.Tensor | None = None  # (N, D) float32，int8 模式下为 int8
+        self._scales: torch.Tensor | None = None  # int8 模式下每行的缩放系数 (N,)
+        self._ids: torch.Tensor | None = None  # (N,) int64，PostgreSQL 主键
+        self._loaded_at = 0.0
+        self._too_large = False  # 集合超过 max_vectors 时不再尝试加载
+        self._load_task: asyncio.Task | None = None
+        # 每次 invalidate 加一；加载期间代数变化说明读到的可能是删除前的数据，结果作废
+        self._generation = 0
+
+    async def _load(self) -> None:
+        generation = self._generation
+        collection = await get_chroma_async_collection()
+        total = await collection.count()
+        if generation != self._generation:
+            logger.info("内存向量索引在加载期间被置为失效，丢弃本次加载结果。")
+            return
+        if total > self.max_vectors:
+            logger.warning(
+                f"ChromaDB 集合包含 {total} 个向量，超过内存索引上限 {self.max_vectors}，继续使用 ChromaDB 检索。"
+            )
+            self._too_large = True
+            self._matrix = self._scales = self._ids = None
+            self._loaded_at = time.monotonic()
+            return
+
+        embeddings: list = []
+        ids: list[int] = []
+        for offset in range(0, total, self.page_size):
+            page = await collection.get(
+                limit=self.page_size, offset=offset, include=["embeddings"]
+            )
+            embeddings.extend(page["embeddings"])
+            ids.extend(int(chunk_id) for chunk_id in page["ids"])
+
+        if generation != self._generation:
+            logger.info("内存向量索引在加载期间被置为失效，丢弃本次加载结果。")
+            return
+
+        # ChromaDB 返回的每行可能是 numpy 数组，先拼成一个连续的 float32 矩阵再交给 torch
+        matrix = torch.from_numpy(
+            np.asarray(embeddings, dtype=np.float32).reshape(
+                len(ids), settings.EMBEDDING_DIMENSIONS
+            )
+        )
+        if self.int8:
+            scales = matrix.abs().amax(dim=1).clamp_min(1e-12) / 127
+            self._matrix = torch.round(matrix / scales.unsqueeze(1)).to(torch.int8)
+            self._scales = scales
+        else:
+            self._matrix, self._scales = matrix, None
+        self._ids = torch.tensor(ids, dtype=torch.long)
+        self._too_large = False
+        self._loaded_at = time.monotonic()
+        logger.info(f"内存向量索引已加载 {len(ids)} 个向量。")
+
+    def _start_load(self) -> None:
+        self._load_task = asyncio.create_task(self._load())
+        self._load_task.add_done_callback(self._on_load_done)
+
+    def _on_load_done(self, task: asyncio.Task) -> None:
+        """
+        后台刷新无人等待，在回调中取出异常并记录，避免 "Task exception was never retrieved"。
+        失败时同样推进 _loaded_at：ChromaDB 不可用期间按刷新间隔重试，
+        而不是每个查询都重新发起一次完整加载。
+        """
+        if task.cancelled() or task.exception() is None:
+            return
+        logger.warning(f"内存向量索引加载失败，继续使用现有副本或 ChromaDB: {task.exception()}")
+        self._loaded_at = time.monotonic()
+
+    async def _ensure_loaded(self) -> bool:
+        """确保副本可用；返回 False 表示应回退到 ChromaDB。"""
+        stale = time.monotonic() - self._loaded_at > self.refresh_seconds
+        if self._too_large:
+            # 集合过大时按刷新间隔在后台重新检查，集合缩小后可以重新启用
+            if stale and (self._load_task is None or self._load_task.done()):
+                self._start_load()
+            return False
+        if self._matrix is None:
+            # 首次加载（或失效后）需要等待；并发请求共用同一个加载任务
+            if self._load_task is None or self._load_task.done():
+                self._start_load()
+            await asyncio.shield(self._load_task)
+        elif stale:
+            # 副本过期时在后台刷新，本次查询仍使用旧副本
+            if self._load_task is None or self._load_task.done():
+                self._start_load()
+        return self._matrix is not None
+
+    @classmethod
+    def _top_k(
+        cls,
+        matrix: torch.Tensor,
+        scales: torch.Tensor | None,
+        ids: torch.Tensor,
+        query_embedding: np.ndarray,
+        top_k: int,
+    ) -> list[int]:
+        query = torch.from_numpy(query_embedding)
+        if scales is None:
+            scores = matrix @ query
+        else:
+            scores = torch.cat(
+                [
+                    matrix[start : start + cls._INT8_BLOCK_ROWS].float() @ query
+                    for start in range(0, matrix.shape[0], cls._INT8_BLOCK_ROWS)
+                ]
+            ) * scales
+        k = min(top_k, scores.shape[0])
+        top_indices = torch.topk(scores, k).indices
+        return ids[top_indices].tolist()
+
+    async def search(self, query_embedding: np.ndarray, top_k: int) -> list[int] | None:
+        """
+        返回与查询最相似的 top_k 个文本块 ID（按相似度降序）；
+        副本不可用时返回 None，调用方应改用 ChromaDB 查询。
+        """
+        if not await self._ensure_loaded():
+            return None
+        # 取局部引用：后台刷新替换副本时不影响本次计算
+        matrix, scales, ids = self._matrix, self._scales, self._ids
+        if matrix.shape[0] == 0:
+            return []
+        return await asyncio.to_thread(
+            self._top_k, matrix, scales, ids, query_embedding, top_k
+        )
+
+    def invalidate(self) -> None:
+        """丢弃副本，下一次查询时重新加载；正在进行的加载结果也会被丢弃。"""
+        self._generation += 1
+        self._matrix = self._scales = self._ids = None
+        self._too_large = False
+        # 不再等待旧的加载任务，下一次查询启动新的加载
+        self._load_task = None
+
+
+vector_index = InMemoryVectorIndex(
+    max_vectors=settings.VECTOR_INDEX_MAX_VECTORS,
+    refresh_seconds=settings.VECTOR_INDEX_REFRESH_SECONDS,
+    int8=settings.VECTOR_INDEX_INT8,
+)
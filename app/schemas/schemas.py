@@ -59,6 +59,7 @@ class TextChunkBase(BaseSchema):
 
 class TextChunkCreate(TextChunkBase):
     source_document_id: int = Field(..., description="关联的源文档ID")
+    content_hash: bytes | None = Field(None, description="文本块内容的哈希，用于复用已有向量")
 
 class TextChunkUpdate(BaseSchema):
     chunk_text: str | None = Field(None, description="更新后的文本块内容")
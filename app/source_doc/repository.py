@@ -8,6 +8,9 @@ from app.schemas.schemas import SourceDocumentCreate, SourceDocumentUpdate
 
 
 class SourceDocumentRepository:
+    # 每个请求/任务都会按会话构造一次，只持有会话引用，用 __slots__ 省去实例 __dict__
+    __slots__ = ("session",)
+
     def __init__(self, session: AsyncSession):
         self.session = session
 
@@ -1,3 +1,4 @@
+import asyncio
 import uuid
 import mimetypes
 from datetime import datetime, timedelta, timezone
@@ -9,10 +10,12 @@ from fastapi.responses import StreamingResponse
 from botocore.exceptions import ClientError
 
 from app.core.config import settings
-from app.core.s3_client import s3_client
+from app.core.s3_client import s3_client, upload_transfer_config
 from app.core.celery_app import celery_app
+from app.core.corpus_version import bump_corpus_version
 from app.core.exceptions import NotFoundException, ForbiddenException
 from app.source_doc.repository import SourceDocumentRepository
+from app.query.vector_index import vector_index
 from app.schemas.schemas import (
     SourceDocumentCreate,
     SourceDocumentUpdate,
@@ -22,6 +25,8 @@ from app.schemas.schemas import (
 
 
 class SourceDocumentService:
+    __slots__ = ("repository",)
+
     def __init__(self, repository: SourceDocumentRepository):
         """Service layer for document operations."""
 
@@ -62,12 +67,16 @@ class SourceDocumentService:
         object_name = f"documents/{uuid.uuid4()}.{file_extension}"
 
         # ===== 3. 使用 boto3 上传文件到 MinIO =====
+        #    upload_fileobj 是阻塞调用，放到线程中执行，避免大文件上传期间阻塞事件循环；
+        #    直接从 UploadFile 的底层文件流分片读取上传，不把整个文件读入内存
         try:
-            s3_client.upload_fileobj(
+            await asyncio.to_thread(
+                s3_client.upload_fileobj,
                 Fileobj=file.file,
                 Bucket=settings.MINIO_BUCKET,
                 Key=object_name,
                 ExtraArgs={"ContentType": final_content_type},
+                Config=upload_transfer_config,
             )
         except ClientError as e:
             error_code = e.response.get("Error", {}).get("Code", "UnknownError")
@@ -111,7 +120,11 @@ class SourceDocumentService:
         except Exception as e:
             # 数据库失败后尝试清理已上传的文件
             try:
-                s3_client.delete_object(Bucket=settings.MINIO_BUCKET, Key=object_name)
+                await asyncio.to_thread(
+                    s3_client.delete_object,
+                    Bucket=settings.MINIO_BUCKET,
+                    Key=object_name,
+                )
                 logger.info(
                     f"Cleaned up orphaned file {object_name} after database failure"
                 )
@@ -143,11 +156,16 @@ class SourceDocumentService:
         document = await self.get_document(document_id=document_id)
         await self.repository.delete(document.id)
         logger.info(f"Deleted document record {document_id} from database")
+        # 使各进程中基于旧知识库生成的缓存答案失效
+        await bump_corpus_version()
+        vector_index.invalidate()
 
         # 再删除文件
         try:
-            s3_client.delete_object(
-                Bucket=document.bucket_name, Key=document.object_name
+            await asyncio.to_thread(
+                s3_client.delete_object,
+                Bucket=document.bucket_name,
+                Key=document.object_name,
             )
         except ClientError as e:
             error_code = e.response.get("Error", {}).get("Code", "Unknown")
@@ -164,10 +182,15 @@ class SourceDocumentService:
         document = await self.get_document(document_id=document_id)
 
         try:
-            s3_response = s3_client.get_object(
-                Bucket=document.bucket_name, Key=document.object_name
+            # get_object 会阻塞到响应头返回，同样放到线程中执行
+            s3_response = await asyncio.to_thread(
+                s3_client.get_object,
+                Bucket=document.bucket_name,
+                Key=document.object_name,
             )
-            file_stream = s3_response["Body"]
+            # StreamingBody 默认按 1KB 迭代，而同步迭代器的每次 next 都要切换一次线程，
+            # 这里改为按 1MB 分块读取
+            file_stream = s3_response["Body"].iter_chunks(chunk_size=1024 * 1024)
             safe_filename = quote(document.original_filename)
             return StreamingResponse(
                 content=file_stream,
@@ -1,11 +1,58 @@
 import asyncio
+import threading
 
+from celery.signals import worker_process_shutdown, worker_shutdown
 from loguru import logger
 
 from app.core.celery_app import celery_app
+from app.core.database import dispose_engine_for_celery
 from app.tasks.utils.doc_process import _execute_document_processing_async
 from app.tasks.utils.query_process import execute_query_processing_async
 
+try:
+    # uvloop 随 uvicorn[standard] 安装（Windows 上不可用），调度开销明显低于默认事件循环
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+# --- 工作线程的事件循环 ---
+# 每个工作线程持有一个持久的事件循环，在该线程执行的所有任务间复用。
+# 绑定在事件循环上的数据库连接池、ChromaDB 异步客户端因此也能跨任务复用。
+_thread_local = threading.local()
+_worker_loops: list[asyncio.AbstractEventLoop] = []
+_worker_loops_lock = threading.Lock()
+
+
+def _get_worker_event_loop() -> asyncio.AbstractEventLoop:
+    """获取当前工作线程的事件循环，首次调用时创建并设置为当前线程的循环。"""
+    loop = getattr(_thread_local, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+        _thread_local.loop = loop
+        with _worker_loops_lock:
+            _worker_loops.append(loop)
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def close_worker_event_loops(**kwargs):
+    """Worker 关闭时释放各事件循环上的数据库连接池，并关闭事件循环。"""
+    with _worker_loops_lock:
+        loops = list(_worker_loops)
+        _worker_loops.clear()
+    for loop in loops:
+        if loop.is_closed() or loop.is_running():
+            continue
+        try:
+            loop.run_until_complete(dispose_engine_for_celery())
+        except Exception as e:
+            logger.warning(f"关闭 Celery 数据库连接池失败: {e}")
+        finally:
+            loop.close()
+
 
 # --- Celery 同步任务入口点 ---
 @celery_app.task(
@@ -19,18 +66,16 @@ def process_document_task(self, document_id: int):
     一个健壮的 Celery 任务，用于安全地执行异步代码。
 
     它遵循以下模式：
-    1. 为每个任务创建一个全新的、隔离的事件循环。
-    2. 使用 try...finally 结构确保事件循环总是被关闭，防止资源泄露。
-    3. 在 try...except 中处理业务逻辑异常，并记录日志。
+    1. 复用当前工作线程的持久事件循环，数据库连接池等资源随之跨任务复用。
+    2. 在 try...except 中处理业务逻辑异常，并记录日志。
     """
     task_id_log_prefix = f"[Celery Task ID: {self.request.id}]"
     logger.info(
         f"{task_id_log_prefix} 接收到文档 ID: {document_id}。开始设置异步环境。"
     )
 
-    # 1. 创建全新的事件循环，并设置为当前线程的循环
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    # 1. 获取当前工作线程的事件循环
+    loop = _get_worker_event_loop()
 
     try:
         # 2. 将您原来的业务逻辑和异常处理放在这个 try 块中
@@ -50,11 +95,6 @@ def process_document_task(self, document_id: int):
         #    Celery 会捕获这个异常，并将任务状态标记为 FAILED。
         #    如果不抛出，Celery 会认为任务成功了。
         raise
-    finally:
-        # 5. 关键步骤：这个 finally 块中的代码保证【总是】会执行。
-        #    无论 try 块是成功返回、还是发生异常，都会执行这里。
-        logger.info(f"{task_id_log_prefix} 开始清理异步环境，关闭事件循环。")
-        loop.close()
 
 
 @celery_app.task(name="app.tasks.document_task.process_query_task", bind=True)
@@ -64,8 +104,7 @@ def process_query_task(self, message: dict):
     query_text = message.get("query_text")
     top_k_final_reranked = message.get("top_k_final_reranked")
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    loop = _get_worker_event_loop()
 
     logger.info(
         f"{task_id_log_prefix} (Sync Entry) 接收到查询请求: '{query_text}', top_k: {top_k_final_reranked}"
@@ -97,7 +136,3 @@ def process_query_task(self, message: dict):
             exc_info=True,
         )
         raise
-
-    finally:
-        logger.info(f"{task_id_log_prefix} 开始清理异步环境，关闭事件循环。")
-        loop.close()
@@ -2,9 +2,12 @@ import io
 import re
 from typing import List
 from loguru import logger
+import pypdfium2 as pdfium
+
+from app.core.config import settings
+from .process_pool import get_ingest_process_pool, ingest_pool_enabled
 
 # 导入所有我们需要用到的、具体的解析函数
-from unstructured.partition.text import partition_text
 from unstructured.partition.pdf import partition_pdf
 from unstructured.partition.docx import partition_docx
 from unstructured.partition.pptx import partition_pptx
@@ -12,6 +15,12 @@ from unstructured.partition.xlsx import partition_xlsx
 from unstructured.partition.md import partition_md
 from unstructured.documents.elements import Element
 
+# 规范化空白用到的正则在模块加载时编译一次
+# \n\s*\n 会把任意多个连续空行都折叠成一个段落分隔，因此不再需要单独处理 \n{3,}
+_BLANK_LINES_RE = re.compile(r'\n\s*\n')
+_MULTI_SPACES_RE = re.compile(r' {2,}')
+
+
 def _normalize_whitespace(text: str) -> str:
     """
     规范化文本中的空白字符，合并多余的换行和空格。
@@ -19,12 +28,79 @@ def _normalize_whitespace(text: str) -> str:
     if not isinstance(text, str):
         return ""
     text = text.replace('\u200b', '')
-    text = re.sub(r'\n\s*\n', '\n\n', text)
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    text = re.sub(r' {2,}', ' ', text)
+    text = _BLANK_LINES_RE.sub('\n\n', text)
+    text = _MULTI_SPACES_RE.sub(' ', text)
     text = text.strip()
     return text
 
+def _split_pdf_into_shards(file_content_bytes: bytes, pages_per_shard: int) -> List[bytes]:
+    """
+    使用 pypdfium2 将 PDF 按页切分为若干个小 PDF，返回每个分片的字节内容。
+    """
+    source_pdf = pdfium.PdfDocument(file_content_bytes)
+    try:
+        page_count = len(source_pdf)
+        shards: List[bytes] = []
+        for start in range(0, page_count, pages_per_shard):
+            shard_pdf = pdfium.PdfDocument.new()
+            try:
+                shard_pdf.import_pages(
+                    source_pdf, list(range(start, min(start + pages_per_shard, page_count)))
+                )
+                buffer = io.BytesIO()
+                shard_pdf.save(buffer)
+                shards.append(buffer.getvalue())
+            finally:
+                shard_pdf.close()
+        return shards
+    finally:
+        source_pdf.close()
+
+
+def _partition_pdf_shard(shard_bytes: bytes) -> List[str]:
+    """
+    在子进程中解析单个 PDF 分片，只返回文本以减少进程间传输的数据量。
+    """
+    elements = partition_pdf(
+        file=io.BytesIO(shard_bytes), strategy=settings.PDF_PARTITION_STRATEGY
+    )
+    return [str(el) for el in elements]
+
+
+def _partition_pdf_texts(file_content_bytes: bytes) -> List[str]:
+    """
+    解析 PDF 并返回按页序排列的元素文本。
+    页数较多时按页分片，交给进程池并行解析；失败时回退到单进程解析。
+    """
+    if ingest_pool_enabled():
+        try:
+            pdf = pdfium.PdfDocument(file_content_bytes)
+            page_count = len(pdf)
+            pdf.close()
+        except Exception as e:
+            logger.warning(f"pypdfium2 读取 PDF 页数失败，回退到单进程解析: {e}")
+            page_count = 0
+
+        if page_count > settings.PDF_PARALLEL_MIN_PAGES:
+            try:
+                shards = _split_pdf_into_shards(
+                    file_content_bytes, settings.PDF_PAGES_PER_SHARD
+                )
+                logger.info(
+                    f"PDF 共 {page_count} 页，切分为 {len(shards)} 个分片并行解析..."
+                )
+                # executor.map 按提交顺序返回结果，保证合并后的页序不变
+                shard_results = get_ingest_process_pool().map(_partition_pdf_shard, shards)
+                return [text for shard_texts in shard_results for text in shard_texts]
+            except Exception as e:
+                logger.warning(f"PDF 并行解析失败，回退到单进程解析: {e}")
+
+    elements = partition_pdf(
+        file=io.BytesIO(file_content_bytes), strategy=settings.PDF_PARTITION_STRATEGY
+    )
+    return [str(el) for el in elements]
+
+
 def parse_and_clean_document(
     file_content_bytes: bytes,
     original_filename: str,
@@ -36,18 +112,20 @@ def parse_and_clean_document(
     logger.info(f"开始手动路由解析文件: {original_filename} (Content-Type: {content_type})...")
     
     elements: List[Element] = []
+    element_texts: List[str] | None = None
     
     try:
         # --- 核心改动：使用 match case 根据 content_type 选择解析器 ---
         match content_type:
             case "text/plain":
-                logger.info("匹配到 text/plain，使用 partition_text 解析...")
-                # partition_text 需要字符串，所以我们要先解码
-                elements = partition_text(text=file_content_bytes.decode('utf-8', errors='ignore'))
+                # 纯文本没有版面结构可分析，直接解码后交给空白规范化，
+                # 不再经过 partition_text 逐段构造元素对象
+                logger.info("匹配到 text/plain，直接解码文本...")
+                element_texts = [file_content_bytes.decode('utf-8', errors='ignore')]
             
             case "application/pdf":
                 logger.info("匹配到 PDF，使用 partition_pdf 解析...")
-                elements = partition_pdf(file=io.BytesIO(file_content_bytes), strategy="fast")
+                element_texts = _partition_pdf_texts(file_content_bytes)
 
             case "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
                 logger.info("匹配到 DOCX，使用 partition_docx 解析...")
@@ -71,11 +149,14 @@ def parse_and_clean_document(
                 logger.error(unsupported_message)
                 raise ValueError(unsupported_message)
 
-        if not elements:
+        if element_texts is None:
+            element_texts = [str(el) for el in elements]
+
+        if not element_texts:
             logger.warning(f"Unstructured 未能从文件 {original_filename} 中解析出任何元素。")
             return ""
 
-        raw_text = "\n\n".join([str(el) for el in elements])
+        raw_text = "\n\n".join(element_texts)
         logger.info(f"解析完成，提取原始文本长度: {len(raw_text)}")
         
         cleaned_text = _normalize_whitespace(raw_text)
@@ -1,27 +1,183 @@
 import asyncio
+import hashlib
 
 from loguru import logger
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 from app.core.config import settings
 from app.core.s3_client import s3_client
-from app.core.database import create_engine_and_session_for_celery
+from app.core.database import get_session_for_celery
 from app.core.embedding_qwen import get_embeddings
-from app.core.chromadb_client import get_chroma_collection
+from app.core.chromadb_client import get_chroma_async_collection
+from app.core.corpus_version import bump_corpus_version
 from app.source_doc.repository import SourceDocumentRepository
 from app.source_doc.service import SourceDocumentService
 from app.text_chunk.repository import TextChunkRepository
 from app.text_chunk.service import TextChunkService
-from app.models.models import TextChunk
-from app.schemas.schemas import SourceDocumentResponse, TextChunkCreate
+from app.schemas.schemas import SourceDocumentResponse
 from .doc_parser import parse_and_clean_document
+from .text_splitter import split_text_parallel
+
+
+def _content_hash(text: str) -> bytes:
+    """计算文本块内容的 128 位哈希，用于识别内容完全相同的文本块。"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+# 向量化与向量写入之间的队列长度：限制已算好但尚未写入的批次数，控制内存占用
+_EMBEDDING_QUEUE_MAXSIZE = 4
+
+
+async def _produce_embedding_batches(
+    chunks: list[dict],
+    queue: asyncio.Queue,
+    reusable_chunk_ids: dict[int, int],
+) -> None:
+    """
+    按批次为文本块（已分配好 ID 的列字典）生成向量，并把 (文本块批次, 向量批次) 放入队列，结束时放入 None。
+    reusable_chunk_ids 为 {新文本块ID: 内容相同的已有文本块ID}，
+    这些文本块直接复用 ChromaDB 中已有的向量，不再经过模型。
+    """
+    batch_size = settings.EMBEDDING_BATCH_SIZE
+
+    existing_embeddings: dict[int, list[float]] = {}
+    if reusable_chunk_ids:
+        chroma_collection = await get_chroma_async_collection()
+        existing = await chroma_collection.get(
+            ids=[str(chunk_id) for chunk_id in set(reusable_chunk_ids.values())],
+            include=["embeddings"],
+        )
+        existing_embeddings = {
+            int(chunk_id): embedding
+            for chunk_id, embedding in zip(existing["ids"], existing["embeddings"])
+        }
+
+    # 已有向量的文本块分批直接入队；ChromaDB 中找不到对应向量的仍然重新计算
+    reused_chunks = [
+        chunk
+        for chunk in chunks
+        if reusable_chunk_ids.get(chunk["id"]) in existing_embeddings
+    ]
+    for start in range(0, len(reused_chunks), batch_size):
+        batch = reused_chunks[start : start + batch_size]
+        await queue.put(
+            (batch, [existing_embeddings[reusable_chunk_ids[chunk["id"]]] for chunk in batch])
+        )
+    if reused_chunks:
+        logger.info(f"{len(reused_chunks)} 个文本块内容已存在，直接复用已有向量。")
+
+    reused_ids = {chunk["id"] for chunk in reused_chunks}
+    # 同一文档中内容完全相同的文本块（页眉页脚、模板段落等）只计算一次向量
+    chunks_by_hash: dict[bytes, list[dict]] = {}
+    for chunk in chunks:
+        if chunk["id"] not in reused_ids:
+            chunks_by_hash.setdefault(chunk["content_hash"], []).append(chunk)
+    # 按文本长度排序后再分批，同一批次内长度接近，减少填充带来的无效计算；
+    # 向量按文本块 ID 写入 ChromaDB，顺序无关紧要
+    unique_chunks = sorted(
+        (same_chunks[0] for same_chunks in chunks_by_hash.values()),
+        key=lambda chunk: len(chunk["chunk_text"]),
+    )
+    duplicate_count = len(chunks) - len(reused_ids) - len(unique_chunks)
+    if duplicate_count:
+        logger.info(f"{duplicate_count} 个文本块与文档内其他块内容相同，共用同一个向量。")
+
+    for start in range(0, len(unique_chunks), batch_size):
+        unique_batch = unique_chunks[start : start + batch_size]
+        # 将同步的 embedding 操作放到线程中执行，避免阻塞事件循环
+        unique_embeddings = await asyncio.to_thread(
+            get_embeddings,
+            [chunk["chunk_text"] for chunk in unique_batch],
+            task_description=settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL,
+            is_query=False,
+        )
+        batch: list[dict] = []
+        batch_embeddings: list = []
+        for chunk, embedding in zip(unique_batch, unique_embeddings):
+            same_chunks = chunks_by_hash[chunk["content_hash"]]
+            batch.extend(same_chunks)
+            batch_embeddings.extend([embedding] * len(same_chunks))
+        await queue.put((batch, batch_embeddings))
+    await queue.put(None)
+
+
+async def _consume_embedding_batches(
+    document: SourceDocumentResponse, queue: asyncio.Queue
+) -> int:
+    """
+    从队列中取出已生成的向量批次，攒够 CHROMA_BATCH_SIZE 个后写入 ChromaDB，返回写入的向量总数。
+    写入请求最多同时进行 CHROMA_UPLOAD_CONCURRENCY 个。
+    """
+    chroma_collection = await get_chroma_async_collection()
+    # 文档级的公共字段只取一次，逐块只补充与块相关的字段
+    doc_level_metadata = {
+        "source_document_id": document.id,
+        "original_filename": document.original_filename,
+    }
+    upload_slots = asyncio.Semaphore(settings.CHROMA_UPLOAD_CONCURRENCY)
+    upload_tasks: list[asyncio.Task] = []
+
+    async def _upload_batch(ids: list[str], embeddings: list, metadatas: list[dict]):
+        try:
+            # 使用 upsert：ID 由 (文档, 块序号) 确定，任务重试时沿用上一次尝试的 ID，
+            # 重复写入只会覆盖同一个向量，不会报错或产生重复向量
+            await chroma_collection.upsert(
+                ids=ids, embeddings=embeddings, metadatas=metadatas
+            )
+        finally:
+            upload_slots.release()
+
+    async def _flush(ids: list[str], embeddings: list, metadatas: list[dict]):
+        # 先占用一个写入名额再创建任务：写入跟不上时在这里等待，
+        # 从而反压到队列和向量化阶段，内存中最多只有有限个批次
+        await upload_slots.acquire()
+        for task in upload_tasks:
+            if task.done() and task.exception():
+                upload_slots.release()
+                raise task.exception()
+        upload_tasks.append(
+            asyncio.create_task(_upload_batch(ids, embeddings, metadatas))
+        )
+
+    pending_ids: list[str] = []
+    pending_embeddings: list = []
+    pending_metadatas: list[dict] = []
+    stored_count = 0
+    try:
+        while (item := await queue.get()) is not None:
+            batch, batch_embeddings = item
+            # 一次遍历同时构造 ID、向量和元数据三列
+            for chunk, embedding in zip(batch, batch_embeddings):
+                pending_ids.append(str(chunk["id"]))  # ChromaDB 需要字符串ID
+                pending_embeddings.append(embedding)
+                # ChromaDB 的 ID 就是 PostgreSQL TextChunk 表的主键，无需在元数据中重复存储
+                pending_metadatas.append(
+                    {**doc_level_metadata, "sequence": chunk["sequence_in_document"]}
+                )
+            while len(pending_ids) >= settings.CHROMA_BATCH_SIZE:
+                size = settings.CHROMA_BATCH_SIZE
+                await _flush(
+                    pending_ids[:size], pending_embeddings[:size], pending_metadatas[:size]
+                )
+                stored_count += size
+                del pending_ids[:size], pending_embeddings[:size], pending_metadatas[:size]
+
+        if pending_ids:
+            await _flush(pending_ids, pending_embeddings, pending_metadatas)
+            stored_count += len(pending_ids)
+
+        await asyncio.gather(*upload_tasks)
+    except BaseException:
+        for task in upload_tasks:
+            task.cancel()
+        await asyncio.gather(*upload_tasks, return_exceptions=True)
+        raise
+    return stored_count
 
 
 # --- 异步业务逻辑核心 ---
 async def _execute_document_processing_async(document_id: int, task_id_for_log: str):
-    # 1. 延迟初始化：在函数开始时，为本次任务创建专属的数据库引擎和会话工厂
-    #    它们会自动绑定到由 Celery 任务创建的那个全新的事件循环上。
-    db_engine, SessionLocal = create_engine_and_session_for_celery()
+    # 1. 获取当前工作线程事件循环上的会话工厂，引擎和连接池在同一线程的任务间复用
+    SessionLocal = get_session_for_celery()
     logger.info(f"{task_id_for_log} (Async Logic) 开始处理文档 ID: {document_id}")
 
     source_doc_service: SourceDocumentService
@@ -99,7 +255,6 @@ async def _execute_document_processing_async(document_id: int, task_id_for_log:
             # 第4步：根据文档类型解析文本内容
             # ==================================================================
             raw_text: str = ""
-            content_type = document_response.content_type.lower()
 
             try:
                 logger.info("开始解析和清洗文档内容...")
@@ -141,25 +296,9 @@ async def _execute_document_processing_async(document_id: int, task_id_for_log:
             # 第5步：将文本内容分割成小块 (Chunks)
             # ==================================================================
 
-            # 示例：简单的按固定长度（大致）分块，带重叠
-            chunk_size = settings.CHUNK_SIZE  # 每个块的目标字符数
-            chunk_overlap = settings.CHUNK_OVERLAP  # 相邻块之间的重叠字符数
-
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=chunk_size,
-                chunk_overlap=chunk_overlap,
-                length_function=len,
-                separators=["\n\n", "\n", " ", ""],
+            chunks_texts_list: list[str] = await asyncio.to_thread(
+                split_text_parallel, raw_text
             )
-            chunks_texts_list = text_splitter.split_text(raw_text)
-
-            chunks_texts_list: list[str] = []
-            if len(raw_text) > chunk_size:
-                for i in range(0, len(raw_text), chunk_size - chunk_overlap):
-                    chunk = raw_text[i : i + chunk_size]
-                    chunks_texts_list.append(chunk)
-            elif raw_text:  # 如果文本不为空但小于块大小，则本身作为一个块
-                chunks_texts_list.append(raw_text)
 
             if (
                 not chunks_texts_list and raw_text
@@ -174,43 +313,63 @@ async def _execute_document_processing_async(document_id: int, task_id_for_log:
             )
 
             # ==================================================================
-            # 第6步：将文本块存入数据库 (使用 TextChunkService)
+            # 第6步：为文本块预留数据库 ID，并查找可复用向量的已有文本块
             # ==================================================================
-            created_chunk_db_objects: list[TextChunk] = []  # 用于存储返回的 ORM 对象
+            chunk_rows: list[dict] = []
+            reusable_chunk_ids: dict[int, int] = {}  # 新文本块ID -> 内容相同的已有文本块ID
             if chunks_texts_list:
-                chunks_to_create: list[TextChunkCreate] = []
-                for i, chunk_text_content in enumerate(chunks_texts_list):
-                    # 准备 Pydantic 模型数据
-                    # 你可以在这里为 metadata_json 添加更多信息，例如如果解析时得到了页码
+                try:
+                    # ID 在写入前确定，写入 PostgreSQL 与写入 ChromaDB 互不依赖，可以并发进行。
+                    # 任务重投/重试时沿用上一次尝试为同一 (文档, 块序号) 写入的 ID，
+                    # 两边都按 ID 覆盖写入，不会产生重复的文本块或向量
+                    chunk_ids = await text_chunk_service.assign_chunk_ids(
+                        document_response.id, len(chunks_texts_list)
+                    )
+                    # 上一次尝试若切出了更多的块，多出的部分在两边都删除
+                    stale_chunk_ids = await text_chunk_service.delete_chunks_from_sequence(
+                        document_response.id, len(chunks_texts_list)
+                    )
+                    if stale_chunk_ids:
+                        chroma_collection = await get_chroma_async_collection()
+                        await chroma_collection.delete(
+                            ids=[str(chunk_id) for chunk_id in stale_chunk_ids]
+                        )
+                    # 直接构造列字典，跳过逐条的 Pydantic 校验，交给仓库层一次性批量插入
+                    # 所有块的 metadata_json 内容相同，只构造一次；序列化时各行各自写入
                     chunk_meta = {"parsed_by": "default_parser_v1"}
-                    if (
-                        "pdf" in content_type
-                    ):  # 示例：如果是pdf，可以尝试从解析器获取页码信息
-                        # chunk_meta["page_number"] = extracted_page_number_for_this_chunk
-                        pass
-
-                    chunks_to_create.append(
-                        TextChunkCreate(
-                            source_document_id=document_response.id,
-                            chunk_text=chunk_text_content,
-                            sequence_in_document=i,
-                            metadata_json=chunk_meta,
+                    # 单次遍历同时得到待插入的行和每个块的内容哈希
+                    content_hashes: list[bytes] = []
+                    for i, (chunk_id, chunk_text_content) in enumerate(
+                        zip(chunk_ids, chunks_texts_list)
+                    ):
+                        content_hash = _content_hash(chunk_text_content)
+                        content_hashes.append(content_hash)
+                        chunk_rows.append(
+                            {
+                                "id": chunk_id,
+                                "source_document_id": document_response.id,
+                                "chunk_text": chunk_text_content,
+                                "sequence_in_document": i,
+                                "metadata_json": chunk_meta,
+                                "content_hash": content_hash,
+                            }
                         )
-                    )
 
-                try:
-                    created_chunk_db_objects = (
-                        await text_chunk_service.add_chunks_for_document(
-                            chunks_data=chunks_to_create
+                    # 查找数据库中内容相同的已有文本块，后续直接复用它们的向量，只为新内容计算向量。
+                    # 不排除当前文档：任务重试时，上一次尝试已写入的文本块（ID 相同）的向量也能被复用
+                    existing_ids_by_hash = (
+                        await text_chunk_service.find_existing_chunk_ids_by_hash(
+                            content_hashes=content_hashes
                         )
                     )
-                    number_of_chunks_created = len(created_chunk_db_objects)
-                    logger.info(
-                        f"{task_id_for_log} (Async Logic) 文档 ID: {document_id} 的 {number_of_chunks_created} 个文本块已存入数据库"
-                    )
+                    if existing_ids_by_hash:
+                        for row in chunk_rows:
+                            existing_id = existing_ids_by_hash.get(row["content_hash"])
+                            if existing_id is not None:
+                                reusable_chunk_ids[row["id"]] = existing_id
                 except Exception as db_chunk_error:
                     logger.error(
-                        f"{task_id_for_log} (Async Logic) 存储文本块到数据库时失败 (文档ID: {document_id}): {db_chunk_error}",
+                        f"{task_id_for_log} (Async Logic) 为文本块分配 ID 时失败 (文档ID: {document_id}): {db_chunk_error}",
                         exc_info=True,
                     )
                     await source_doc_service.update_document_processing_info(
@@ -220,34 +379,82 @@ async def _execute_document_processing_async(document_id: int, task_id_for_log:
                     )
                     raise db_chunk_error
             else:  # 如果没有文本块产生（例如原文件为空或解析后为空）
-                number_of_chunks_created = 0
                 logger.info(
                     f"{task_id_for_log} (Async Logic) 文档 ID: {document_id} 未产生文本块可存储。"
                 )
 
             # ==================================================================
-            # 第7步：为文本块生成向量嵌入
+            # 第7/8步：文本块写入数据库，同时生成向量嵌入并写入向量数据库 (ChromaDB)
+            # 写入 PostgreSQL 与向量流水线并发进行；向量化与向量写入之间通过有界队列流水线化：
+            # 模型计算下一批向量的同时，上一批向量写入 ChromaDB
             # ==================================================================
-            if created_chunk_db_objects:  # 仅当有成功创建的文本块时才进行向量化
-                texts_to_embed = [
-                    chunk.chunk_text for chunk in created_chunk_db_objects
-                ]
-
+            if chunk_rows:
                 logger.info(
-                    f"{task_id_for_log} (Async Logic) 开始为 {len(texts_to_embed)} 个文本块生成向量嵌入..."
+                    f"{task_id_for_log} (Async Logic) 开始存储 {len(chunk_rows)} 个文本块，并生成向量嵌入存入 ChromaDB 集合: {settings.CHROMA_COLLECTION_NAME}..."
                 )
-                try:
-                    # 将同步的 embedding 操作放到线程中执行，避免阻塞事件循环
-                    embeddings_list = await asyncio.to_thread(
-                        get_embeddings,
-                        texts_to_embed,                        
-                        task_description=settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL,
-                        is_query=False,
+                sql_task = asyncio.create_task(
+                    text_chunk_service.add_chunk_rows_for_document(chunk_rows=chunk_rows)
+                )
+                embedding_queue: asyncio.Queue = asyncio.Queue(
+                    maxsize=_EMBEDDING_QUEUE_MAXSIZE
+                )
+                embed_task = asyncio.create_task(
+                    _produce_embedding_batches(
+                        chunk_rows, embedding_queue, reusable_chunk_ids
+                    )
+                )
+                store_task = asyncio.create_task(
+                    _consume_embedding_batches(document_response, embedding_queue)
+                )
+                # 任一任务出错即停止向量流水线，避免生产者阻塞在已满的队列上；
+                # 数据库写入只有一条语句，总是等它执行完，保证会话状态干净
+                await asyncio.wait(
+                    {sql_task, embed_task, store_task},
+                    return_when=asyncio.FIRST_EXCEPTION,
+                )
+                pipeline_failed = (
+                    sql_task.done() and sql_task.exception() is not None
+                ) or any(
+                    task.done() and task.exception() is not None
+                    for task in (embed_task, store_task)
+                )
+                if pipeline_failed:
+                    for task in (embed_task, store_task):
+                        task.cancel()
+                await asyncio.gather(
+                    sql_task, embed_task, store_task, return_exceptions=True
+                )
+
+                if sql_task.exception():
+                    db_chunk_error = sql_task.exception()
+                    logger.error(
+                        f"{task_id_for_log} (Async Logic) 存储文本块到数据库时失败 (文档ID: {document_id}): {db_chunk_error}",
+                        exc_info=True,
                     )
-                    logger.info(
-                        f"{task_id_for_log} (Async Logic) 成功生成 {len(embeddings_list)} 组向量嵌入。"
+                    # 已经写入 ChromaDB 的向量没有对应的文本块，尽力删除
+                    try:
+                        chroma_collection = await get_chroma_async_collection()
+                        await chroma_collection.delete(
+                            ids=[str(row["id"]) for row in chunk_rows]
+                        )
+                    except Exception as cleanup_error:
+                        logger.warning(
+                            f"{task_id_for_log} (Async Logic) 清理 ChromaDB 中的向量失败: {cleanup_error}"
+                        )
+                    await source_doc_service.update_document_processing_info(
+                        document_id=document_response.id,
+                        status="error",
+                        error_message=f"存储文本块失败: {str(db_chunk_error)[:255]}",
                     )
-                except Exception as embed_error:
+                    raise db_chunk_error
+
+                number_of_chunks_created = len(chunk_rows)
+                logger.info(
+                    f"{task_id_for_log} (Async Logic) 文档 ID: {document_id} 的 {number_of_chunks_created} 个文本块已存入数据库"
+                )
+
+                if not embed_task.cancelled() and embed_task.exception():
+                    embed_error = embed_task.exception()
                     logger.error(
                         f"{task_id_for_log} (Async Logic) 生成向量嵌入失败: {embed_error}",
                         exc_info=True,
@@ -260,56 +467,23 @@ async def _execute_document_processing_async(document_id: int, task_id_for_log:
                     )
                     raise embed_error
 
-                # ==================================================================
-                # 第8步：将向量和文本块的关联信息存入向量数据库 (ChromaDB)
-                # ==================================================================
-                if embeddings_list:
-                    chroma_chunk_ids = [
-                        str(chunk.id) for chunk in created_chunk_db_objects
-                    ]  # ChromaDB 需要字符串ID
-                    chroma_metadatas = [
-                        {
-                            "source_document_id": document_response.id,
-                            "original_filename": document_response.original_filename,
-                            "text_chunk_db_id": chunk.id,  # 对应 PostgreSQL TextChunk 表的ID
-                            "sequence": chunk.sequence_in_document,
-                        }
-                        for chunk in created_chunk_db_objects
-                    ]
-                    # 有些向量数据库也允许存储文档本身，ChromaDB 也支持
-                    # chroma_documents_text = texts_to_embed
+                if not store_task.cancelled() and store_task.exception():
+                    chroma_error = store_task.exception()
+                    logger.error(
+                        f"{task_id_for_log} (Async Logic) 存入 ChromaDB 失败: {chroma_error}",
+                        exc_info=True,
+                    )
+                    await source_doc_service.update_document_processing_info(
+                        document_id=document_response.id,
+                        status="error",
+                        error_message=f"向量存储失败: {str(chroma_error)[:255]}",
+                        number_of_chunks=number_of_chunks_created,
+                    )
+                    raise chroma_error
 
-                    try:
-                        logger.info(
-                            f"{task_id_for_log} (Async Logic) 准备将向量存入 ChromaDB 集合: {settings.CHROMA_COLLECTION_NAME}..."
-                        )
-                        chroma_collection = await asyncio.to_thread(
-                            get_chroma_collection
-                        )  # 获取集合也可能是阻塞的
-
-                        # ChromaDB 的 add/upsert 是同步的，也需要用 to_thread
-                        await asyncio.to_thread(
-                            chroma_collection.add,  # 或者 .upsert 如果你想支持幂等更新
-                            ids=chroma_chunk_ids,
-                            embeddings=embeddings_list,
-                            metadatas=chroma_metadatas,
-                            # documents=chroma_documents_text # 可选
-                        )
-                        logger.info(
-                            f"{task_id_for_log} (Async Logic) 成功将 {len(chroma_chunk_ids)} 个向量存入 ChromaDB。"
-                        )
-                    except Exception as chroma_error:
-                        logger.error(
-                            f"{task_id_for_log} (Async Logic) 存入 ChromaDB 失败: {chroma_error}",
-                            exc_info=True,
-                        )
-                        await source_doc_service.update_document_processing_info(
-                            document_id=document_response.id,
-                            status="error",
-                            error_message=f"向量存储失败: {str(chroma_error)[:255]}",
-                            number_of_chunks=number_of_chunks_created,
-                        )
-                        raise chroma_error
+                logger.info(
+                    f"{task_id_for_log} (Async Logic) 成功生成并将 {store_task.result()} 个向量存入 ChromaDB。"
+                )
             else:  # 如果没有文本块被创建和向量化
                 logger.info(
                     f"{task_id_for_log} (Async Logic) 没有文本块进行向量化和存储。文档ID: {document_id}"
@@ -328,6 +502,8 @@ async def _execute_document_processing_async(document_id: int, task_id_for_log:
             logger.info(
                 f"{task_id_for_log} (Async Logic) 文档 {document_response.id} 所有处理步骤完成，状态更新为 'ready'"
             )
+            # 新文档此时才可被检索到：使 API 进程中基于旧知识库生成的缓存答案失效
+            await bump_corpus_version()
             return {
                 "status": "success",
                 "document_id": document_id,
@@ -357,10 +533,3 @@ async def _execute_document_processing_async(document_id: int, task_id_for_log:
                         exc_info=True,
                     )
         raise e  # 将异常向上抛给 asyncio.run()，再由同步任务的 except 块处理
-
-    finally:
-        # 最终清理
-        # 无论成功还是失败，最后都要关闭数据库引擎的连接池
-        logger.info(f"{task_id_for_log} (Async Logic) 关闭数据库连接池...")
-        await db_engine.dispose()
-        logger.info(f"{task_id_for_log} (Async Logic) 异步资源清理完毕。")
@@ -0,0 +1,28 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from app.core.config import settings
+
+
+# 文档解析、文本切分等 CPU 密集型步骤共用的进程池，首次使用时再创建
+_ingest_process_pool: ProcessPoolExecutor | None = None
+
+
+def ingest_pool_enabled() -> bool:
+    """
+    是否可以使用进程池并行处理单个文档。
+    Celery prefork 的子进程是守护进程，multiprocessing 不允许守护进程再创建子进程，
+    此时直接在当前进程中处理（跨文档已由 prefork 并行）。
+    """
+    return settings.INGEST_WORKERS > 0 and not multiprocessing.current_process().daemon
+
+
+def get_ingest_process_pool() -> ProcessPoolExecutor:
+    global _ingest_process_pool
+    if _ingest_process_pool is None:
+        # 使用 spawn 启动子进程，避免 fork 已加载模型和多线程的 Worker 进程
+        _ingest_process_pool = ProcessPoolExecutor(
+            max_workers=settings.INGEST_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _ingest_process_pool
@@ -1,13 +1,14 @@
 import asyncio
 
+import numpy as np
 from loguru import logger
 
 # --- 核心和工具类导入 ---
 from app.core.config import settings
-from app.core.embedding_qwen import get_embeddings
-from app.core.chromadb_client import get_chroma_collection
+from app.core.embedding_qwen import embed_query
+from app.core.chromadb_client import chroma_ids_to_pg_ids, get_chroma_collection
 from app.core.reranker_qwen import rerank_documents
-from app.core.database import create_engine_and_session_for_celery
+from app.core.database import get_session_for_celery
 
 # --- 服务和仓库层导入 ---
 from app.text_chunk.service import TextChunkService
@@ -19,30 +20,31 @@ from app.text_chunk.repository import TextChunkRepository
 from app.schemas.schemas import TextChunkResponse
 
 
-async def _embed_query_for_processing(query_text: str) -> list[float]:
+async def _embed_query_for_processing(query_text: str) -> np.ndarray:
     """
     (内部辅助函数) 向量化查询文本。
     logger_instance 是从 Celery 任务传递过来的 logger。
     """
     logger.debug(f"查询处理工具：开始为查询文本生成向量嵌入: '{query_text[:50]}...'")
     try:
-        embeddings_list = await asyncio.to_thread(
-            get_embeddings,
-            [query_text],
-            instruction=settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL
+        # 与 QueryService 一致，通过 embed_query 以查询模式编码（带指令前缀，命中 LRU 缓存时不经过模型）
+        query_embedding = await asyncio.to_thread(
+            embed_query,
+            query_text,
+            task_description=settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL,
         )
-        if not embeddings_list:
+        if query_embedding is None or query_embedding.size == 0:
             logger.error(f"查询处理工具：查询文本 '{query_text}' 的向量化结果为空。")
             raise ValueError("未能为查询生成向量嵌入。")
         logger.debug("查询处理工具：查询文本向量嵌入生成完毕。")
-        return embeddings_list[0]
+        return query_embedding
     except Exception as e:
         logger.error(f"查询处理工具：查询向量化失败: {e}", exc_info=True)
         raise ValueError(f"查询向量化失败: {e}")
 
 
 async def _search_vector_db_for_processing(
-    query_embedding: list[float], initial_top_k: int,
+    query_embedding: np.ndarray, initial_top_k: int,
 ) -> list[int]:
     """
     (内部辅助函数) 在 ChromaDB 中进行初步向量召回。
@@ -63,12 +65,7 @@ async def _search_vector_db_for_processing(
         results = await asyncio.to_thread(_query_chroma_sync_internal)
         retrieved_pg_ids: list[int] = []
         if results and results.get("ids") and results["ids"][0]:
-            chroma_ids_str_list = results["ids"][0]
-            for str_id in chroma_ids_str_list:
-                try:
-                    retrieved_pg_ids.append(int(str_id))
-                except ValueError:
-                    logger.warning(f"查询处理工具：无法将 ChromaDB ID '{str_id}' 转为整数。已跳过。")
+            retrieved_pg_ids = chroma_ids_to_pg_ids(results["ids"][0])
         logger.info(f"查询处理工具：从 ChromaDB 初步召回 {len(retrieved_pg_ids)} 个文本块 ID: {retrieved_pg_ids}")
         return retrieved_pg_ids
     except Exception as e:
@@ -86,14 +83,11 @@ async def execute_query_processing_async(
     包含数据库会话管理、服务实例化、查询向量化、向量召回、
     获取文本块、Rerank精排，并返回最终的文本块列表。
     """
-    db_engine, SessionLocal = create_engine_and_session_for_celery()
+    SessionLocal = get_session_for_celery()
     logger.info(
         f"{task_id_for_log} (Async Query Logic) 开始处理查询: '{query_text[:100]}...', 目标返回精排后 top {top_k_final_reranked} 条"
     )
 
-    # text_chunk_service 变量将在 try 块内部的数据库会话上下文中被赋值
-    text_chunk_service: TextChunkService | None = None 
-
     try:
         async with SessionLocal() as db: # 管理异步数据库会话
             logger.info(
@@ -150,12 +144,14 @@ async def execute_query_processing_async(
                 reranked_scored_results: list[tuple[TextChunkResponse, float]] = await asyncio.to_thread(
                     rerank_documents, # 这是你 app.core.reranker 中的函数
                     query_text,
-                    candidate_chunks 
+                    candidate_chunks,
+                    settings.RERANKER_INSTRUCTION,
+                    top_k_final_reranked,
                 )
                 
-                # 根据传入的 top_k_final_reranked 参数，提取最终的文本块
+                # rerank_documents 已经只返回最终的 top_k_final_reranked 个文本块
                 final_reranked_chunks = [
-                    doc_response for doc_response, score in reranked_scored_results[:top_k_final_reranked]
+                    doc_response for doc_response, score in reranked_scored_results
                 ]
                 logger.info(f"{task_id_for_log} (Async Query Logic) Rerank 完成，最终选取 {len(final_reranked_chunks)} 个文本块。")
                 
@@ -179,10 +175,3 @@ async def execute_query_processing_async(
         # 对于查询处理任务，通常没有像文档处理那样的“状态”可以更新到数据库来标记错误。
         # 主要依赖 Celery 将任务标记为失败，并记录异常信息。
         raise e # 将异常向上抛给 async_to_sync，再由同步任务的 except 块处理
-    
-    finally:
-        # 最终清理
-        # 无论成功还是失败，最后都要关闭数据库引擎的连接池
-        logger.info(f"{task_id_for_log} (Async Logic) 关闭数据库连接池...")
-        await db_engine.dispose()
-        logger.info(f"{task_id_for_log} (Async Logic) 异步资源清理完毕。")
\ No newline at end of file
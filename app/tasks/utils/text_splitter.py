@@ -0,0 +1,79 @@
+from functools import lru_cache
+
+from loguru import logger
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from app.core.config import settings
+from app.core.tokenizer_cache import get_tokenizer
+from .process_pool import get_ingest_process_pool, ingest_pool_enabled
+
+
+_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+
+@lru_cache(maxsize=1)
+def _get_text_splitter() -> RecursiveCharacterTextSplitter:
+    """
+    文本分割器无状态，首次使用时创建一次，所有任务（以及进程池中的子进程）复用。
+    CHUNK_LENGTH_UNIT 为 token 时，用 Embedding 模型的 fast tokenizer（Rust 实现）计算块长度，
+    块边界与模型实际看到的 token 数一致；否则按字符数计算。
+    """
+    if settings.CHUNK_LENGTH_UNIT == "token":
+        # 切块只做不截断的 encode，与 Embedding 推理（带截断和 padding）使用不同的实例，
+        # 避免两者在不同线程中同时调用时互相修改 fast tokenizer 的截断设置
+        tokenizer = get_tokenizer(settings.EMBEDDING_MODEL_PATH, padding_side="right")
+        logger.info("文本分割器按 token 数计算块长度")
+        return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+            tokenizer,
+            chunk_size=settings.CHUNK_SIZE,  # 每个块的目标 token 数
+            chunk_overlap=settings.CHUNK_OVERLAP,  # 相邻块之间的重叠 token 数
+            separators=_SEPARATORS,
+        )
+    return RecursiveCharacterTextSplitter(
+        chunk_size=settings.CHUNK_SIZE,  # 每个块的目标字符数
+        chunk_overlap=settings.CHUNK_OVERLAP,  # 相邻块之间的重叠字符数
+        length_function=len,
+        separators=_SEPARATORS,
+    )
+
+
+def split_text(text: str) -> list[str]:
+    """使用共享的分割器把文本切分成块。"""
+    return _get_text_splitter().split_text(text)
+
+
+def _split_into_sections(text: str, section_count: int) -> list[str]:
+    """
+    把长文本按段落边界切成大致等长的若干段，每段可以独立切块。
+    找不到段落边界时直接在目标位置切开。
+    """
+    target_size = max(1, len(text) // section_count)
+    sections: list[str] = []
+    start = 0
+    while len(text) - start > target_size:
+        end = text.rfind("\n\n", start + 1, start + target_size)
+        if end == -1:
+            end = start + target_size
+        sections.append(text[start:end])
+        start = end
+    sections.append(text[start:])
+    return sections
+
+
+def split_text_parallel(text: str) -> list[str]:
+    """
+    切分文本块。超长文本先按段落边界分段，再交给进程池并行切块；
+    段与段之间不再产生重叠块，其余行为与 split_text 相同。失败时回退到单进程切分。
+    """
+    if not ingest_pool_enabled() or len(text) < settings.SPLIT_PARALLEL_MIN_CHARS:
+        return split_text(text)
+
+    try:
+        sections = _split_into_sections(text, settings.INGEST_WORKERS * 2)
+        logger.info(f"文本长度 {len(text)}，分为 {len(sections)} 段并行切块...")
+        # executor.map 按提交顺序返回结果，保证块的顺序不变
+        section_chunks = get_ingest_process_pool().map(split_text, sections)
+        return [chunk for chunks in section_chunks for chunk in chunks]
+    except Exception as e:
+        logger.warning(f"并行切块失败，回退到单进程切块: {e}")
+        return split_text(text)
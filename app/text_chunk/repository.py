@@ -1,4 +1,5 @@
-from sqlalchemy import select, delete
+import orjson
+from sqlalchemy import select, delete, func, text
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -7,6 +8,9 @@ from app.schemas.schemas import TextChunkCreate
 
 
 class TextChunkRepository:
+    # 每个请求/任务都会按会话构造一次，只持有会话引用，用 __slots__ 省去实例 __dict__
+    __slots__ = ("session",)
+
     def __init__(self, session: AsyncSession):
         self.session = session
 
@@ -38,27 +42,97 @@ class TextChunkRepository:
             await self.session.rollback()
             raise e  # 重新抛出其他未知异常
 
-    async def create_bulk(self, chunks_data: list[TextChunkCreate]) -> list[TextChunk]:
+    async def get_ids_by_sequence(self, document_id: int) -> dict[int, int]:
+        """返回文档已写入的文本块 {块序号: 文本块ID}。"""
+        result = await self.session.execute(
+            select(TextChunk.sequence_in_document, TextChunk.id).where(
+                TextChunk.source_document_id == document_id
+            )
+        )
+        return {sequence: chunk_id for sequence, chunk_id in result.all()}
+
+    async def delete_from_sequence(self, document_id: int, first_sequence: int) -> list[int]:
+        """删除文档中序号不小于 first_sequence 的文本块，返回被删除的文本块 ID。"""
+        result = await self.session.scalars(
+            delete(TextChunk)
+            .where(
+                TextChunk.source_document_id == document_id,
+                TextChunk.sequence_in_document >= first_sequence,
+            )
+            .returning(TextChunk.id)
+        )
+        deleted_ids = list(result.all())
+        await self.session.commit()
+        return deleted_ids
+
+    async def reserve_ids(self, count: int) -> list[int]:
         """
-        批量创建文本块记录。
-        这比逐个创建效率高得多。
+        从 text_chunks 的主键序列中一次性预留 count 个 ID。
+        预留后文本块的 ID 在写入数据库之前就已确定，
+        写入 PostgreSQL 和写入 ChromaDB 不再有先后依赖，可以并发进行。
+        序列值不受事务回滚影响，未使用的 ID 只会在序列中留下空洞。
         """
-        if not chunks_data:
+        if count <= 0:
             return []
+        result = await self.session.scalars(
+            text(
+                "SELECT nextval(pg_get_serial_sequence('text_chunks', 'id')) "
+                "FROM generate_series(1, :count)"
+            ),
+            {"count": count},
+        )
+        return list(result.all())
 
-        new_chunks_orm = [TextChunk(**data.model_dump()) for data in chunks_data]
+    async def insert_rows(self, rows: list[dict]) -> None:
+        """
+        用一条 INSERT ... SELECT FROM unnest(...) 语句批量写入文本块，ID 由调用方预先指定。
+        每一列作为一个数组参数传入，无论多少行都只有一次往返和固定数量的绑定参数，
+        也不构造任何 ORM 对象。created_at/updated_at 由数据库的默认值 now() 填充。
+        ID 已存在的行（任务重试时上一次尝试写入的文本块）原地覆盖，不会产生重复行。
+        """
+        if not rows:
+            return
 
-        self.session.add_all(new_chunks_orm)
+        stmt = text(
+            """
+            INSERT INTO text_chunks (
+                id, source_document_id, chunk_text, sequence_in_document,
+                metadata_json, content_hash
+            )
+            SELECT t.id, t.source_document_id, t.chunk_text, t.sequence_in_document,
+                   t.metadata_json, t.content_hash
+            FROM unnest(
+                CAST(:ids AS integer[]),
+                CAST(:source_document_ids AS integer[]),
+                CAST(:chunk_texts AS text[]),
+                CAST(:sequences AS integer[]),
+                CAST(:metadata_jsons AS jsonb[]),
+                CAST(:content_hashes AS bytea[])
+            ) AS t(id, source_document_id, chunk_text, sequence_in_document, metadata_json, content_hash)
+            ON CONFLICT (id) DO UPDATE SET
+                chunk_text = EXCLUDED.chunk_text,
+                sequence_in_document = EXCLUDED.sequence_in_document,
+                metadata_json = EXCLUDED.metadata_json,
+                content_hash = EXCLUDED.content_hash,
+                updated_at = now()
+            """
+        )
+        params = {
+            "ids": [row["id"] for row in rows],
+            "source_document_ids": [row["source_document_id"] for row in rows],
+            "chunk_texts": [row["chunk_text"] for row in rows],
+            "sequences": [row["sequence_in_document"] for row in rows],
+            "metadata_jsons": [
+                None
+                if row.get("metadata_json") is None
+                else orjson.dumps(row["metadata_json"]).decode()
+                for row in rows
+            ],
+            "content_hashes": [row.get("content_hash") for row in rows],
+        }
         try:
+            await self.session.execute(stmt, params)
             await self.session.commit()
-            # 批量 refresh 可能比较麻烦或效率不高，通常在批量创建后，
-            # 如果需要立即使用这些对象的数据库生成属性（如ID），
-            # 可以选择不 refresh，或者如果数量不多，可以逐个 refresh。
-            # 对于 RAG 流程，通常创建后会立即用于向量化，ID 是关键。
-            # SQLAlchemy 2.0 的 add_all 配合 commit 后，对象会自动填充 ID。
-            # 如果需要其他数据库默认值或触发器生成的值，才需要 refresh。
-            # 我们这里假设 ID 会被自动填充。
-            return new_chunks_orm
         except IntegrityError as e:
             await self.session.rollback()
             raise ValueError(
@@ -75,6 +149,23 @@ class TextChunkRepository:
         result = await self.session.scalars(query)
         return list(result.all())
 
+    async def get_ids_by_content_hashes(
+        self, content_hashes: list[bytes]
+    ) -> dict[bytes, int]:
+        """
+        查找内容哈希相同的已有文本块，返回 {内容哈希: 文本块ID}。
+        同一哈希对应多个文本块时任取其一（取 ID 最小者）。
+        """
+        if not content_hashes:
+            return {}
+        query = (
+            select(TextChunk.content_hash, func.min(TextChunk.id))
+            .where(TextChunk.content_hash.in_(content_hashes))
+            .group_by(TextChunk.content_hash)
+        )
+        result = await self.session.execute(query)
+        return {content_hash: chunk_id for content_hash, chunk_id in result.all()}
+
     async def get_by_document_id(
         self, document_id: int, limit: int = 1000, offset: int = 0
     ) -> list[TextChunk]:
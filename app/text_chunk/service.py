@@ -5,6 +5,8 @@ from app.schemas.schemas import TextChunkCreate, TextChunkResponse
 
 
 class TextChunkService:
+    __slots__ = ("repository",)
+
     def __init__(self, repository: TextChunkRepository):
         """Service layer for TextChunk operations."""
 
@@ -14,11 +16,34 @@ class TextChunkService:
         new_chunk = await self.repository.create(data)
         return TextChunkResponse.model_validate(new_chunk)
 
-    async def add_chunks_for_document(
-        self, chunks_data: list[TextChunkCreate]
-    ) -> list[TextChunkResponse]:
-        new_chunks = await self.repository.create_bulk(chunks_data)
-        return [TextChunkResponse.model_validate(chunk) for chunk in new_chunks]
+    async def assign_chunk_ids(self, document_id: int, count: int) -> list[int]:
+        """
+        为文档的第 0..count-1 个文本块分配 ID：(文档, 序号) 已有文本块的沿用其 ID，
+        其余从序列中预留。任务重试时同一文本块始终得到同一个 ID。
+        """
+        existing_ids = await self.repository.get_ids_by_sequence(document_id)
+        missing_sequences = [i for i in range(count) if i not in existing_ids]
+        new_ids = iter(await self.repository.reserve_ids(len(missing_sequences)))
+        return [
+            existing_ids[i] if i in existing_ids else next(new_ids) for i in range(count)
+        ]
+
+    async def delete_chunks_from_sequence(
+        self, document_id: int, first_sequence: int
+    ) -> list[int]:
+        """删除上一次尝试留下的、超出本次块数的文本块，返回被删除的 ID。"""
+        return await self.repository.delete_from_sequence(document_id, first_sequence)
+
+    async def add_chunk_rows_for_document(self, chunk_rows: list[dict]) -> None:
+        """写入已通过 assign_chunk_ids 分配好 ID 的文本块列字典。"""
+        await self.repository.insert_rows(chunk_rows)
+
+    async def find_existing_chunk_ids_by_hash(
+        self, content_hashes: list[bytes]
+    ) -> dict[bytes, int]:
+        return await self.repository.get_ids_by_content_hashes(
+            list(set(content_hashes))
+        )
 
     async def get_chunks_by_ids(self, chunk_ids: list[int]) -> list[TextChunkResponse]:
         if not chunk_ids:
@@ -0,0 +1,120 @@
+"""
+将 Embedding / Reranker 模型导出为 ONNX，分别供 EMBEDDING_ONNX_PATH / RERANKER_ONNX_PATH 使用。
+
+    uv run python -m app.utils.export_onnx --output app/embeddings/qwen3-embedding.onnx [--int8]
+    uv run python -m app.utils.export_onnx --model reranker --output app/embeddings/qwen3-reranker.onnx [--int8]
+
+导出的 Embedding 图内已包含最后一个 token 的池化和 L2 归一化，输出形状为 (batch, hidden)；
+Reranker 图内已包含最后一个位置 "yes"/"no" 两个 logits 的 sigmoid 打分，输出形状为 (batch,)。
+"""
+
+import argparse
+from pathlib import Path
+
+import torch
+import torch.nn.functional as F
+from loguru import logger
+from transformers import AutoModel, AutoModelForCausalLM
+
+from app.core.embedding_qwen import EMBEDDING_MODEL_PATH, last_token_pool
+from app.core.reranker_qwen import RERANKER_MODEL_PATH
+from app.core.tokenizer_cache import get_tokenizer
+
+
+class _PooledEmbedding(torch.nn.Module):
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        hidden = self.model(
+            input_ids=input_ids, attention_mask=attention_mask
+        ).last_hidden_state
+        return F.normalize(last_token_pool(hidden, attention_mask).float(), p=2, dim=1)
+
+
+class _YesNoScore(torch.nn.Module):
+    def __init__(self, model: torch.nn.Module, token_true_id: int, token_false_id: int):
+        super().__init__()
+        self.model = model
+        self.token_true_id = token_true_id
+        self.token_false_id = token_false_id
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        logits = self.model(
+            input_ids=input_ids, attention_mask=attention_mask, logits_to_keep=1
+        ).logits[:, -1, :]
+        return torch.sigmoid(
+            logits[:, self.token_true_id].float() - logits[:, self.token_false_id].float()
+        )
+
+
+def _export(
+    module: torch.nn.Module, output_path: Path, output_name: str, int8: bool
+) -> Path:
+    """导出 float32 的 ONNX 模型；int8=True 时额外生成动态量化版本并返回其路径。"""
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    dummy_ids = torch.ones((2, 16), dtype=torch.long)
+    dummy_mask = torch.ones((2, 16), dtype=torch.long)
+    with torch.inference_mode():
+        torch.onnx.export(
+            module,
+            (dummy_ids, dummy_mask),
+            str(output_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=[output_name],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                output_name: {0: "batch"},
+            },
+            opset_version=17,
+        )
+    logger.info(f"模型已导出到 {output_path}")
+
+    if not int8:
+        return output_path
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    int8_path = output_path.with_name(f"{output_path.stem}_int8{output_path.suffix}")
+    quantize_dynamic(str(output_path), str(int8_path), weight_type=QuantType.QInt8)
+    logger.info(f"int8 动态量化模型已导出到 {int8_path}")
+    return int8_path
+
+
+def export_embedding_model(output_path: Path, int8: bool = False) -> Path:
+    """导出 Embedding 模型，返回供 EMBEDDING_ONNX_PATH 使用的文件路径。"""
+    model = AutoModel.from_pretrained(
+        EMBEDDING_MODEL_PATH, torch_dtype=torch.float32, attn_implementation="sdpa"
+    ).eval()
+    return _export(_PooledEmbedding(model), output_path, "embeddings", int8)
+
+
+def export_reranker_model(output_path: Path, int8: bool = False) -> Path:
+    """导出 Reranker 模型，返回供 RERANKER_ONNX_PATH 使用的文件路径。"""
+    tokenizer = get_tokenizer(RERANKER_MODEL_PATH, padding_side="left")
+    model = AutoModelForCausalLM.from_pretrained(
+        RERANKER_MODEL_PATH, torch_dtype=torch.float32, attn_implementation="sdpa"
+    ).eval()
+    module = _YesNoScore(
+        model,
+        tokenizer.convert_tokens_to_ids("yes"),
+        tokenizer.convert_tokens_to_ids("no"),
+    )
+    return _export(module, output_path, "scores", int8)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出 Embedding / Reranker 模型为 ONNX")
+    parser.add_argument(
+        "--model", choices=["embedding", "reranker"], default="embedding"
+    )
+    parser.add_argument("--output", type=Path, required=True)
+    parser.add_argument("--int8", action="store_true", help="额外生成动态 int8 量化模型")
+    args = parser.parse_args()
+    if args.model == "reranker":
+        export_reranker_model(args.output, int8=args.int8)
+    else:
+        export_embedding_model(args.output, int8=args.int8)
@@ -1,7 +1,78 @@
+import asyncio
 import os
 import subprocess
 import sys
 
+import asyncpg
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from loguru import logger
+
+from app.core.config import settings
+
+# Arbitrary application-wide key for pg_advisory_lock, so that concurrently
+# starting workers run the upgrade one at a time.
+MIGRATION_ADVISORY_LOCK_ID = 7_305_218_814
+
+
+def _get_head_revision() -> str | None:
+    """Reads the head revision from the migration scripts without loading env.py."""
+    return ScriptDirectory.from_config(Config("alembic.ini")).get_current_head()
+
+
+async def _get_database_revision(conn: asyncpg.Connection) -> str | None:
+    try:
+        return await conn.fetchval("SELECT version_num FROM alembic_version")
+    except asyncpg.UndefinedTableError:
+        # Fresh database, no migration has ever been applied
+        return None
+
+
+def _upgrade_to_head():
+    # Ensure the current directory is in the Python path
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, current_dir)
+
+    # Use sys.executable to run the Alembic module
+    result = subprocess.run(
+        [sys.executable, "-m", "alembic", "upgrade", "head"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # Print the output if there's any
+    if result.stdout:
+        logger.info(f"Migration output: {result.stdout}")
+
+
+async def _run_migrations_if_needed():
+    head_revision = _get_head_revision()
+    conn = await asyncpg.connect(
+        host=settings.POSTGRES_HOST,
+        port=int(settings.POSTGRES_PORT),
+        user=settings.POSTGRES_USER,
+        password=settings.POSTGRES_PASSWORD,
+        database=settings.POSTGRES_DB,
+    )
+    try:
+        if await _get_database_revision(conn) == head_revision:
+            logger.info(f"Database already at head revision {head_revision}, skipping migrations.")
+            return
+
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_ADVISORY_LOCK_ID)
+        try:
+            # Another worker may have finished the upgrade while we waited for the lock
+            if await _get_database_revision(conn) == head_revision:
+                logger.info(f"Database upgraded to {head_revision} by another process.")
+                return
+            await asyncio.to_thread(_upgrade_to_head)
+            logger.info("Migrations completed successfully!")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_ADVISORY_LOCK_ID)
+    finally:
+        await conn.close()
+
 
 def run_migrations():
     """
@@ -9,31 +80,20 @@ def run_migrations():
 
     This method is more compatible with environments like Vercel where direct
     command execution might be restricted.
+
+    The database revision is compared with the head revision of the migration
+    scripts first, so a worker starting against an up-to-date database skips the
+    Alembic subprocess entirely. Upgrades are serialized with a PostgreSQL
+    advisory lock. Must be called outside a running event loop (e.g. via
+    asyncio.to_thread).
     """
     try:
-        # Ensure the current directory is in the Python path
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        sys.path.insert(0, current_dir)
-
-        # Use sys.executable to run the Alembic module
-        result = subprocess.run(
-            [sys.executable, "-m", "alembic", "upgrade", "head"],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-
-        # Print the output if there's any
-        if result.stdout:
-            print("Migration output:", result.stdout)
-
-        print("Migrations completed successfully!")
-
+        asyncio.run(_run_migrations_if_needed())
     except subprocess.CalledProcessError as e:
-        print(f"Migration failed. Error: {e}")
-        print("Standard output:", e.stdout)
-        print("Standard error:", e.stderr)
+        logger.error(f"Migration failed. Error: {e}")
+        logger.error(f"Standard output: {e.stdout}")
+        logger.error(f"Standard error: {e.stderr}")
         raise
     except Exception as e:
-        print(f"An error occurred while running migrations: {e}")
-        raise
\ No newline at end of file
+        logger.error(f"An error occurred while running migrations: {e}")
+        raise